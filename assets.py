@@ -0,0 +1,139 @@
+"""Finds the game's portraits and decodes them ahead of use
+
+The asset root is resolved once, and the first lookup indexes which poets
+from get_all_poets() have a portrait there, and whether atlas.py has
+packed them into an atlas. Portraits asked for with preload() are decoded
+on a small thread pool, as pygame lets other threads run while an image
+decodes, so the main thread can carry on with the handshake. portrait()
+then only waits for a decode still in flight. With an atlas, preload()
+decodes that once instead of the portraits one by one, and only loads
+the files of poets added since it was built.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+from atlas import Atlas, ATLAS_IMAGE, ATLAS_INDEX, read_index
+from configs import get_game_root
+from poetry import get_all_poets
+
+PORTRAIT_EXTENSION = ".jpg"
+LOAD_WORKERS = 2  # One per player
+PYGAME_MODULES = [pygame.display, pygame.font]  # All the game draws with
+
+
+def init_pygame():
+    """Starts only the pygame modules the game uses, unlike pygame.init()
+
+    :return: Seconds it took
+    """
+    start = time.perf_counter()
+    for module in PYGAME_MODULES:
+        module.init()
+    return time.perf_counter() - start
+
+
+class AssetManager:
+    """Index of the portraits on disk, decoded in the background on request
+
+    :param root: Folder the portraits are in. The game root if None
+    """
+
+    def __init__(self, root=None, workers=LOAD_WORKERS):
+        self.root = root if root else get_game_root()
+        self.workers = workers
+        self.index = None
+        self.has_atlas = None
+        self.atlas_poets = set()  # Lowercase poets the atlas has
+        self.pool = None
+        self.loading = {}  # Lowercase poet: Future of the decoded portrait
+        self.atlas = None  # Future of the loaded Atlas
+        self.wait_time = 0  # Seconds the caller spent blocked on decodes
+
+    def get_index(self):
+        """Returns {lowercase poet: path} of the portraits that exist"""
+        if isinstance(self.index, type(None)):
+            try:
+                names = os.listdir(self.root)
+            except OSError:
+                names = []
+            files = {name.lower(): name for name in names}
+            self.has_atlas = ATLAS_IMAGE in names and ATLAS_INDEX in names
+            if self.has_atlas:
+                size, cells = read_index(os.path.join(self.root, ATLAS_INDEX))
+                self.atlas_poets = set(poet for poet, size in cells)
+            self.index = {}
+            for poet in get_all_poets():
+                name = files.get(poet.lower() + PORTRAIT_EXTENSION)
+                if name:
+                    self.index[poet.lower()] = os.path.join(self.root, name)
+        return self.index
+
+    def missing(self):
+        """Returns the poets with no portrait"""
+        index = self.get_index()
+        return [poet for poet in get_all_poets() if poet.lower() not in index]
+
+    def submit(self, function, *args):
+        """Runs function on the thread pool and returns its Future"""
+        if isinstance(self.pool, type(None)):
+            self.pool = ThreadPoolExecutor(self.workers, "asset-loader")
+        return self.pool.submit(function, *args)
+
+    def preload(self, poets):
+        """Starts decoding the portraits of poets on the thread pool
+
+        Poets without a portrait are left for portrait() to complain about.
+        """
+        self.get_index()
+        if self.has_atlas and isinstance(self.atlas, type(None)):
+            self.atlas = self.submit(Atlas.load, self.root)
+        for poet in poets:
+            if poet.lower() not in self.atlas_poets:
+                self.load(poet)
+
+    def load(self, poet):
+        """Starts decoding poet's portrait file, if it has one"""
+        poet = poet.lower()
+        index = self.get_index()
+        if poet not in self.loading and poet in index:
+            self.loading[poet] = self.submit(pygame.image.load, index[poet])
+
+    def get_atlas(self):
+        """Returns the Atlas, in the display's format if there is one yet,
+        or None if none has been built"""
+        self.get_index()
+        if not self.has_atlas:
+            return None
+        start = time.perf_counter()
+        self.preload([])
+        atlas = self.atlas.result()
+        atlas.convert()
+        self.wait_time += time.perf_counter() - start
+        return atlas
+
+    def portrait(self, poet):
+        """Returns poet's decoded, unconverted portrait, waiting if needed
+
+        Each call decodes or waits again, so callers keep what they get.
+        """
+        start = time.perf_counter()
+        self.load(poet)
+        future = self.loading.pop(poet.lower(), None)
+        if isinstance(future, type(None)):
+            raise FileNotFoundError("No portrait for " + poet + " in " +
+                                    self.root)
+        try:
+            return future.result()
+        finally:
+            self.wait_time += time.perf_counter() - start
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+asset_manager = AssetManager()
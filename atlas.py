@@ -0,0 +1,176 @@
+"""Packs every poet's portrait into one image, at several sizes
+
+Building the atlas is an offline step. Every portrait listed by
+get_all_poets() is scaled to each of BUCKETS and shelf packed into a
+single image, and an index file gives where each (poet, size) cell is.
+At run time the image is decoded once and a portrait is a subsurface of
+it: the cell of the right size if there is one, or the next bigger cell
+scaled down. Build with:
+
+    python atlas.py [root]
+
+which writes ATLAS_IMAGE and ATLAS_INDEX into the game root, or root.
+"""
+import os
+import struct
+import sys
+
+import pygame
+
+from poetry import get_all_poets
+
+ATLAS_IMAGE = "portraits.jpg"  # Cells line up with JPEG blocks, so none bleed
+ATLAS_INDEX = "portraits.idx"
+BUCKETS = [256, 128, 64, 32]  # Portrait sizes packed, biggest first
+ATLAS_WIDTH = 2048
+
+MAGIC = b"PPAT"
+VERSION = 1
+HEADER = struct.Struct("!4sBHHH")  # magic, version, width, height, cells
+CELL = struct.Struct("!32sHHH")  # poet, size, x, y
+
+
+def pack(sizes, width=ATLAS_WIDTH):
+    """Shelf packs squares of sizes into rows of width
+
+    :param sizes: Sizes in the order to place them, tallest first
+    :return: ([(x, y) of each square], height used)
+    """
+    places = []
+    x = y = shelf = 0
+    for size in sizes:
+        if x + size > width:
+            x = 0
+            y += shelf
+            shelf = 0
+        places.append((x, y))
+        x += size
+        shelf = max(shelf, size)
+    return places, y + shelf
+
+
+def build(assets, buckets=BUCKETS, width=ATLAS_WIDTH):
+    """Packs the portraits assets has into one surface
+
+    :return: (surface, {(lowercase poet, size): (x, y)})
+    """
+    files = assets.get_index()
+    poets = [poet.lower() for poet in get_all_poets() if poet.lower() in files]
+    # From the files, even where an atlas has been built before
+    loading = {poet: assets.submit(pygame.image.load, files[poet])
+               for poet in poets}
+    sources = {poet: loading[poet].result() for poet in poets}
+    cells = [(poet, size) for size in sorted(buckets, reverse=True)
+             for poet in poets]
+    places, height = pack([size for poet, size in cells], width)
+    image = pygame.Surface([width, max(height, 1)])
+    index = {}
+    for (poet, size), place in zip(cells, places):
+        source = sources[poet]
+        if source.get_bitsize() < 24:
+            # smoothscale needs 24 or 32 bit pixels
+            source = pygame.Surface(source.get_size())
+            source.blit(sources[poet], [0, 0])
+        image.blit(pygame.transform.smoothscale(source, [size, size]), place)
+        index[(poet, size)] = place
+    return image, index
+
+
+def write_index(path, width, height, index):
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, width, height, len(index)))
+        for (poet, size), (x, y) in index.items():
+            file.write(CELL.pack(poet.encode(), size, x, y))
+
+
+def read_index(path):
+    """Returns ((width, height), {(lowercase poet, size): (x, y)})"""
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, version, width, height, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise Exception("Not an atlas index: " + path)
+    if version != VERSION:
+        raise Exception("Unsupported atlas version: " + str(version))
+    index = {}
+    for i in range(0, count):
+        poet, size, x, y = CELL.unpack_from(data, HEADER.size + i * CELL.size)
+        index[(poet.rstrip(b"\0").decode(), size)] = (x, y)
+    return (width, height), index
+
+
+class Atlas:
+    """A loaded atlas, handing out portraits as subsurfaces of one image"""
+
+    def __init__(self, image, index):
+        self.image = image
+        self.index = index
+        self.sizes = {}  # Lowercase poet: its cell sizes, smallest first
+        for poet, size in index:
+            self.sizes.setdefault(poet, []).append(size)
+        for sizes in self.sizes.values():
+            sizes.sort()
+        self.converted = False
+
+    @classmethod
+    def load(cls, root):
+        """Loads the atlas built into root"""
+        size, index = read_index(os.path.join(root, ATLAS_INDEX))
+        return cls(pygame.image.load(os.path.join(root, ATLAS_IMAGE)), index)
+
+    def convert(self):
+        """Converts the image to the display's format, once there is one"""
+        if not self.converted and pygame.display.get_surface() is not None:
+            self.image = self.image.convert()
+            self.converted = True
+
+    def has(self, poet):
+        return poet.lower() in self.sizes
+
+    def portrait(self, poet, size):
+        """Returns poet's portrait at size
+
+        A cell of that size is returned as a subsurface, sharing the
+        atlas's pixels. Any other size is scaled from the next bigger cell.
+        """
+        poet = poet.lower()
+        sizes = self.sizes[poet]
+        cell = sizes[-1]
+        for bucket in sizes:
+            if bucket >= size:
+                cell = bucket
+                break
+        x, y = self.index[(poet, cell)]
+        image = self.image.subsurface([x, y, cell, cell])
+        if cell == size:
+            return image
+        return pygame.transform.scale(image, [size, size])
+
+    def memory(self):
+        """Returns the bytes of pixels held"""
+        return self.image.get_pitch() * self.image.get_height()
+
+
+def save(root, image, index):
+    pygame.image.save(image, os.path.join(root, ATLAS_IMAGE))
+    write_index(os.path.join(root, ATLAS_INDEX), image.get_width(),
+                image.get_height(), index)
+
+
+def main(root=None):
+    from assets import AssetManager  # assets imports this module
+
+    assets = AssetManager(root)
+    missing = assets.missing()
+    if missing:
+        print("No portrait for " + ", ".join(missing))
+    image, index = build(assets)
+    assets.close()
+    save(assets.root, image, index)
+    print("Packed " + str(len(index)) + " portraits into " +
+          str(image.get_width()) + "x" + str(image.get_height()) + " in " +
+          os.path.join(assets.root, ATLAS_IMAGE))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -0,0 +1,712 @@
+"""Microbenchmarks for the game's hot paths
+
+Run with:
+
+    python bench.py [--json] [--repeat N] [benchmark ...]
+
+Every benchmark is seeded, so runs on one machine are comparable. With
+--repeat, each result is the median of N runs. --json prints the results
+with the interpreter, platform and git commit they were taken on, for
+keeping a history to compare against.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # Keep stdout JSON
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+from bots import ChaseBot
+from lockstep import LockstepSession, unpack_controls
+from net import LossySocket, NetLoop, TcpTransport, UdpTransport, \
+    RESEND_TIME, SEND_RATE
+from physics import Body, World, TICK_RATE
+from physics_np import ArrayWorld, numpy
+from poetry import get_all_poets
+from protocol import Encoder, Message, decode, SIZES, STATE as STATE_KIND, \
+    INPUT, WIN
+from snapshots import SnapshotBuffer, INTERP_DELAY
+from stats import percentiles
+
+BUFFER_SIZE = 32
+BUFFER_PART = 8
+THROW_SPEED = 3  # Most sideways speed the bouncing balls are thrown in at
+
+STATE = ([812.5, 643.25], [-1.5, 3.75])
+
+
+def is_number(num):
+    """Checks if num is a number"""
+    try:
+        float(num)
+    except ValueError:
+        return False
+    return True
+
+
+def format_data(*data):
+    """The original 32 byte ASCII encoding, kept as a baseline"""
+    string = ""
+    for obj in data:
+        if isinstance(obj, int) or isinstance(obj, float):
+            string += f'{obj:.{BUFFER_PART}f}'[:BUFFER_PART]
+        else:
+            if len(obj) > BUFFER_PART:
+                string += obj[:BUFFER_PART]
+            else:
+                string += obj.ljust(BUFFER_PART, "~")
+    return string
+
+
+def unformat_data(data):
+    """The original 32 byte ASCII decoding, kept as a baseline"""
+    if len(data) < BUFFER_SIZE:
+        return None  # Not all data received
+    data_list = []
+    while len(data) >= BUFFER_PART:
+        part = data[:BUFFER_PART]
+        if not is_number(part):
+            data_list.append(part.rstrip("~"))
+        else:
+            data_list.append(float(part))
+        if len(data) > BUFFER_PART:
+            data = data[BUFFER_PART:]
+        else:
+            break
+    return data_list
+
+
+def ops_per_sec(func, number):
+    return number / min(timeit.repeat(func, number=number, repeat=5))
+
+
+def bench_codec(number=100000):
+    """Returns encode/decode ops per second for the ascii and binary codecs"""
+    pos, vel = STATE
+    encoder = Encoder()
+    message = Message()
+    ascii_data = format_data(*pos, *vel).encode()
+    binary_data = bytes(encoder.state(pos, vel))
+    return {
+        "ascii encode ops/s": ops_per_sec(
+            lambda: format_data(*pos, *vel).encode(), number),
+        "ascii decode ops/s": ops_per_sec(
+            lambda: unformat_data(ascii_data.decode()), number),
+        "binary encode ops/s": ops_per_sec(
+            lambda: encoder.state(pos, vel), number),
+        "binary decode ops/s": ops_per_sec(
+            lambda: decode(binary_data, message), number),
+    }
+
+
+def tcp_pair():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    client = socket.create_connection(listener.getsockname())
+    server = listener.accept()[0]
+    listener.close()
+    return client, server
+
+
+def udp_pair():
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(("127.0.0.1", 0))
+    server.bind(("127.0.0.1", 0))
+    return client, server
+
+
+def bench_transport(kind, loss=.05, latency=.03, jitter=.01, seconds=3,
+                    rate=100):
+    """Streams states through a simulated lossy link
+
+    Each state carries its send time, so the receiver can report how old
+    the state it is displaying is when it arrives (in ms).
+    """
+    if kind == "tcp":
+        client, server = tcp_pair()
+        sender = TcpTransport(LossySocket(client, loss, latency, jitter, 1))
+        server.settimeout(RESEND_TIME)
+        receiver = TcpTransport(server)
+    else:
+        client, server = udp_pair()
+        sender = UdpTransport(LossySocket(client, loss, latency, jitter, 1),
+                              server.getsockname())
+        receiver = UdpTransport(server, client.getsockname())
+
+    start = time.monotonic()
+
+    def send():
+        while time.monotonic() - start < seconds:
+            sender.send_state([(time.monotonic() - start) * 1000, 0], [0, 0])
+            time.sleep(1 / rate)
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    ages = []
+    while time.monotonic() - start < seconds + latency + .5:
+        try:
+            if not receiver.poll():
+                break
+        except socket.timeout:
+            continue
+        state = receiver.take_state()
+        if not isinstance(state, type(None)):
+            ages.append((time.monotonic() - start) * 1000 - state.values[0])
+    thread.join()
+    sender.close()
+    receiver.close()
+    age, age_95, age_max = percentiles(ages)
+    return {
+        kind + " states received": len(ages),
+        kind + " age p50 ms": age,
+        kind + " age p95 ms": age_95,
+        kind + " age max ms": age_max,
+    }
+
+
+def bench_bandwidth(seconds=10, seed=1):
+    """Returns bytes per second sent by state and by lockstep input mode
+
+    Lockstep input is driven by random key changes a few times a second.
+    """
+    rng = random.Random(seed)
+    world = World([1600, 900])
+    host = Body("Thomas Hardy")
+    join = Body("William Blake")
+    world.add(host)
+    world.add(join)
+    host.reset(True, True)
+    join.reset(False, False)
+    session = LockstepSession(world, host, join, host)
+    sent = 0
+    frames_per_sec = int(1 / session.step_secs)
+    for frame in range(0, seconds * frames_per_sec):
+        if rng.random() < 4 / frames_per_sec:
+            session.set_local_controls(
+                rng.choice([set(), {"left"}, {"right"}, {"right", "jump"}]),
+                rng.choice([set(), {"jump"}]))
+        session.add_remote_input(frame, 0)
+        session.run(1)
+        sent += len(session.take_outgoing()) * SIZES[INPUT]
+    return {
+        "state mode bytes/s": SEND_RATE * SIZES[STATE_KIND],
+        "lockstep mode bytes/s": sent / seconds,
+    }
+
+
+def bench_send_rate(seconds=30, fps=60, seed=1):
+    """Returns the states sent per second, and how far from the truth the
+    peer shows the ball (in pixels), adaptively and at a fixed SEND_RATE
+
+    The run is in three phases: the balls thrown in from the top and left
+    bouncing, then settled on the ground untouched, then two ChaseBots
+    fighting. Time is simulated, and the peer plays the states back as
+    they are sent, against where the ball was INTERP_DELAY before.
+    """
+    rng = random.Random(seed)
+    world = World([1600, 900])
+    bodies = [Body("Thomas Hardy"), Body("William Blake")]
+    for body in bodies:
+        world.add(body)
+
+    def reset(thrown):
+        bodies[0].reset(True)
+        bodies[1].reset(False)
+        if thrown:
+            for body in bodies:
+                body.pos[1] = body.radius * 2
+                body.prev_pos = list(body.pos)
+                body.vel[0] = rng.uniform(-THROW_SPEED, THROW_SPEED)
+
+    reset(True)
+    bots = [ChaseBot(random.Random(rng.random())) for body in bodies]
+    client, server = udp_pair()
+    loop = NetLoop(UdpTransport(client, server.getsockname()))
+    views = [SnapshotBuffer(), SnapshotBuffer()]  # Adaptive, fixed
+    history = []
+    delay = int(round(INTERP_DELAY * fps))
+    frames = seconds * fps
+    phases = ["bouncing", "idle", "duel"]
+    sent = [[0, 0] for phase in phases]  # Adaptive then fixed
+    errors = [[[], []] for phase in phases]
+    next_send = 0
+    phase = 0
+    for frame in range(0, frames):
+        now = frame / fps
+        last_phase, phase = phase, frame * len(phases) // frames
+        if phase == 1 and last_phase == 0:
+            reset(False)  # Still rolling, as nothing slows a ball sideways
+        for i in range(0, 2):
+            if phase == 2:
+                bodies[i].set_controls(*unpack_controls(
+                    bots[i].controls(bodies[i], bodies[1 - i])))
+        for step in range(0, TICK_RATE // fps):
+            if world.step(1 / TICK_RATE) or len(world.bodies) < 2:
+                for body in bodies:
+                    if body not in world.bodies:
+                        world.add(body)
+                reset(phase == 0)
+        me = bodies[0]
+        close = math.dist(me.pos, bodies[1].pos) < \
+            (me.radius + bodies[1].radius) * 3
+        loop.set_state(me.pos, me.vel, world.grid_scale, close, now)
+        history.append(list(me.pos))
+        if now >= next_send:
+            if loop.flush(now):
+                # A ball at rest is sent as the state before, again
+                views[0].add(now, *loop.sent[0:2])
+                sent[phase][0] += 1
+            next_send = now + loop.interval
+        views[1].add(now, me.pos, me.vel)
+        sent[phase][1] += 1
+        if frame >= delay:
+            for i in range(0, 2):
+                shown = views[i].sample(now, world.grid_scale)[0]
+                errors[phase][i].append(math.dist(shown,
+                                                  history[frame - delay]))
+    loop.stop()
+    server.close()
+    results = {}
+    for phase, name in enumerate(phases):
+        for i, mode in enumerate(["adaptive", "fixed"]):
+            results[name + " " + mode + " states/s"] = \
+                sent[phase][i] / (seconds / len(phases))
+            results[name + " " + mode + " error p95 px"] = \
+                percentiles(errors[phase][i])[1]
+    return results
+
+
+def make_world(bodies, seed=1, array=False):
+    """Returns an arena with bodies balls of random poets scattered over it
+
+    :param array: Use the NumPy backend
+    """
+    rng = random.Random(seed)
+    poets = get_all_poets()
+    if array:
+        world = ArrayWorld([1600, 900])
+    else:
+        world = World([1600, 900])
+    for i in range(0, bodies):
+        if array:
+            body = world.spawn(rng.choice(poets), rng.random() < .5)
+        else:
+            body = Body(rng.choice(poets))
+            world.add(body)
+            body.reset(rng.random() < .5)
+        if bodies > 2:
+            body.radius = max(2, int(body.radius / (bodies / 2) ** .5))
+            body.pos = [rng.uniform(0, 1600), rng.uniform(0, 900)]
+            body.prev_pos = list(body.pos)
+        body.vel = [rng.uniform(-2, 2), rng.uniform(-2, 2)]
+    return world
+
+
+def bench_physics(counts=(2, 100, 10000), seconds=1):
+    """Returns fixed steps per second for arenas of each size in counts
+
+    The NumPy backend is run too when NumPy is installed.
+    """
+    backends = [("scalar", False)]
+    if not isinstance(numpy, type(None)):
+        backends.append(("numpy", True))
+    results = {}
+    for count in counts:
+        for name, array in backends:
+            world = make_world(count, array=array)
+            steps = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                world.step(1 / 240)
+                steps += 1
+            results[name + " " + str(count) + " bodies steps/s"] = steps / (
+                    time.perf_counter() - start)
+    return results
+
+
+def bench_rtt(kind, count=2000):
+    """Returns loopback round trip times of a state echoed back, in us
+
+    The echo runs on its own thread, as the other player's NetLoop would,
+    so this includes waking it up as well as the codec and the sockets.
+    """
+    if kind == "tcp":
+        client, server = tcp_pair()
+        sender = TcpTransport(client)
+        echo = TcpTransport(server)
+    else:
+        client, server = udp_pair()
+        sender = UdpTransport(client, server.getsockname())
+        echo = UdpTransport(server, client.getsockname())
+
+    def run_echo():
+        try:
+            while echo.poll():
+                state = echo.take_state()
+                if not isinstance(state, type(None)):
+                    echo.send_state(state.values[:2], state.values[2:])
+        except OSError:
+            pass  # Closed
+
+    thread = threading.Thread(target=run_echo)
+    thread.start()
+    times = []
+    for i in range(0, count):
+        start = time.perf_counter()
+        sender.send_state([i, 0], [0, 0])
+        state = None
+        while isinstance(state, type(None)) or state.values[0] != i:
+            if not sender.poll():
+                break
+            state = sender.take_state()
+        times.append((time.perf_counter() - start) * 1000000)
+    sender.close()
+    echo.close()
+    thread.join()
+    rtt, rtt_95, rtt_max = percentiles(times)
+    return {
+        kind + " rtt p50 us": rtt,
+        kind + " rtt p95 us": rtt_95,
+    }
+
+
+def bench_render(frames=300, seed=1):
+    """Returns the time taken to draw a frame of a local match, in ms
+
+    Runs under SDL's dummy video driver, so no window is opened. Blank
+    portraits stand in for any that are missing from the game folder.
+    """
+    if isinstance(pygame, type(None)):
+        return {}
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import main
+    from renderer import DirtyRenderer
+    from sprites import sprite_cache
+
+    pygame.init()
+    display = pygame.display.set_mode(main.RESOLUTION)
+    poets = ["Wilfred Owen", "William Blake"]  # Gas and visions
+    for poet in poets:
+        try:
+            sprite_cache.get_source(poet)
+        except FileNotFoundError:
+            sprite_cache.sources[poet.lower()] = pygame.Surface([256, 256])
+    sprite_cache.clear()
+
+    random.seed(seed)  # Gas is drawn from the global generator
+    rng = random.Random(seed)
+    game = main.Game(main.Player(poets[0]), main.Player(poets[1]), True)
+    renderer = DirtyRenderer(display)
+    times = []
+    for frame in range(0, frames):
+        for player in game.world.bodies:
+            if rng.random() < .05:
+                player.set_controls(
+                    rng.choice([set(), {"left"}, {"right"}]),
+                    rng.choice([set(), {"jump"}]))
+        game.update(1 / 60)
+        start = time.perf_counter()
+        renderer.clear()
+        renderer.add(game.render(display))
+        renderer.present()
+        times.append((time.perf_counter() - start) * 1000)
+    pygame.quit()
+    draw, draw_95, draw_max = percentiles(times)
+    return {
+        "render frame p50 ms": draw,
+        "render frame p95 ms": draw_95,
+    }
+
+
+class LoopbackLink:
+    """Stands in for a NetLoop, handing what is sent straight to its peer"""
+
+    closed = False
+
+    def __init__(self):
+        self.peer = None
+        self.state = None
+        self.events = []
+
+    def set_state(self, pos, vel, grid_scale, urgent=False, now=None):
+        self.peer.state = (time.monotonic(), list(pos), list(vel))
+
+    def send_win(self):
+        self.peer.events.append(WIN)
+
+    def take_state(self):
+        state = self.state
+        self.state = None
+        return state
+
+    def take_events(self):
+        events = self.events
+        self.events = []
+        return events
+
+
+def bench_replay(frames=3600, seed=1):
+    """Returns how many frames of a recorded state mode match replay
+    differently, and how fast the replay runs
+
+    Two Games are linked back to back and played by ChaseBots, so there
+    are remote wins in the recording. It keeps a keyframe every frame, so
+    playback checks the whole match state before every frame.
+    """
+    if isinstance(pygame, type(None)):
+        return {}
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import main
+    from replay import Recorder, Replay
+    from sprites import sprite_cache
+
+    pygame.init()
+    pygame.display.set_mode(main.RESOLUTION)
+    poets = ["Wilfred Owen", "William Blake"]
+    for poet in poets:
+        try:
+            sprite_cache.get_source(poet)
+        except FileNotFoundError:
+            sprite_cache.sources[poet.lower()] = pygame.Surface([256, 256])
+
+    links = [LoopbackLink(), LoopbackLink()]
+    links[0].peer, links[1].peer = links[1], links[0]
+    games = [main.Game(main.Player(poets[0]), main.Player(poets[1]), True,
+                       links[0]),
+             main.Game(main.Player(poets[1]), main.Player(poets[0]), False,
+                       links[1])]
+    bots = [ChaseBot(random.Random(seed + i)) for i in range(0, 2)]
+    path = "bench-replay.rec"
+    games[0].recorder = Recorder(path, games[0], 1)
+    for frame in range(0, frames):
+        for game, bot in zip(games, bots):
+            game.set_controls(bot.controls(game.local_player,
+                                           game.remote_player))
+            game.receive()
+            game.update(1 / 60)
+    games[0].recorder.close()
+
+    replay = Replay(path)
+    game = replay.make_game()
+    start = time.perf_counter()
+    played, mismatches = replay.play(game)
+    elapsed = time.perf_counter() - start
+    replay.close()
+    os.remove(path)
+    pygame.quit()
+    return {
+        "replay remote wins": games[0].enemy_wins,
+        "replay frames": played,
+        "replay mismatched frames": mismatches,
+        "replay frames/s": played / elapsed,
+    }
+
+
+def bench_startup(size=1024, handshake=.05, seed=1):
+    """Returns how long start up takes before the first frame, in ms
+
+    pygame.init() and init_pygame() are each timed in a fresh interpreter.
+    Two noisy portraits of size pixels stand in for the chosen poets'.
+    They are decoded one after the other when first drawn, as before the
+    asset manager, then preloaded across a handshake of handshake seconds.
+    """
+    if isinstance(pygame, type(None)):
+        return {}
+    import tempfile
+    from assets import AssetManager
+
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy")
+    results = {}
+    for name, module, call in [("pygame.init", "pygame", "pygame.init()"),
+                               ("init_pygame", "assets",
+                                "assets.init_pygame()")]:
+        timer = "import time, " + module + \
+            "; start = time.perf_counter(); " + call + \
+            "; print(time.perf_counter() - start)"
+        output = subprocess.run(
+            [sys.executable, "-c", timer], capture_output=True, text=True,
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        results[name + " ms"] = float(output.split()[-1]) * 1000
+
+    rng = random.Random(seed)
+    poets = ["Wilfred Owen", "William Blake"]
+    with tempfile.TemporaryDirectory() as root:
+        for poet in poets:
+            noise = bytes(rng.getrandbits(8)
+                          for i in range(0, size * size * 3))
+            pygame.image.save(pygame.image.frombuffer(noise, [size, size],
+                                                      "RGB"),
+                              os.path.join(root, poet.lower() + ".jpg"))
+
+        assets = AssetManager(root)
+        start = time.perf_counter()
+        for poet in poets:
+            assets.portrait(poet)
+        results["serial decode ms"] = (time.perf_counter() - start) * 1000
+
+        assets.preload(poets)
+        start = time.perf_counter()
+        for poet in poets:
+            assets.portrait(poet)
+        results["parallel decode ms"] = (time.perf_counter() - start) * 1000
+
+        assets.preload(poets)
+        time.sleep(handshake)
+        start = time.perf_counter()
+        for poet in poets:
+            assets.portrait(poet)
+        results["wait after handshake ms"] = \
+            (time.perf_counter() - start) * 1000
+        assets.close()
+    return results
+
+
+def bench_atlas(size=512, radius=80, seed=1):
+    """Returns the time and memory to load every poet's portrait, from one
+    file each and from an atlas
+
+    Runs under SDL's dummy video driver, so portraits are converted to
+    the display's format as in the game. Made up portraits of size pixels
+    stand in for the real ones, and are drawn at the size a ball of radius
+    shows them.
+    """
+    if isinstance(pygame, type(None)):
+        return {}
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import tempfile
+    import atlas
+    from assets import AssetManager
+    from sprites import PORTRAIT_SCALE
+
+    pygame.display.init()
+    pygame.display.set_mode([64, 64])
+    rng = random.Random(seed)
+    poets = get_all_poets()
+    shown = int(radius * PORTRAIT_SCALE)
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        for poet in poets:
+            image = pygame.Surface([size, size])
+            for i in range(0, 40):
+                pygame.draw.circle(
+                    image, [rng.randrange(0, 256) for k in range(0, 3)],
+                    [rng.randrange(0, size), rng.randrange(0, size)],
+                    rng.randrange(4, size // 4))
+            pygame.image.save(image, os.path.join(root, poet + ".jpg"))
+
+        assets = AssetManager(root)
+        start = time.perf_counter()
+        sources = [assets.portrait(poet) for poet in poets]
+        portraits = [pygame.transform.scale(source, [shown, shown]).convert()
+                     for source in sources]
+        results["files load ms"] = (time.perf_counter() - start) * 1000
+        results["files memory KB"] = sum(
+            image.get_pitch() * image.get_height()
+            for image in sources + portraits) / 1024
+        results["files disk KB"] = sum(os.path.getsize(path) for path in
+                                       assets.get_index().values()) / 1024
+
+        atlas.save(root, *atlas.build(assets))
+        start = time.perf_counter()
+        packed = atlas.Atlas.load(root)
+        packed.convert()
+        portraits = [packed.portrait(poet, shown) for poet in poets]
+        results["atlas load ms"] = (time.perf_counter() - start) * 1000
+        results["atlas memory KB"] = (packed.memory() + sum(
+            image.get_pitch() * image.get_height()
+            for image in portraits)) / 1024
+        results["atlas disk KB"] = sum(
+            os.path.getsize(os.path.join(root, name))
+            for name in [atlas.ATLAS_IMAGE, atlas.ATLAS_INDEX]) / 1024
+        assets.close()
+    pygame.display.quit()
+    return results
+
+
+BENCHMARKS = {
+    "physics": bench_physics,
+    "codec": bench_codec,
+    "bandwidth": bench_bandwidth,
+    "send_rate": bench_send_rate,
+    "transport": lambda: {**bench_transport("tcp"), **bench_transport("udp")},
+    "rtt": lambda: {**bench_rtt("tcp"), **bench_rtt("udp")},
+    "render": bench_render,
+    "replay": bench_replay,
+    "startup": bench_startup,
+    "atlas": bench_atlas,
+}
+
+
+def median_results(runs):
+    """Merges several runs of a benchmark into the median of each result"""
+    results = {}
+    for name in runs[0]:
+        values = sorted(run[name] for run in runs)
+        results[name] = values[len(values) // 2]
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def report(results):
+    for name in results:
+        print(name.ljust(32) + str(round(results[name], 1)).rjust(12))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the game")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="Any of " + ", ".join(BENCHMARKS) +
+                        ". All of them if none given")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs of each benchmark to take the median of")
+    args = parser.parse_args(args)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark " + name)
+
+    results = {}
+    for name in args.benchmarks or list(BENCHMARKS):
+        runs = [BENCHMARKS[name]() for i in range(0, args.repeat)]
+        results[name] = median_results(runs)
+        if not args.json:
+            report(results[name])
+    if args.json:
+        print(json.dumps({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": not isinstance(numpy, type(None)),
+            "pygame": not isinstance(pygame, type(None)),
+            "repeat": args.repeat,
+            "results": results,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
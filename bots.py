@@ -0,0 +1,76 @@
+"""Computer players that drive a body with the same controls as the keys
+
+A bot is asked for its controls once a frame and answers with the packed
+byte the keyboard handler would have made, so it can stand in for either
+player of a Game or run a bare World headless.
+"""
+import random
+
+from lockstep import pack_controls
+
+CHANGE_CHANCE = .05  # Chance per frame that a RandomBot changes its keys
+MISTAKE_CHANCE = .1  # Chance per frame that a ChaseBot holds its last keys
+REACH = 3  # Radii apart at which a ChaseBot jumps for the opponent's head
+DODGE = 1.5  # Radii from an opponent coming down past which it stops running
+
+
+class Bot:
+    """Base for the bots. Subclasses say which keys they hold in think()"""
+
+    def __init__(self, rng=None):
+        self.rng = rng if rng else random.Random()
+        self.held = set()
+
+    def think(self, me, them):
+        """Returns the set of controls to hold this frame
+
+        :param me: The bot's body
+        :param them: The opponent's body
+        """
+        return set()
+
+    def controls(self, me, them):
+        """Returns this frame's packed controls, pressing any new keys"""
+        held = self.think(me, them)
+        pressed = held - self.held
+        self.held = held
+        return pack_controls(held, pressed)
+
+
+class RandomBot(Bot):
+    """Mashes keys at random, like loadgen's clients"""
+
+    def think(self, me, them):
+        if self.rng.random() >= CHANGE_CHANCE:
+            return self.held
+        return set(control for control in ["left", "right", "jump"]
+                   if self.rng.random() < .5)
+
+
+class ChaseBot(Bot):
+    """Runs at the opponent and jumps for their head when close
+
+    It runs away from an opponent coming down on it from above, and now
+    and then is too slow to change what it was doing.
+    """
+
+    def think(self, me, them):
+        if self.rng.random() < MISTAKE_CHANCE:
+            return self.held
+        held = set()
+        dx = them.pos[0] - me.pos[0]
+        toward = "right" if dx > 0 else "left"
+        above = them.pos[1] < me.pos[1] - me.radius
+        if above and abs(dx) < (me.radius + them.radius) * DODGE:
+            # Out from under them
+            held.add("left" if toward == "right" else "right")
+        else:
+            held.add(toward)
+            # Tapped rather than held, as Victorians only jump on a press
+            if abs(dx) < (me.radius + them.radius) * REACH and not above \
+                    and "jump" not in self.held:
+                held.add("jump")
+        return held
+
+
+BOTS = {"random": RandomBot, "chase": ChaseBot}
@@ -0,0 +1,109 @@
+"""Load generator for server.py
+
+Connects many bot clients that send random lockstep inputs, all from one
+selector loop, and reports what the server relayed back. Run with:
+
+    python loadgen.py [clients] [seconds] [port]
+"""
+import random
+import selectors
+import socket
+import sys
+import time
+
+from lockstep import HEARTBEAT
+from net import TcpTransport
+from physics import TICK_RATE
+from poetry import get_all_poets
+from server import SERVER_PORT
+
+CLIENT_TICK = 60
+CHANGE_CHANCE = .05  # Chance per tick that a bot changes its controls
+
+
+class Bot:
+    def __init__(self, address, rng):
+        self.rng = rng
+        self.transport = TcpTransport(socket.create_connection(address))
+        self.transport.send_poet(rng.choice(get_all_poets()))
+        self.start = None
+        self.controls = 0
+        self.sent_frame = None
+        self.sent = 0
+        self.received = 0
+        self.lags = []
+
+    def receive(self):
+        if not self.transport.receive():
+            return False
+        if isinstance(self.start, type(None)) and not isinstance(
+                self.transport.poet, type(None)):
+            self.start = time.monotonic()
+        frame = self.frame()
+        for their_frame, controls in self.transport.take_inputs():
+            self.received += 1
+            self.lags.append((frame - their_frame) / TICK_RATE * 1000)
+        return True
+
+    def frame(self):
+        if isinstance(self.start, type(None)):
+            return 0
+        return int((time.monotonic() - self.start) * TICK_RATE)
+
+    def tick(self):
+        if isinstance(self.start, type(None)):
+            return
+        frame = self.frame()
+        changed = self.rng.random() < CHANGE_CHANCE
+        if changed:
+            self.controls = self.rng.randrange(0, 64)
+        if changed or isinstance(self.sent_frame, type(None)) or \
+                frame - self.sent_frame >= HEARTBEAT:
+            self.transport.send_input(frame, self.controls)
+            self.sent_frame = frame
+            self.sent += 1
+
+
+def main(clients=200, seconds=10, port=SERVER_PORT):
+    rng = random.Random(1)
+    selector = selectors.DefaultSelector()
+    bots = []
+    for i in range(0, clients):
+        bot = Bot(("127.0.0.1", port), rng)
+        selector.register(bot.transport.sock, selectors.EVENT_READ, bot)
+        bots.append(bot)
+
+    start = time.monotonic()
+    next_tick = start
+    lost = 0
+    while time.monotonic() - start < seconds:
+        for key, mask in selector.select(max(0, next_tick - time.monotonic())):
+            if not key.data.receive():
+                selector.unregister(key.fileobj)
+                lost += 1
+        if time.monotonic() >= next_tick:
+            for bot in bots:
+                bot.tick()
+            next_tick += 1 / CLIENT_TICK
+
+    elapsed = time.monotonic() - start
+    lags = sorted(lag for bot in bots for lag in bot.lags)
+    print("clients".ljust(24) + str(clients).rjust(12))
+    print("matched".ljust(24) + str(sum(
+        not isinstance(bot.start, type(None)) for bot in bots)).rjust(12))
+    print("disconnected".ljust(24) + str(lost).rjust(12))
+    print("inputs sent/s".ljust(24) + str(int(sum(
+        bot.sent for bot in bots) / elapsed)).rjust(12))
+    print("inputs relayed/s".ljust(24) + str(int(sum(
+        bot.received for bot in bots) / elapsed)).rjust(12))
+    if lags:
+        print("relay lag p50 ms".ljust(24) +
+              str(round(lags[len(lags) // 2], 1)).rjust(12))
+        print("relay lag p95 ms".ljust(24) +
+              str(round(lags[int(len(lags) * .95)], 1)).rjust(12))
+    for bot in bots:
+        bot.transport.close()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:4]])
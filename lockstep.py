@@ -0,0 +1,174 @@
+from bisect import bisect_right, insort
+
+from physics import Simulation, TICK_RATE
+
+ROLLBACK_FRAMES = 240  # Frames of history kept for rolling back
+MAX_AHEAD = 120  # Frames the local side may run past the last remote input
+HEARTBEAT = 24  # Frames between input messages when nothing changes
+
+CONTROLS = ["left", "right", "jump"]
+
+
+def pack_controls(held, pressed):
+    """Packs held and pressed control sets into one byte"""
+    controls = 0
+    for i in range(0, len(CONTROLS)):
+        if CONTROLS[i] in held:
+            controls |= 1 << i
+        if CONTROLS[i] in pressed:
+            controls |= 1 << (i + len(CONTROLS))
+    return controls
+
+
+def unpack_controls(controls):
+    """Returns the (held, pressed) control sets packed in controls"""
+    held = set()
+    pressed = set()
+    for i in range(0, len(CONTROLS)):
+        if controls & (1 << i):
+            held.add(CONTROLS[i])
+        if controls & (1 << (i + len(CONTROLS))):
+            pressed.add(CONTROLS[i])
+    return held, pressed
+
+
+class InputHistory:
+    """A player's controls over time, from messages sent when they change
+
+    A message gives the controls from its frame on, until the frame of the
+    next message. heard is the newest frame any message has covered.
+    """
+
+    def __init__(self):
+        self.frames = []
+        self.controls = {}
+        self.heard = -1
+
+    def add(self, frame, controls):
+        """Records controls from frame on
+
+        :return: False if this was already known
+        """
+        self.heard = max(self.heard, frame)
+        if self.controls.get(frame) == controls:
+            return False
+        if frame not in self.controls:
+            insort(self.frames, frame)
+        self.controls[frame] = controls
+        return True
+
+    def get(self, frame):
+        """Returns the controls in effect at frame, as best known"""
+        i = bisect_right(self.frames, frame)
+        if not i:
+            return 0
+        return self.controls[self.frames[i - 1]]
+
+    def forget(self, frame):
+        """Drops changes that frame and later no longer depend on"""
+        while len(self.frames) > 1 and self.frames[1] <= frame:
+            del self.controls[self.frames.pop(0)]
+
+
+class LockstepSession(Simulation):
+    """Steps a World from both players' inputs alone
+
+    Each fixed step is a frame. Local input is applied straight away and
+    sent whenever it changes (and every HEARTBEAT frames otherwise). Remote
+    input is predicted to stay as it was last heard. When a message shows a
+    prediction was wrong, the world is restored from the snapshot taken
+    before that frame and the frames since are run again.
+
+    Scores are kept here rather than by the caller so that a win which is
+    rolled back is also taken back.
+    """
+
+    def __init__(self, world, host, join, local, tick_rate=TICK_RATE):
+        super().__init__(world, tick_rate)
+        self.host = host
+        self.join = join
+        self.local = local
+        self.remote = join if local is host else host
+        self.frame = 0
+        self.held = set()
+        self.pressed = set()
+        self.local_inputs = {}
+        self.remote_inputs = InputHistory()
+        self.remote_used = {}
+        self.snapshots = {}
+        self.scores = {host: 0, join: 0}
+        self.sent = None
+        self.sent_frame = None
+        self.outgoing = []
+        self.rollbacks = 0
+        self.desyncs = 0
+
+    def set_local_controls(self, held, pressed):
+        self.held = set(held)
+        self.pressed |= set(pressed)
+
+    def take_outgoing(self):
+        """Returns the (frame, controls) input messages to send"""
+        outgoing = self.outgoing
+        self.outgoing = []
+        return outgoing
+
+    def add_remote_input(self, frame, controls):
+        """Records remote controls from frame on, rolling back if needed"""
+        if not self.remote_inputs.add(frame, controls):
+            return
+        for past in range(frame, self.frame):
+            if self.remote_used.get(past) != self.remote_inputs.get(past):
+                self.rollback(past)
+                break
+
+    def rollback(self, frame):
+        """Runs every frame from frame up to now again"""
+        if frame not in self.snapshots:
+            self.desyncs += 1  # Too late to fix
+            return
+        end = self.frame
+        world, scores = self.snapshots[frame]
+        self.world.restore(world)
+        self.scores = dict(scores)
+        self.frame = frame
+        self.rollbacks += 1
+        while self.frame < end:
+            self.simulate()
+
+    def step(self):
+        if self.frame - self.remote_inputs.heard > MAX_AHEAD:
+            return []  # Wait for the remote player to catch up
+        controls = pack_controls(self.held, self.pressed)
+        self.pressed = set()
+        self.local_inputs[self.frame] = controls
+        if controls != self.sent or self.frame - self.sent_frame >= HEARTBEAT:
+            self.outgoing.append((self.frame, controls))
+            self.sent = controls
+            self.sent_frame = self.frame
+        self.steps += 1
+        return self.simulate()
+
+    def simulate(self):
+        """Runs the current frame from the recorded and predicted inputs"""
+        frame = self.frame
+        old = frame - ROLLBACK_FRAMES
+        self.snapshots[frame] = (self.world.snapshot(), dict(self.scores))
+        self.snapshots.pop(old, None)
+        self.local_inputs.pop(old, None)
+        self.remote_used.pop(old, None)
+        self.remote_inputs.forget(old)
+
+        remote = self.remote_inputs.get(frame)
+        self.remote_used[frame] = remote
+        self.local.held, self.local.pressed = unpack_controls(
+            self.local_inputs[frame])
+        self.remote.held, self.remote.pressed = unpack_controls(remote)
+
+        wins = self.world.step(self.step_secs)
+        if wins:
+            self.scores[wins[0][0]] += 1
+            self.host.reset(True, self.host is self.local)
+            self.join.reset(False, self.join is self.local)
+        self.frame += 1
+        return wins
@@ -1,62 +1,52 @@
-import socket
+import argparse
 import math
+import socket
+import sys
 import time
-import threading
 import random
 
 import pygame
-from pygame.image import load
-import pygame.gfxdraw
-
-from configs import get_game_root
-from poetry import get_all_poets, find_poet
 
-pygame.init()
+from physics import Body, World, Simulation, RESOLUTION
+from poetry import get_all_poets
+from assets import asset_manager, init_pygame
+from lockstep import LockstepSession, pack_controls, unpack_controls
+from net import NetLoop, TcpTransport, UdpTransport
+from pacing import FrameScheduler, FPS
+from protocol import WIN, HOST_SIDE
+from renderer import DirtyRenderer
+from replay import Recorder
+from snapshots import SnapshotBuffer
+from spectate import SpectatorFeed
+from sprites import sprite_cache, text_cache
+from stats import FrameStats
 
 FLAGS = pygame.VIDEORESIZE
-RESOLUTION = [1600, 900]
-
-y_gravity = -9.81
-x_gravity = 0
-grid_scale = RESOLUTION[1] / 4
-time_scale = 1000
-WALLS = ["WALL", "HOLE", "WALL", "WALL"]
-EFFICIENCY = .2
-MIN_FORCE = .1
-WALL_WEIGHT = 500
-BALL_ACCEL = 10
-JUMP_VEL = 4
-
-WIN_ARC = .5
-
-BUFFER_SIZE = 32
-BUFFER_PART = 8
-
-SLEEP_TIME = .01
-
-clock = pygame.time.Clock()
-
-send_time = -1000
-recv_time = -1000
-send_int = -553
-recv_int = -553
+VSYNC = False  # Let the display pace frames, where it can, instead of FPS
 
 PING_UPDATE = 500
-PING_FACTOR = 10
 PING_SIZE = 50
-ping_time = 0
-
-SEND_LOCK = threading.Lock()
-
-enemy_wins = 0
-my_wins = 0
+CLOSE_FIGHT = 3  # Radii apart within which states go out at the full rate
 
-PLAYER_SIZE = 20
+OVERLAY_KEY = pygame.K_F3
+EXPORT_KEY = pygame.K_F4  # Saves the overlay's frames as CSV and JSON
+OVERLAY_SIZE = 18
+OVERLAY_COLOR = (255, 255, 0)
 
 LEFT_COLOR = (125, 125, 125)
 RIGHT_COLOR = (255, 255, 255)
 
-GROUND_FACTOR = 1.25
+LOCAL_KEYS = {
+    pygame.K_a: "left",
+    pygame.K_d: "right",
+    pygame.K_w: "jump",
+    pygame.K_SPACE: "jump",
+}
+REMOTE_KEYS = {
+    pygame.K_LEFT: "left",
+    pygame.K_RIGHT: "right",
+    pygame.K_UP: "jump",
+}
 
 
 def get_millis():
@@ -125,57 +115,25 @@ def get_input(prompt="", choices=None):
             return answer
 
 
-def elastic_bounce(m1, v1, m2, v2, eff):
-    """Returns the final vel of 1 after an elastic bounce"""
-    force = (((m1 - m2) / (m1 + m2)) * v1) + (
-            ((2 * m2) / (m1 + m2)) * v2)
-    if abs(force) <= MIN_FORCE:
-        return 0
-    return force * EFFICIENCY * eff
+def blit_centered(display, image, pos):
+    """Draws an odd sized image with its middle pixel at pos
 
-
-def angle_of_points(point1, point2):
-    return math.atan2(point2[0] - point1[0], point2[1] - point1[1])
-
-
-def angled_point(point, angle, dist):
-    x = point[0] + math.sin(angle) * dist
-    y = point[1] + math.cos(angle) * dist
-    return [x, y]
-
-
-def get_dist(point1, point2):
-    return math.sqrt(
-        (point2[0] - point1[0]) ** 2 + (point2[1] - point1[1]) ** 2)
-
-
-def shift(pos, rad):
-    return (int(random.randint(-rad, rad) + pos[0]), int(random.randint(-rad, rad) + pos[1]))
+    :return: The rect drawn over
+    """
+    return display.blit(image, (int(pos[0]) - image.get_width() // 2,
+                         int(pos[1]) - image.get_height() // 2))
 
 
-def invert(pos, _invert):
+def invert(pos, _invert, width):
     if _invert:
-        return (display.get_width() - pos[0], pos[1])
+        return (width - pos[0], pos[1])
     return pos
 
 
-class Player(threading.Thread):
-    def __init__(self, _connection=None, _poet=None):
-        super().__init__()
-        self.connection = _connection
-        self.poet = _poet
-        self.pos = None
-        self.radius = None
-        self.vel = None
+class Player(Body):
+    def __init__(self, _poet=None):
+        Body.__init__(self, _poet)
         self.color = LEFT_COLOR
-        self.local = None
-        self.path = get_game_root() + self.poet.lower() + ".jpg"
-        self.era = find_poet(self.poet)[0]
-        self.atts = find_poet(self.poet)[1]
-        self.jumps = 1
-        self.jump_start = 2
-        self.air_move = False
-        self.mass = 10 // self.atts["bounce"]
 
         if self.era == "Romantic":
             self.era_color = (255, 50, 50)
@@ -184,252 +142,54 @@ class Player(threading.Thread):
         else:
             self.era_color = (50, 125, 50)
 
-    def run(self):
-        global quit_running, send_time, recv_time, recv_int, send_int, enemy_wins
-        while not quit_running:
-            time.sleep(SLEEP_TIME)
-            if not self.local:
-                try:
-                    data = self.connection.recv(BUFFER_SIZE)
-                except ConnectionResetError:
-                    print("Server has closed")
-                    break
-
-                if not data:
-                    print("Lost connection")
-                    break
-                if data.decode().startswith("WIN"):
-                    enemy_wins += 1
-                    reset()
-                else:
-                    data = unformat_data(data.decode())
-                    if not isinstance(data, type(None)):
-                        self.pos = data[0:2]
-                        self.vel = data[2:4]
-                recv_int = get_millis() * PING_FACTOR - recv_time
-                recv_time = get_millis() * PING_FACTOR
-            else:  # TODO: Only send remote input. Calc all on local
-                data_string = format_data(*self.pos, *self.vel)
-                SEND_LOCK.acquire()
-                try:
-                    remote_player.connection.sendall(data_string.encode())
-                except ConnectionResetError:
-                    print("Player left")
-                    quit_running = True
-                    raise SystemExit
-                SEND_LOCK.release()
-                send_int = get_millis() * PING_FACTOR - send_time
-                send_time = get_millis() * PING_FACTOR
-
     def reset(self, host=True, local=False):
         """Resets player position"""
-        global grid_scale
-        self.local = local
-        grid_scale = RESOLUTION[1] / 4
-        width = display.get_width()
-        height = display.get_height()
-        self.vel = [0, 0]
-        self.radius = int((width // PLAYER_SIZE) * get_att(self, "size", 1))
-        if not host:
-            self.pos = [self.radius * 2, height - self.radius * 2]
-        else:
-            self.color = RIGHT_COLOR
-            self.pos = [width - self.radius * 2, height - self.radius * 2]
-
-    def render(self, _invert=False):
-        if self.on_ground(True):
-            self.jumps = self.jump_start
-            self.air_move = False
-
-        if get_att(self, "gas", False):
-            for k in range(0, random.randint(1, 10)):
-                pygame.draw.circle(display, (25, 100, 25), shift(invert(self.pos, _invert), self.radius), int(random.randint(0, self.radius*4)))
-
-        pygame.draw.circle(display, self.color, list(int(x) for x in invert(self.pos, _invert)),
-                           self.radius)
-        image = load(self.path)
-        image = pygame.transform.scale(image,
-                                       [int(self.radius*1.3), int(self.radius*1.3)])
-        if self.vel[0] < 0:
-            image = pygame.transform.flip(image, True, False)
-
-        display.blit(image, [*list(x - self.radius//1.5 for x in invert(self.pos, _invert))])
-
-        # I was running out of time, ok?
-        pygame.draw.circle(display, self.color, list(int(x) for x in invert(self.pos, _invert)),
-                           int(self.radius), int(self.radius // 3))
-        pygame.draw.circle(display, self.color,
-                           list(int(x + 1) for x in invert(self.pos, _invert)),
-                           int(self.radius), int(self.radius // 3))
-        pygame.draw.circle(display, self.color,
-                           list(int(x - 1) for x in invert(self.pos, _invert)),
-                           int(self.radius), int(self.radius // 3))
-        pygame.draw.circle(display, self.era_color,
-                           list(int(x) for x in invert(self.pos, _invert)),
-                           int(self.radius), int(self.radius // 8))
-        pygame.draw.circle(display, self.era_color,
-                           list(int(x - 1) for x in invert(self.pos, _invert)),
-                           int(self.radius), int(self.radius // 8))
-        pygame.draw.circle(display, self.era_color,
-                           list(int(x + 1) for x in invert(self.pos, _invert)),
-                           int(self.radius), int(self.radius // 8))
-
-        if get_att(self, "visions", False) and not _invert:
-            self.render(True)
-
-    def tick(self, secs, balls):
-        for i in range(0, 2):
-            if i == 1:
-                self.vel[1] -= y_gravity * secs
-            else:
-                self.vel[0] -= x_gravity * secs
-            self.pos[i] += (self.vel[i] * secs) * grid_scale
-        self.check_pos(balls)
-
-    def check_pos(self, balls):
-
-        # Check Walls
-
-        i = 0
-        for wall in WALLS:
-            new_pos = None
-            new_vel = None
-            opposite_pos = None
-            if i == 0 or i == 3:
-                # RIGHT or BOTTOM
-                if self.pos[i % 2] + self.radius >= RESOLUTION[i % 2]:
-                    new_pos = RESOLUTION[i % 2] - (self.radius + 1)
-                    opposite_pos = (self.radius + 1)
-                    if i == 3:
-                        eff = self.atts["elastic"]
-                    else:
-                        eff = 1
-                    new_vel = elastic_bounce(self.mass,
-                                             self.vel[i % 2],
-                                             WALL_WEIGHT, 0, eff)
-            else:
-                # TOP OR LEFT
-                if self.pos[i % 2] - self.radius <= 0:
-                    new_pos = (self.radius + 1)
-                    opposite_pos = RESOLUTION[i % 2] - (self.radius + 1)
-                    new_vel = elastic_bounce(self.mass,
-                                             self.vel[i % 2],
-                                             WALL_WEIGHT, 0, 1)
-
-            if not isinstance(new_pos, type(None)):
-                if wall == "WALL":
-                    self.pos[i % 2] = new_pos
-                    self.vel[i % 2] = new_vel
-                elif wall == "LOOP":
-                    self.pos[i % 2] = opposite_pos
-                elif wall == "HOLE":
-                    pass
-                else:
-                    balls.remove(self)
-            i += 1
-
-    def collide(self, _ball, _collisions):
-        if _ball != self and not ([self, _ball] in _collisions
-                                  or [_ball, self] in _collisions):
-            dist = math.sqrt((_ball.pos[0] - self.pos[0]) ** 2 + (
-                    _ball.pos[1] - self.pos[1]) ** 2)
-            if dist <= self.radius + _ball.radius:
-                selftempx = self.vel[0]
-                selftempy = self.vel[1]
-                self.vel[0] = elastic_bounce(self.mass, self.vel[0],
-                                             _ball.mass, _ball.vel[0], 1)
-                self.vel[1] = elastic_bounce(self.mass, self.vel[1],
-                                             _ball.mass, _ball.vel[1], 1)
-                _ball.vel[0] = elastic_bounce(_ball.mass, _ball.vel[0],
-                                              self.mass, selftempx, 1)
-                _ball.vel[1] = elastic_bounce(_ball.mass, _ball.vel[1],
-                                              self.mass, selftempy, 1)
-
-                angle1 = angle_of_points(self.pos, _ball.pos)
-                angle2 = angle_of_points(_ball.pos, self.pos)
-
-                if self.local:
-                    if -WIN_ARC < angle1 < WIN_ARC and not get_att(remote_player, "do not go gentle", False):
-                        # Jumped on opponent's head
-                        return "WIN"
-                    elif -WIN_ARC < angle2 < WIN_ARC and LOCAL_GAME and not get_att(self, "do not go gentle", False):
-                        # Jumped on my head
-                        return "LOST"
-
-                n_dist2 = dist * (
-                        self.radius / (self.radius + _ball.radius))
-
-                center = angled_point(self.pos, angle1, n_dist2)
-                if get_dist(self.pos, center) <= self.radius:
-                    self.pos = angled_point(center, angle2, self.radius + 1)
-                if get_dist(_ball.pos, center) <= _ball.radius:
-                    _ball.pos = angled_point(center, angle1, _ball.radius + 1)
-            _collisions.append([self, _ball])
-        return _collisions
-
-    def on_wall(self):
-        if self.on_ground(True):
-            return True
-        elif -self.radius <= self.pos[1] <= self.radius * get_att(self, "ground factor", GROUND_FACTOR):
-            return True
-        elif self.pos[0] >= display.get_width() - self.radius * get_att(self, "ground factor", GROUND_FACTOR):
-            return not self.pos[1] <= -self.radius  # Walls not above ceiling
-        elif self.pos[0] <= self.radius * GROUND_FACTOR:
-            return not self.pos[1] <= -self.radius
-        return False
-
-    def on_ground(self, touching=False, moved=True):
-        on_ground = self.pos[1] >= display.get_height() - self.radius * get_att(self, "ground factor", GROUND_FACTOR)
-        if touching:
-            return on_ground
-        if self.era == "Romantic":
-            return on_ground
-        elif self.era == "Victorian":
-            if not moved and self.air_move:
-                return True
-            if self.jumps > 0:
-                self.air_move = True
-                self.jumps -= 1
-                return True
-            self.air_move = False
-            return False
-        else:
-            return self.on_wall()
-
-
-def reset():
-    local_player.reset(hosting, True)
-    remote_player.reset(not hosting, False)
+        Body.reset(self, host, local)
+        self.color = RIGHT_COLOR if host else LEFT_COLOR
+        # Rebuild after resizes
+        for flipped in [False, True]:
+            sprite_cache.get_player(self.poet, self.radius, flipped,
+                                    self.color, self.era_color)
+        if self.atts.gas:
+            sprite_cache.get_gas(self.radius)
+
+    def render(self, display, alpha=1, _invert=False):
+        """Draws the player
+
+        :return: The rects drawn over
+        """
+        pos = invert(self.lerp_pos(alpha), _invert, display.get_width())
+
+        rects = []
+        if self.atts.gas:
+            rects.append(blit_centered(display, random.choice(
+                sprite_cache.get_gas(self.radius)), pos))
+        rects.append(blit_centered(display, sprite_cache.get_player(
+            self.poet, self.radius, self.vel[0] < 0, self.color,
+            self.era_color), pos))
+
+        if self.atts.visions and not _invert:
+            rects += self.render(display, alpha, True)
+        return rects
+
+
+def open_display(resolution):
+    """Opens the window, waiting for vsync if VSYNC is set and supported
+
+    :return: (display, fps), fps being the frame cap still needed
+    """
+    if VSYNC:
+        try:
+            return pygame.display.set_mode(
+                resolution, FLAGS | pygame.SCALED, vsync=1), 0
+        except pygame.error:
+            pass  # Cap the frame rate instead
+    return pygame.display.set_mode(resolution, FLAGS), FPS
 
 
-def format_data(*data):
-    string = ""
-    for obj in data:
-        if isinstance(obj, int) or isinstance(obj, float):
-            string += f'{obj:.{BUFFER_PART}f}'[:BUFFER_PART]
-        else:
-            if len(obj) > BUFFER_PART:
-                string += obj[:BUFFER_PART]
-            else:
-                string += obj.ljust(BUFFER_PART, "~")
-    return string
-
-
-def unformat_data(data):
-    if len(data) < BUFFER_SIZE:
-        return None  # Not all data received
-    data_list = []
-    while len(data) >= BUFFER_PART:
-        part = data[:BUFFER_PART]
-        if not is_number(part):
-            data_list.append(part.rstrip("~"))
-        else:
-            data_list.append(float(part))
-        if len(data) > BUFFER_PART:
-            data = data[BUFFER_PART:]
-        else:
-            break
-    return data_list
+def get_controls(keys, keymap):
+    """Maps a set of pygame keys to the controls they are bound to"""
+    return set(keymap[key] for key in keys if key in keymap)
 
 
 def choose_poet(player=1):
@@ -444,24 +204,360 @@ def choose_poet(player=1):
     return poet
 
 
-def get_att(player, att, default=None):
-    if att in player.atts:
-        return player.atts[att]
-    return default
+class Game:
+    """A match between the local player and a remote or second local one
 
+    Holds everything the main loop works on, so a match can be stepped and
+    drawn by a script, with no prompts and no window of its own.
 
-def jump(player, power=1):
-    player.vel[1] -= JUMP_VEL * get_att(player, "jump vel", 1) * power
+    :param net_loop: NetLoop to the remote player. None for a local game
+    :param lockstep: Send inputs only. Both players must agree on this
+    """
 
+    def __init__(self, local_player, remote_player, hosting=False,
+                 net_loop=None, lockstep=False, resolution=RESOLUTION):
+        self.local_player = local_player
+        self.remote_player = remote_player
+        self.hosting = hosting
+        self.net_loop = net_loop
+        self.local_game = isinstance(net_loop, type(None))
+        self.lockstep = lockstep
+        self.remote_snapshots = SnapshotBuffer()
+        self.my_wins = 0
+        self.enemy_wins = 0
+        self.key_downs = set()
+        self.pings = ""
+        self.ping_time = 0
+        self.frame_stats = FrameStats()
+        self.overlay = False
+        self.overlay_lines = []
+        self.overlay_time = 0
+        self.recorder = None
+        self.spectators = None  # SpectatorFeed to a relay, if broadcasting
+        self.ready_time = None  # When both poets were known
+        self.first_frame = None  # Seconds from ready_time to the first frame
+
+        if hosting:
+            self.host_player, self.join_player = local_player, remote_player
+        else:
+            self.host_player, self.join_player = remote_player, local_player
+
+        # Same body order on both sides, so a lockstep simulation runs
+        # identically
+        self.world = World(resolution)
+        self.world.add(self.host_player)
+        self.world.add(self.join_player)
+
+        self.reset()
+        if lockstep:
+            self.simulation = LockstepSession(self.world, self.host_player,
+                                              self.join_player, local_player)
+        else:
+            self.simulation = Simulation(self.world)
+            if not self.local_game:
+                self.remote_player.steered = False
+
+    def reset(self):
+        self.local_player.reset(self.hosting, True)
+        self.remote_player.reset(not self.hosting, False)
+        self.remote_snapshots.clear()
+
+    def resize(self, resolution):
+        if not self.lockstep:
+            # Lockstep peers must keep simulating the same arena
+            self.world.resize(resolution)
+            self.reset()
+
+    def control(self, events):
+        """Turns key events into controls
+
+        :return: False if the player asked to quit
+        """
+        key_presses = set()
+        for event in events:
+            if event.type == pygame.QUIT:
+                return False
+            elif event.type == pygame.KEYDOWN:
+                key = event.dict["key"]
+                if key == pygame.K_ESCAPE:
+                    return False
+                elif key == OVERLAY_KEY:
+                    self.overlay = not self.overlay
+                elif key == EXPORT_KEY:
+                    self.export_stats()
+                if key not in self.key_downs:
+                    key_presses.add(key)
+                self.key_downs.add(key)
+            elif event.type == pygame.KEYUP:
+                self.key_downs.discard(event.dict["key"])
+
+        remote = 0
+        if self.local_game:
+            remote = pack_controls(get_controls(self.key_downs, REMOTE_KEYS),
+                                   get_controls(key_presses, REMOTE_KEYS))
+        self.set_controls(pack_controls(
+            get_controls(self.key_downs, LOCAL_KEYS),
+            get_controls(key_presses, LOCAL_KEYS)), remote)
+        return True
+
+    def set_controls(self, local, remote=0):
+        """Applies this frame's packed controls
+
+        :param remote: The second player's, in a local game
+        """
+        if self.recorder:
+            self.recorder.controls(self, local, remote)
+        held, pressed = unpack_controls(local)
+        if self.lockstep:
+            self.simulation.set_local_controls(held, pressed)
+        else:
+            self.local_player.set_controls(held, pressed)
+        if self.local_game:
+            self.remote_player.set_controls(*unpack_controls(remote))
 
-LOCAL_GAME = check_input("Yes", "Run local game? ", ["Yes", "No"])
+    def receive(self):
+        """Applies what the remote player sent
 
-local_player = Player(_poet=choose_poet())
-remote_player = None
-hosting = False
+        :return: False if the connection was lost
+        """
+        if self.local_game:
+            return True
+        if self.net_loop.closed:
+            return False
+        if self.lockstep:
+            for frame, controls in self.net_loop.take_inputs():
+                self.remote_input(frame, controls)
+            return True
+
+        for kind in self.net_loop.take_events():
+            if kind == WIN:
+                self.remote_win()
+        state = self.net_loop.take_state()
+        if not isinstance(state, type(None)):
+            self.remote_snapshots.add(*state)
+        if len(self.remote_snapshots):
+            self.move_remote(*self.remote_snapshots.sample(
+                time.monotonic(), self.world.grid_scale))
+        return True
+
+    def remote_input(self, frame, controls):
+        if self.recorder:
+            self.recorder.input(frame, controls)
+        self.simulation.add_remote_input(frame, controls)
+
+    def remote_win(self):
+        if self.recorder:
+            self.recorder.win()
+        self.enemy_wins += 1
+        self.reset()
+
+    def move_remote(self, pos, vel):
+        """Shows the remote player where their last state puts them"""
+        if self.recorder:
+            self.recorder.state(pos, vel)
+        self.remote_player.pos = list(pos)
+        self.remote_player.vel = list(vel)
+        self.remote_player.prev_pos = list(pos)
+
+    def side_scores(self):
+        """Returns the (host, join) scores"""
+        if self.hosting:
+            return self.my_wins, self.enemy_wins
+        return self.enemy_wins, self.my_wins
+
+    def update(self, secs):
+        """Advances the match by secs of real time and scores any wins"""
+        if self.recorder:
+            self.recorder.frame(secs)
+        wins = self.simulation.advance(secs)
+
+        if self.lockstep:
+            # Resets and scores are part of the simulation
+            for frame, controls in self.simulation.take_outgoing():
+                self.net_loop.send_input(frame, controls)
+            self.my_wins = self.simulation.scores[self.local_player]
+            self.enemy_wins = self.simulation.scores[self.remote_player]
+            return wins
+
+        win = False
+        for winner, loser in wins:
+            if winner is self.local_player:
+                self.my_wins += 1
+                win = True
+                break
+            elif self.local_game:
+                self.enemy_wins += 1
+                win = True
+                break
 
-if not LOCAL_GAME:
-    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if win:
+            self.reset()
+            if not self.local_game:
+                self.net_loop.send_win()
+        if not self.local_game:
+            self.net_loop.set_state(self.local_player.pos,
+                                    self.local_player.vel,
+                                    self.world.grid_scale, self.close_fight())
+        return wins
+
+    def close_fight(self):
+        """Checks if the players are near enough to collide soon"""
+        local, remote = self.local_player, self.remote_player
+        return math.dist(local.pos, remote.pos) < \
+            (local.radius + remote.radius) * CLOSE_FIGHT
+
+    def render(self, display):
+        """Draws the players and the scores
+
+        :return: The rects drawn over
+        """
+        rects = []
+        alpha = self.simulation.alpha()
+        for ball in self.world.bodies:
+            rects += ball.render(display, alpha)
+
+        if not self.local_game:
+            if get_millis() - self.ping_time >= PING_UPDATE:
+                rtt = self.net_loop.stats.summary.get("rtt", 0)
+                self.pings = str(int(rtt)).rjust(5) + " ms"
+                self.ping_time = get_millis()
+            label = text_cache.get(self.pings, PING_SIZE//2, (255, 255, 255))
+            width, height = label.get_size()
+            rects.append(display.blit(
+                label, (int(display.get_width() - width), height)))
+        score = str(self.my_wins).strip(" ")
+        label = text_cache.get(score, PING_SIZE, LEFT_COLOR)
+        width1, height = label.get_size()
+        rects.append(display.blit(label, (0, height)))
+        score = " " + str(self.enemy_wins).strip(" ")
+        label = text_cache.get(score, PING_SIZE, RIGHT_COLOR)
+        rects.append(display.blit(label, (width1, height)))
+        if self.overlay:
+            rects += self.render_overlay(display, height * 3)
+        return rects
+
+    def render_overlay(self, display, top):
+        """Draws the frame and network timings from top down
+
+        :return: The rects drawn over
+        """
+        if get_millis() - self.overlay_time >= PING_UPDATE:
+            self.overlay_lines = self.describe_stats()
+            self.overlay_time = get_millis()
+        rects = []
+        for line in self.overlay_lines:
+            label = text_cache.get(line, OVERLAY_SIZE, OVERLAY_COLOR)
+            rects.append(display.blit(label, (0, top)))
+            top += label.get_height()
+        return rects
+
+    def describe_stats(self):
+        """Returns the overlay's lines of text"""
+        lines = ["ms".ljust(10) + "p50".rjust(7) + "p95".rjust(7) +
+                 "max".rjust(7)]
+        summary = self.frame_stats.summary()
+        for name in summary:
+            lines.append(name.ljust(10) + "".join(
+                ("%.2f" % value).rjust(7) for value in summary[name]))
+        if not isinstance(self.first_frame, type(None)):
+            lines.append("first frame %.1f ms" % (self.first_frame * 1000))
+        if not self.local_game:
+            net = self.net_loop.stats.summary
+            if net:
+                lines.append("rtt %.1f ms, p95 %.1f, jitter %.1f" % (
+                    net["rtt"], net["rtt p95"], net["jitter"]))
+                lines.append("loss %.1f%%" % net["loss"])
+                lines.append("out %d pkt/s %d B/s, rate %d/s" % (
+                    net["packets out/s"], net["bytes out/s"],
+                    net.get("send rate", 0)))
+                lines.append("in  %d pkt/s %d B/s" % (
+                    net["packets in/s"], net["bytes in/s"]))
+        return lines
+
+    def export_stats(self):
+        name = "perf-" + time.strftime("%Y%m%d-%H%M%S")
+        for extension in [".csv", ".json"]:
+            self.frame_stats.export(name + extension)
+        print("Saved " + name + ".csv and .json")
+
+    def run(self, display, fps=FPS):
+        """Plays until the window is closed or the connection is lost
+
+        Frames are drawn at most fps times a second. Input is read just
+        after waiting for a frame, so the cap does not delay it. The
+        simulation keeps its own fixed rate and the network its own thread.
+        """
+        if not self.local_game:
+            self.net_loop.start()
+        renderer = DirtyRenderer(display)
+        scheduler = FrameScheduler(fps)
+        stats = self.frame_stats
+        running = True
+        while running:
+            secs = scheduler.wait()
+            stats.begin(secs)
+            events = []
+            for event in pygame.event.get():
+                if event.type == pygame.VIDEORESIZE:
+                    display = open_display(event.dict["size"])[0]
+                    renderer.resize(display)
+                    self.resize(event.dict["size"])
+                else:
+                    events.append(event)
+            running = self.control(events)
+            stats.lap("input")
+            if not self.receive():
+                print("Lost connection")
+                running = False
+            stats.lap("network")
+
+            collide_time = self.world.collide_time
+            self.update(secs)
+            stats.lap("physics")
+            stats.move(self.world.collide_time - collide_time, "physics",
+                       "collision")
+            if self.spectators:
+                self.spectators.publish(self.world.bodies, self.side_scores())
+                stats.lap("network")
+
+            renderer.clear()
+            renderer.add(self.render(display))
+            stats.lap("render")
+            renderer.present()
+            stats.lap("flip")
+            if isinstance(self.first_frame, type(None)) and self.ready_time:
+                self.first_frame = time.perf_counter() - self.ready_time
+                print("First frame %.1f ms after both poets were known, "
+                      "%.1f ms of it waiting on portraits" % (
+                          self.first_frame * 1000,
+                          asset_manager.wait_time * 1000))
+            if self.local_game:
+                stats.end()
+            else:
+                stats.end(self.net_loop.stats.summary)
+
+        if not self.local_game:
+            self.net_loop.stop()
+        if self.recorder:
+            self.recorder.close()
+        if self.spectators:
+            self.spectators.close()
+
+
+def connect(local_player):
+    """Asks how to reach the other player and swaps poets with them
+
+    :return: (transport, hosting, lockstep)
+    """
+    use_udp = check_input("Udp", "TCP or UDP? ", ["TCP", "UDP"])
+    # Both players must answer this the same way
+    lockstep = check_input("Yes", "Send inputs only (lockstep)? ",
+                           ["Yes", "No"])
+    hosting = False
+    if use_udp:
+        server_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    else:
+        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_port = get_int("Enter the port: ")
     server_host = socket.gethostbyname(socket.gethostname())
     if not check_input("Yes", "Use system IP: " + server_host + ":" + str(
@@ -477,185 +573,78 @@ if not LOCAL_GAME:
             raise Exception("Server already running.")
             # See comment below
 
-        server_sock.listen()
-        connection, address = server_sock.accept()
-        print("Player connected from " + str(address) + ".")
-        try:
-            data = connection.recv(BUFFER_SIZE)
-        except ConnectionResetError:
-            raise Exception("Server has closed")
-
-        poet = data.decode().strip().title()
-        remote_player = Player(connection, poet)
-
-        data_string = local_player.poet.ljust(BUFFER_SIZE, " ")
-        SEND_LOCK.acquire()
-        try:
-            connection.sendall(data_string.encode())
-        except ConnectionResetError:
-            print("Player left")
-            quit_running = True
-            raise SystemExit
-        SEND_LOCK.release()
+        if use_udp:
+            transport = UdpTransport(server_sock)
+        else:
+            server_sock.listen()
+            connection, address = server_sock.accept()
+            print("Player connected from " + str(address) + ".")
+            transport = TcpTransport(connection)
 
     else:
         # Join
         print("Joining")
-        try:
-            server_sock.connect((server_host, server_port))
-        except OSError:
-            raise Exception("Could not connect")
-            # Look, my users won't know what a OSError is anyways
-        data_string = local_player.poet.ljust(BUFFER_SIZE, " ")
-        SEND_LOCK.acquire()
-        try:
-            server_sock.sendall(data_string.encode())
-        except ConnectionResetError:
-            print("Player left")
-            quit_running = True
-            raise SystemExit
-        SEND_LOCK.release()
-
-        try:
-            data = server_sock.recv(BUFFER_SIZE)
-        except ConnectionResetError:
-            raise Exception("Server has closed")
-
-        poet = data.decode().strip().title()
-
-        remote_player = Player(server_sock, poet)
-else:
-    remote_player = Player(_poet=choose_poet())
-
-display = pygame.display.set_mode(RESOLUTION, FLAGS)
-
-quit_running = False
-
-reset()
-if not LOCAL_GAME:
-    remote_player.start()
-    local_player.start()
-balls = [local_player, remote_player]
-secs = 0
-sim_time = get_millis()
-
-key_downs = set()
-
-while not quit_running:
-    key_presses = set()
-    for event in pygame.event.get():
-        if event.type == pygame.VIDEORESIZE:
-            display = pygame.display.set_mode(event.dict["size"], FLAGS)
-            RESOLUTION = event.dict["size"]
-            reset()
-        elif event.type == pygame.QUIT:
-            quit_running = True
-            break
-        elif event.type == pygame.KEYDOWN:
-            key = event.dict["key"]
-            if key == pygame.K_ESCAPE:
-                quit_running = True
-                break
-            else:
-                if key not in key_downs:
-                    key_presses.add(key)
-                key_downs.add(key)
-        elif event.type == pygame.KEYUP:
-            key_downs.remove(event.dict["key"])
-
-    if pygame.K_a in key_downs:
-        if local_player.on_ground(
-                moved=pygame.K_a in key_presses) or local_player.era != "Victorian":
-            local_player.vel[0] -= BALL_ACCEL * secs * get_att(local_player, "accel", 1)
-    if pygame.K_d in key_downs:
-        if local_player.on_ground(
-                moved=pygame.K_d in key_presses) or local_player.era != "Victorian":
-            local_player.vel[0] += BALL_ACCEL * secs * get_att(local_player, "accel", 1)
-    if pygame.K_w in key_presses or pygame.K_SPACE in key_presses or (
-            local_player.era != "Victorian" and (
-            pygame.K_w in key_downs or pygame.K_SPACE in key_downs)):
-        if local_player.on_ground(moved=True):
-            jump(local_player)
-    if get_att(local_player, "mad jack", False) and local_player.on_ground():
-        jump(local_player, get_att(local_player, "mad jack", 1))
-
-    if LOCAL_GAME:
-        if pygame.K_LEFT in key_downs:
-            if remote_player.on_ground(
-                    moved=pygame.K_LEFT in key_presses) or remote_player.era != "Victorian":
-                remote_player.vel[0] -= BALL_ACCEL * secs * get_att(remote_player, "accel", 1)
-        if pygame.K_RIGHT in key_downs:
-            if remote_player.on_ground(
-                    moved=pygame.K_RIGHT in key_presses) or remote_player.era != "Victorian":
-                remote_player.vel[0] += BALL_ACCEL * secs * get_att(remote_player, "accel", 1)
-        if pygame.K_UP in key_presses or (
-                remote_player.era != "Victorian" and pygame.K_UP in key_downs):
-            if remote_player.on_ground(moved=True):
-                jump(remote_player)
-        if get_att(remote_player, "mad jack", False) and remote_player.on_ground():
-            jump(remote_player, get_att(remote_player, "mad jack", 1))
-
-    new_sim_time = get_millis()
-    secs = (new_sim_time - sim_time) / time_scale
-    sim_time = new_sim_time
-
-    collisions = []
-    win = False
-    i = 0
-    while not win:
-        j = 0
-        while not win:
-            collisions = balls[i].collide(balls[j], collisions)
-            if collisions == "WIN":
-                my_wins += 1
-                win = True
-                break
-            elif collisions == "LOST":
-                # Only can occur in local game
-                enemy_wins += 1
-                win = True
-                break
-            if balls[i].tick(secs, balls):
-                i -= 1
-            balls[i].render()
-            j += 1
-            if j >= len(balls):
-                break
-        i += 1
-        if i >= len(balls):
-            break
-
-    if win:
-        reset()
-        if not LOCAL_GAME:
-            SEND_LOCK.acquire()
+        if use_udp:
+            transport = UdpTransport(server_sock, (server_host, server_port))
+        else:
             try:
-                remote_player.connection.sendall(
-                    "WIN".ljust(BUFFER_SIZE, " ").encode())
-            except ConnectionResetError:
-                print("Player left")
-                quit_running = True
-                raise SystemExit
-            SEND_LOCK.release()
-    font = pygame.font.SysFont("monospace", PING_SIZE//2)
-    if not LOCAL_GAME:
-        if get_millis() - ping_time >= PING_UPDATE:
-            pings = str(int(send_int)).rjust(5) + " | " + str(
-                int(recv_int)).rjust(5)
-            ping_time = get_millis()
-        label = font.render(pings, 1, (255, 255, 255))
-        width, height = font.size(pings)
-        display.blit(label, (int(display.get_width() - width), height))
-    font = pygame.font.SysFont("monospace", PING_SIZE)
-    score = str(my_wins).strip(" ")
-    label = font.render(score, 1, LEFT_COLOR)
-    width1, height = font.size(score)
-    display.blit(label, (0, height))
-    score = " " + str(enemy_wins).strip(" ")
-    label = font.render(score, 1, RIGHT_COLOR)
-    width2, height = font.size(score)
-    display.blit(label, (width1, height))
-
-    pygame.display.flip()
-    display.fill((0, 0, 0))
-    # time.sleep(SLEEP_TIME)
+                server_sock.connect((server_host, server_port))
+            except OSError:
+                raise Exception("Could not connect")
+                # Look, my users won't know what a OSError is anyways
+            transport = TcpTransport(server_sock)
+
+    try:
+        poet = transport.handshake(local_player.poet)
+    except ConnectionResetError:
+        poet = None
+    if isinstance(poet, type(None)):
+        raise Exception("Server has closed")
+    if not isinstance(transport.side, type(None)):
+        # Joined a dedicated server, which picks the sides
+        hosting = transport.side == HOST_SIDE
+    return transport, hosting, lockstep
+
+
+def main(args=None):
+    """Asks how to play and plays"""
+    parser = argparse.ArgumentParser(description="Play Poetry Project")
+    parser.add_argument("--record", metavar="PATH",
+                        help="Record the match to PATH, for replay.py")
+    parser.add_argument("--relay", metavar="HOST:PORT",
+                        help="Broadcast the match to a spectate.py relay")
+    args = parser.parse_args(args)
+    init_pygame()
+    local_game = check_input("Yes", "Run local game? ", ["Yes", "No"])
+    local_player = Player(_poet=choose_poet())
+    # Decoded while the other poet is chosen or the handshake runs
+    asset_manager.preload([local_player.poet])
+    if local_game:
+        remote_player = Player(_poet=choose_poet())
+    else:
+        transport, hosting, lockstep = connect(local_player)
+        remote_player = Player(transport.poet.strip().title())
+    asset_manager.preload([remote_player.poet])
+    ready_time = time.perf_counter()
+
+    # Opened before the players are reset, so their sprites are converted
+    display, fps = open_display(RESOLUTION)
+    if local_game:
+        game = Game(local_player, remote_player)
+    else:
+        game = Game(local_player, remote_player, hosting,
+                    NetLoop(transport), lockstep)
+    if args.record:
+        game.recorder = Recorder(args.record, game)
+    if args.relay:
+        host, port = args.relay.rsplit(":", 1)
+        game.spectators = SpectatorFeed(
+            socket.create_connection((host, int(port))),
+            [game.host_player.poet, game.join_player.poet])
+    game.ready_time = ready_time
+    game.run(display, fps)
+    asset_manager.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,796 @@
+import heapq
+import math
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from protocol import Encoder, Message, ProtocolError, decode, is_newer, \
+    STATE, POET, ACK, INPUT, MATCH, PING, PONG, MAX_SIZE
+from snapshots import extrapolate, INTERP_DELAY, MAX_EXTRAPOLATE
+from stats import NetStats, PING_INTERVAL
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None  # Not on Windows, where the send buffer goes unread
+
+RECV_BUFFER = 4096
+
+RESEND_TIME = .1  # Seconds before an unacknowledged message is resent
+TIMEOUT = 5  # Seconds of silence before a UDP peer is considered gone
+STREAM_RESEND = .2  # Stall a simulated TCP loss causes before resending
+SEND_RATE = 60  # Most states sent per second, when fast or close
+CALM_RATE = 1 / INTERP_DELAY  # States per second otherwise
+MIN_SEND_RATE = 10  # Least the congestion estimator backs off to
+KEEPALIVE = MAX_EXTRAPOLATE * .8  # Longest unsent, so the peer never freezes
+POS_TOLERANCE = 2  # Pixels a state may be off the peer's guess and go unsent
+VEL_TOLERANCE = .05  # Grid units per second, likewise
+REST_TOLERANCE = .5  # Grid units per second a ball settled on the ground jigs
+REST_KEEPALIVE = 1  # Longest a ball at rest goes unsent
+FAST_SPEED = 3  # Grid units per second a ball is sent at SEND_RATE above
+QUEUE_LIMIT = 1024  # Bytes waiting in the send buffer that mean congestion
+RTT_GROWTH = 2  # Smoothed round trip over the lowest seen that means it too
+RTT_MARGIN = .03  # Seconds added to that, so LAN jitter does not
+RTT_GAIN = 1 / 4  # Less smoothing than TCP, as pings are few
+BACKOFF = .5  # Rate kept after a congestion signal
+BACKOFF_TIME = .5  # Least seconds between two backoffs, for one to tell
+RECOVERY = 10  # States per second regained each second uncongested
+
+
+def queued_bytes(sock):
+    """Returns the bytes in sock's send buffer not yet sent, or 0 if the
+    platform cannot tell"""
+    if isinstance(fcntl, type(None)):
+        return 0
+    try:
+        return struct.unpack("i", fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ,
+                                              bytes(4)))[0]
+    except OSError:
+        return 0
+
+
+class FrameReader:
+    """Splits a TCP byte stream back into protocol messages
+
+    Bytes are received into one reusable buffer. Every whole message is
+    parsed on each read and a partial message at the end is kept for the
+    next read. Only the newest state is kept, so a backlog of states is
+    skipped over rather than replayed.
+    """
+
+    def __init__(self, sock, size=RECV_BUFFER):
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.scratch = Message()
+        self.state = Message()
+        self.new_state = False
+        self.events = []
+        self.inputs = []
+        self.pings = []
+        self.pongs = []
+        self.poet = None
+        self.side = None
+        self.bytes_received = 0
+        self.messages_received = 0
+
+    def fill(self):
+        """Blocks until more bytes arrive and parses them
+
+        :return: False if the connection closed
+        """
+        if self.end == len(self.buffer):
+            # Move the partial message to the front to make room
+            tail = self.end - self.start
+            self.buffer[:tail] = self.buffer[self.start:self.end]
+            self.start = 0
+            self.end = tail
+        received = self.sock.recv_into(self.view[self.end:])
+        if not received:
+            return False
+        self.end += received
+        self.bytes_received += received
+        self.parse()
+        return True
+
+    def parse(self):
+        while True:
+            size = decode(self.view[self.start:self.end], self.scratch)
+            if not size:
+                break
+            self.start += size
+            self.messages_received += 1
+            if self.scratch.kind == STATE:
+                self.state.sequence = self.scratch.sequence
+                self.state.values[:] = self.scratch.values
+                self.new_state = True
+            elif self.scratch.kind == INPUT:
+                self.inputs.append((self.scratch.frame, self.scratch.controls))
+            elif self.scratch.kind == PING:
+                self.pings.append(self.scratch.stamp)
+            elif self.scratch.kind == PONG:
+                self.pongs.append(self.scratch.stamp)
+            else:
+                if self.scratch.kind == POET:
+                    self.poet = self.scratch.poet
+                elif self.scratch.kind == MATCH:
+                    self.side = self.scratch.side
+                # States from before an event are out of date after it
+                self.events.append(self.scratch.kind)
+                self.new_state = False
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def take_events(self):
+        """Returns the kinds of the non-state messages received, in order"""
+        events = self.events
+        self.events = []
+        return events
+
+    def take_inputs(self):
+        """Returns the (frame, controls) input messages received, in order"""
+        inputs = self.inputs
+        self.inputs = []
+        return inputs
+
+    def take_pongs(self):
+        """Returns the stamps of the ping answers received, in order"""
+        pongs = self.pongs
+        self.pongs = []
+        return pongs
+
+    def take_state(self):
+        """Returns the newest unread state message, or None"""
+        if not self.new_state:
+            return None
+        self.new_state = False
+        return self.state
+
+
+class Transport:
+    """Interface used to talk to the other player
+
+    receive() reads and handles one read's worth of incoming data and
+    tick() does any periodic upkeep; both return False once the connection
+    is gone. poll() does both, blocking until data arrives. Received win
+    and poet messages are queued for take_events(), input messages for
+    take_inputs(), and only the newest state is kept for take_state().
+    Pings are answered as they arrive and the stamps of answers to our own
+    pings are queued for take_pongs().
+    """
+
+    poet = None
+    side = None  # Set by a dedicated server
+    bytes_sent = 0
+    bytes_received = 0
+    packets_sent = 0
+    packets_received = 0  # Messages, for a stream
+
+    def can_send(self):
+        return True
+
+    def tick(self):
+        return True
+
+    def poll(self):
+        return self.tick() and self.receive()
+
+    def handshake(self, name):
+        """Swaps poet names with the peer
+
+        :return: The peer's poet, or None if the connection closed
+        """
+        sent = False
+        while True:
+            if not sent and self.can_send():
+                self.send_poet(name)
+                sent = True
+            if sent and not isinstance(self.poet, type(None)):
+                return self.poet
+            if not self.poll():
+                return None
+
+
+class TcpTransport(Transport):
+    """Sends every message over one TCP connection"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = FrameReader(sock)
+        self.encoder = Encoder()
+        self.lock = threading.Lock()
+
+    @property
+    def poet(self):
+        return self.reader.poet
+
+    @property
+    def side(self):
+        return self.reader.side
+
+    @property
+    def bytes_received(self):
+        return self.reader.bytes_received
+
+    @property
+    def packets_received(self):
+        return self.reader.messages_received
+
+    def send(self, kind, *args):
+        with self.lock:
+            data = getattr(self.encoder, kind)(*args)
+            self.sock.sendall(data)
+            self.bytes_sent += len(data)
+            self.packets_sent += 1
+
+    def send_state(self, pos, vel):
+        self.send("state", pos, vel)
+
+    def send_win(self):
+        self.send("win")
+
+    def send_poet(self, name):
+        self.send("poet", name)
+
+    def send_input(self, frame, controls):
+        self.send("input", frame, controls)
+
+    def send_match(self, side):
+        self.send("match", side)
+
+    def send_ping(self, stamp):
+        self.send("ping", stamp)
+
+    def receive(self):
+        if not self.reader.fill():
+            return False
+        for stamp in self.reader.pings:
+            self.send("pong", stamp)
+        self.reader.pings.clear()
+        return True
+
+    def take_events(self):
+        return self.reader.take_events()
+
+    def take_inputs(self):
+        return self.reader.take_inputs()
+
+    def take_pongs(self):
+        return self.reader.take_pongs()
+
+    def take_state(self):
+        return self.reader.take_state()
+
+    def close(self):
+        self.sock.close()
+
+
+class UdpTransport(Transport):
+    """Sends states as datagrams and events over a small reliable channel
+
+    A state older than the newest one received is dropped, so one lost
+    datagram never holds up the ones after it. Wins, poets and inputs are
+    resent every RESEND_TIME until the peer acknowledges them. Pings are
+    not, as a lost ping is what they are there to measure.
+
+    Reliable messages are numbered on their own, with no gaps, so the
+    receiver drops a resent one however late it comes by keeping just the
+    highest sequence it has everything up to and the few handled past it.
+
+    :param peer: Address to send to. If None, the first address heard from
+    """
+
+    def __init__(self, sock, peer=None):
+        self.sock = sock
+        self.sock.settimeout(RESEND_TIME)
+        self.peer = peer
+        self.encoder = Encoder()
+        self.reliable = Encoder()  # Numbers only the reliable messages
+        self.lock = threading.Lock()
+        self.buffer = bytearray(MAX_SIZE)
+        self.view = memoryview(self.buffer)
+        self.scratch = Message()
+        self.state = Message()
+        self.state_sequence = None
+        self.new_state = False
+        self.events = []
+        self.inputs = []
+        self.pongs = []
+        self.poet = None
+        self.side = None
+        self.pending = {}
+        self.delivered = 0  # Every reliable sequence up to this was handled
+        self.ahead = set()  # Reliable sequences handled past delivered
+        self.heard = None  # When the peer was last heard from
+
+    def can_send(self):
+        return not isinstance(self.peer, type(None))
+
+    def sendto(self, data):
+        """Sends one datagram to the peer. Call with the lock held"""
+        self.sock.sendto(data, self.peer)
+        self.bytes_sent += len(data)
+        self.packets_sent += 1
+
+    def send_state(self, pos, vel):
+        if not self.can_send():
+            return
+        with self.lock:
+            self.sendto(self.encoder.state(pos, vel))
+
+    def send_ping(self, stamp):
+        if not self.can_send():
+            return
+        with self.lock:
+            self.sendto(self.encoder.ping(stamp))
+
+    def send_reliable(self, kind, *args):
+        with self.lock:
+            data = bytes(getattr(self.reliable, kind)(*args))
+            self.pending[self.reliable.sequence] = [data, time.monotonic()]
+            self.sendto(data)
+
+    def send_win(self):
+        self.send_reliable("win")
+
+    def send_poet(self, name):
+        self.send_reliable("poet", name)
+
+    def send_input(self, frame, controls):
+        self.send_reliable("input", frame, controls)
+
+    def send_match(self, side):
+        self.send_reliable("match", side)
+
+    def resend(self):
+        now = time.monotonic()
+        with self.lock:
+            for sequence in self.pending:
+                data, sent = self.pending[sequence]
+                if now - sent >= RESEND_TIME:
+                    self.sendto(data)
+                    self.pending[sequence][1] = now
+
+    def tick(self):
+        """Resends unacknowledged messages
+
+        :return: False if the peer has been silent for TIMEOUT
+        """
+        self.resend()
+        return self.alive()
+
+    def alive(self):
+        """Checks the peer has not gone silent for TIMEOUT
+
+        Until a peer has been heard from, there is no one to time out, so
+        a host can wait for a joiner as long as it takes.
+        """
+        return isinstance(self.heard, type(None)) or \
+            time.monotonic() - self.heard < TIMEOUT
+
+    def receive(self):
+        """Handles one datagram, waiting up to RESEND_TIME for it"""
+        try:
+            size, address = self.sock.recvfrom_into(self.view)
+        except socket.timeout:
+            return self.alive()
+        if isinstance(self.peer, type(None)):
+            self.peer = address
+        elif address != self.peer:
+            return True
+        try:
+            if not decode(self.view[:size], self.scratch):
+                return True
+        except ProtocolError:
+            return True  # Not one of ours
+        self.bytes_received += size
+        self.packets_received += 1
+        self.heard = time.monotonic()
+        self.handle(self.scratch)
+        return True
+
+    def handle(self, message):
+        if message.kind == ACK:
+            with self.lock:
+                self.pending.pop(message.sequence, None)
+        elif message.kind == STATE:
+            if isinstance(self.state_sequence, type(None)) or is_newer(
+                    message.sequence, self.state_sequence):
+                self.state_sequence = message.sequence
+                self.state.sequence = message.sequence
+                self.state.values[:] = message.values
+                self.new_state = True
+        elif message.kind == PING:
+            with self.lock:
+                self.sendto(self.encoder.pong(message.stamp))
+        elif message.kind == PONG:
+            self.pongs.append(message.stamp)
+        else:
+            with self.lock:
+                self.sendto(self.encoder.ack(message.sequence))
+            if self.duplicate(message.sequence):
+                return  # Resent because our ack was lost
+            if message.kind == INPUT:
+                self.inputs.append((message.frame, message.controls))
+                return
+            if message.kind == POET:
+                self.poet = message.poet
+            elif message.kind == MATCH:
+                self.side = message.side
+            self.events.append(message.kind)
+            self.new_state = False
+
+    def duplicate(self, sequence):
+        """Checks if a reliable sequence was handled, marking it if not"""
+        if not is_newer(sequence, self.delivered) or sequence in self.ahead:
+            return True
+        self.ahead.add(sequence)
+        following = (self.delivered + 1) & 0xFFFFFFFF
+        while following in self.ahead:
+            self.ahead.remove(following)
+            self.delivered = following
+            following = (following + 1) & 0xFFFFFFFF
+        return False
+
+    def take_events(self):
+        events = self.events
+        self.events = []
+        return events
+
+    def take_inputs(self):
+        inputs = self.inputs
+        self.inputs = []
+        return inputs
+
+    def take_pongs(self):
+        pongs = self.pongs
+        self.pongs = []
+        return pongs
+
+    def take_state(self):
+        if not self.new_state:
+            return None
+        self.new_state = False
+        return self.state
+
+    def close(self):
+        self.sock.close()
+
+
+class CongestionEstimator:
+    """Works out how many states a second the connection will take
+
+    It is fed the bytes waiting in the socket's send buffer before each
+    send, and every round trip time measured. A buffer holding more than
+    QUEUE_LIMIT, or a smoothed round trip grown well past the lowest seen,
+    cuts the rate by BACKOFF, at most once every BACKOFF_TIME. Otherwise
+    it climbs back by RECOVERY a second, as TCP's congestion window does.
+    """
+
+    def __init__(self, max_rate=SEND_RATE, min_rate=MIN_SEND_RATE):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.queued = 0
+        self.rtt = None  # Smoothed, in seconds
+        self.base_rtt = None
+        self.congested = False
+        self.backoffs = 0
+        self.backoff_time = None
+        self.update_time = None
+
+    def rtt_sample(self, rtt):
+        if isinstance(self.rtt, type(None)):
+            self.rtt = self.base_rtt = rtt
+            return
+        self.rtt += (rtt - self.rtt) * RTT_GAIN
+        self.base_rtt = min(self.base_rtt, rtt)
+
+    def update(self, now, queued):
+        """Feeds the send buffer's occupancy and returns the rate to use"""
+        self.queued = queued
+        self.congested = queued > QUEUE_LIMIT or (
+            not isinstance(self.rtt, type(None)) and
+            self.rtt > self.base_rtt * RTT_GROWTH + RTT_MARGIN)
+        if self.congested:
+            if isinstance(self.backoff_time, type(None)) or \
+                    now - self.backoff_time >= BACKOFF_TIME:
+                self.rate = max(self.rate * BACKOFF, self.min_rate)
+                self.backoff_time = now
+                self.backoffs += 1
+        elif not isinstance(self.update_time, type(None)):
+            self.rate = min(self.rate + RECOVERY * (now - self.update_time),
+                            self.max_rate)
+        self.update_time = now
+        return self.rate
+
+
+class NetLoop:
+    """Runs all of a match's network IO on one thread
+
+    The game loop never touches the transport. It hands over its state with
+    set_state(), which only keeps the latest. Received states are handed
+    back by replacing a single tuple, and events go through a deque, so
+    neither side takes a lock. The peer is pinged every PING_INTERVAL and
+    stats.summary keeps the resulting round trip, loss and traffic figures.
+
+    States go out at send_rate while the ball is fast or in a close fight
+    and at CALM_RATE otherwise, both capped by a CongestionEstimator. A
+    state is skipped if the peer, dead reckoning from the last one sent,
+    already shows it within POS_TOLERANCE and VEL_TOLERANCE, so a ball in
+    free flight is only sent every KEEPALIVE. A ball that has come to rest
+    has its last state sent again, which the peer takes as holding still,
+    and then only every REST_KEEPALIVE.
+    """
+
+    def __init__(self, transport, send_rate=SEND_RATE):
+        self.transport = transport
+        self.congestion = CongestionEstimator(send_rate)
+        self.interval = 1 / send_rate
+        self.selector = selectors.DefaultSelector()
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.selector.register(self.transport.sock, selectors.EVENT_READ)
+        self.selector.register(self.wake_recv, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.running = False
+        self.closed = False
+        self.outgoing = None
+        self.sent = None
+        self.sent_time = 0
+        self.outbox = deque()
+        self.incoming = None
+        self.received = 0
+        self.taken = 0
+        self.events = deque()
+        self.inputs = deque()
+        self.skipped = 0  # States the peer could guess, left unsent
+        self.resting = False  # The last state sent went out twice
+        self.stats = NetStats()
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops the loop and closes the transport"""
+        self.running = False
+        self.wake()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.selector.close()
+        self.wake_recv.close()
+        self.wake_send.close()
+        self.transport.close()
+
+    def wake(self):
+        try:
+            self.wake_send.send(b"\0")
+        except OSError:
+            pass
+
+    def set_state(self, pos, vel, grid_scale, urgent=False, now=None):
+        """Hands over the local ball's latest state to send
+
+        :param grid_scale: Pixels per grid unit, to dead reckon the ball
+        :param urgent: Send at the full rate, as in a close fight
+        :param now: When the state is from. Now if None
+        """
+        if isinstance(now, type(None)):
+            now = time.monotonic()
+        self.outgoing = (tuple(pos), tuple(vel), grid_scale, urgent, now)
+
+    def send_win(self):
+        self.outbox.append(("win",))
+        self.wake()
+
+    def send_input(self, frame, controls):
+        self.outbox.append(("input", frame, controls))
+        self.wake()
+
+    def take_state(self):
+        """Returns the newest (arrival time, pos, vel) not yet taken, or None"""
+        incoming = self.incoming
+        if isinstance(incoming, type(None)) or incoming[0] == self.taken:
+            return None
+        self.taken = incoming[0]
+        return incoming[1:]
+
+    def take_events(self):
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+    def take_inputs(self):
+        inputs = []
+        while self.inputs:
+            inputs.append(self.inputs.popleft())
+        return inputs
+
+    def run(self):
+        """Sends and receives until stopped or the connection is lost
+
+        Whatever ends the loop, closed is set so the game loop sees it.
+        """
+        next_send = time.monotonic()
+        next_ping = next_send
+        try:
+            while self.running:
+                timeout = max(0, min(next_send, next_ping) - time.monotonic())
+                for key, mask in self.selector.select(timeout):
+                    if key.fileobj is self.wake_recv:
+                        self.wake_recv.recv(RECV_BUFFER)
+                    elif not self.transport.receive():
+                        self.closed = True
+                self.collect()
+
+                while self.outbox:
+                    kind, *args = self.outbox.popleft()
+                    getattr(self.transport, "send_" + kind)(*args)
+
+                now = time.monotonic()
+                if now >= next_send:
+                    self.flush(now)
+                    next_send = now + self.interval
+                if now >= next_ping:
+                    self.transport.send_ping(now)
+                    self.stats.ping_sent(now)
+                    self.stats.update(now, self.transport,
+                                      1 / self.interval)
+                    next_ping = now + PING_INTERVAL
+                if not self.transport.tick():
+                    self.closed = True
+
+                if self.closed:
+                    self.running = False
+        except (ProtocolError, OSError):
+            pass  # A reset, broken pipe or garbled stream all end the match
+        finally:
+            self.closed = True
+            self.running = False
+
+    def collect(self):
+        """Passes what the transport received on to the game loop"""
+        for kind in self.transport.take_events():
+            self.events.append(kind)
+        for frame_input in self.transport.take_inputs():
+            self.inputs.append(frame_input)
+        for stamp in self.transport.take_pongs():
+            rtt = self.stats.pong(stamp, time.monotonic())
+            if not isinstance(rtt, type(None)):
+                self.congestion.rtt_sample(rtt)
+        state = self.transport.take_state()
+        if not isinstance(state, type(None)):
+            now = time.monotonic()
+            self.received += 1
+            self.incoming = (self.received, now, tuple(state.values[0:2]),
+                             tuple(state.values[2:4]))
+
+    def flush(self, now):
+        """Sends the latest state unless the peer can guess it, and sets
+        the interval to the next flush
+
+        :return: True if a state was sent
+        """
+        outgoing = self.outgoing
+        if isinstance(outgoing, type(None)):
+            return False
+        pos, vel, grid_scale, urgent, stamp = outgoing
+        rate = self.congestion.max_rate \
+            if urgent or math.hypot(*vel) > FAST_SPEED else CALM_RATE
+        rate = min(rate, self.congestion.update(
+            now, queued_bytes(self.transport.sock)))
+        self.interval = 1 / rate
+        if not isinstance(self.sent, type(None)):
+            quiet = now - self.sent_time
+            if quiet < KEEPALIVE and self.predicts(pos, vel, stamp):
+                self.skipped += 1
+                return False
+            if self.unchanged(pos, vel):
+                if self.resting and quiet < REST_KEEPALIVE:
+                    self.skipped += 1
+                    return False
+                self.transport.send_state(*self.sent[0:2])
+                self.sent_time = now
+                self.resting = True
+                return True
+        self.transport.send_state(pos, vel)
+        self.sent = outgoing
+        self.sent_time = now
+        self.resting = False
+        return True
+
+    def predicts(self, pos, vel, stamp):
+        """Checks if dead reckoning from the last state sent lands close
+        enough to pos and vel at stamp that the peer need not be told"""
+        sent_pos, sent_vel, grid_scale, urgent, sent_stamp = self.sent
+        guess_pos, guess_vel = extrapolate(sent_pos, sent_vel,
+                                           stamp - sent_stamp, grid_scale)
+        return math.dist(guess_pos, pos) <= POS_TOLERANCE and \
+            math.dist(guess_vel, vel) <= VEL_TOLERANCE
+
+    def unchanged(self, pos, vel):
+        """Checks if the ball is still where the last state sent put it"""
+        return math.dist(self.sent[0], pos) <= POS_TOLERANCE and \
+            math.dist(self.sent[1], vel) <= REST_TOLERANCE
+
+
+class LossySocket:
+    """Wraps a socket so outgoing data is dropped and delayed, for testing
+
+    Datagrams are dropped with probability loss. On a stream a loss is
+    instead resent after STREAM_RESEND, holding up everything sent after
+    it the way TCP does. Everything else behaves like the wrapped socket.
+    """
+
+    def __init__(self, sock, loss=0, latency=0, jitter=0, seed=None):
+        self.sock = sock
+        self.stream = sock.type == socket.SOCK_STREAM
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.queue = []
+        self.order = 0
+        self.last_due = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.deliver, daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def put(self, data, address):
+        due = time.monotonic() + self.latency + self.random.uniform(
+            -self.jitter, self.jitter)
+        if self.random.random() < self.loss:
+            if not self.stream:
+                return
+            due += STREAM_RESEND
+        if self.stream:
+            due = max(due, self.last_due)
+            self.last_due = due
+        with self.condition:
+            self.order += 1
+            heapq.heappush(self.queue, (due, self.order, bytes(data), address))
+            self.condition.notify()
+
+    def sendall(self, data):
+        self.put(data, None)
+
+    def sendto(self, data, address):
+        self.put(data, address)
+        return len(data)
+
+    def deliver(self):
+        with self.condition:
+            while self.running:
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+                wait = self.queue[0][0] - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                due, order, data, address = heapq.heappop(self.queue)
+                try:
+                    if self.stream:
+                        self.sock.sendall(data)
+                    else:
+                        self.sock.sendto(data, address)
+                except OSError:
+                    pass
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.sock.close()
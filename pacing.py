@@ -0,0 +1,53 @@
+import time
+
+FPS = 120
+MIN_SPIN = .0002  # Shortest time spun before a frame
+MAX_SPIN = .004  # Longest, for systems whose sleeps wake very late
+SPIN_MARGIN = 2  # Spin for this many times how late sleeps have woken
+SPIN_SMOOTHING = .1
+
+
+class FrameScheduler:
+    """Paces a loop to a fixed number of frames per second
+
+    Sleeping is cheap but can wake late by up to a scheduler tick, while
+    spinning is exact but burns a core. So wait() sleeps until shortly
+    before the next frame is due and spins for the rest. How long it spins
+    follows how late its sleeps have been waking up.
+
+    :param fps: Frames per second, or 0 not to wait at all, such as when
+        the display waits for vsync itself
+    """
+
+    def __init__(self, fps=FPS):
+        self.interval = 1 / fps if fps else 0
+        self.spin = MAX_SPIN
+        self.last = time.perf_counter()
+        self.deadline = self.last
+
+    def wait(self):
+        """Waits for the next frame to be due
+
+        :return: Seconds since the previous frame
+        """
+        if self.interval:
+            self.deadline += self.interval
+            now = time.perf_counter()
+            if now >= self.deadline:
+                # Running behind. Start counting again rather than rushing
+                self.deadline = now
+            else:
+                wake = self.deadline - self.spin
+                if wake > now:
+                    time.sleep(wake - now)
+                    late = max(0, time.perf_counter() - wake)
+                    self.spin += (late * SPIN_MARGIN - self.spin) * \
+                        SPIN_SMOOTHING
+                    self.spin = min(MAX_SPIN, max(MIN_SPIN, self.spin))
+                while time.perf_counter() < self.deadline:
+                    time.sleep(0)
+
+        now = time.perf_counter()
+        secs = now - self.last
+        self.last = now
+        return secs
@@ -0,0 +1,572 @@
+import heapq
+import math
+import time
+
+from poetry import find_poet, DEFAULT_ATTS
+
+y_gravity = -9.81
+x_gravity = 0
+WALLS = ["WALL", "HOLE", "WALL", "WALL"]
+EFFICIENCY = .2
+MIN_FORCE = .1
+WALL_WEIGHT = 500
+BALL_ACCEL = 10
+JUMP_VEL = 4
+
+WIN_ARC = .5
+
+PLAYER_SIZE = 20
+GROUND_FACTOR = DEFAULT_ATTS["ground factor"]
+
+BROAD_PHASE_MIN = 8  # Fewest bodies worth building the spatial hash for
+MAX_IMPACTS = 8  # Contacts resolved per body per step, on average
+
+TICK_RATE = 240
+RESOLUTION = [1600, 900]  # Arena size matches are played at
+MAX_FRAME = .25  # Longest frame the accumulator will catch up on
+
+
+def elastic_bounce(m1, v1, m2, v2, eff):
+    """Returns the final vel of 1 after an elastic bounce"""
+    force = (((m1 - m2) / (m1 + m2)) * v1) + (
+            ((2 * m2) / (m1 + m2)) * v2)
+    if abs(force) <= MIN_FORCE:
+        return 0
+    return force * EFFICIENCY * eff
+
+
+def angle_of_points(point1, point2):
+    return math.atan2(point2[0] - point1[0], point2[1] - point1[1])
+
+
+def angled_point(point, angle, dist):
+    x = point[0] + math.sin(angle) * dist
+    y = point[1] + math.cos(angle) * dist
+    return [x, y]
+
+
+def get_dist(point1, point2):
+    return math.sqrt(
+        (point2[0] - point1[0]) ** 2 + (point2[1] - point1[1]) ** 2)
+
+
+def jump(player, power=1):
+    player.vel[1] -= JUMP_VEL * player.atts.jump_vel * power
+
+
+class Body:
+    """Simulation state of one poet's ball, independent of any display
+
+    Controls are given as sets of "left", "right" and "jump": held for the
+    keys currently down and pressed for the keys that went down this frame.
+    """
+
+    def __init__(self, poet):
+        self.poet = poet
+        self.atts = find_poet(self.poet)
+        self.era = self.atts.era
+        self.world = None
+        self.pos = None
+        self.prev_pos = None
+        self.radius = None
+        self.vel = None
+        self.local = None
+        self.jumps = 1
+        self.jump_start = 2
+        self.air_move = False
+        self.mass = 10 // self.atts.bounce
+        self.held = set()
+        self.pressed = set()
+        self.steered = True  # False if only received states move it
+
+    def reset(self, host=True, local=False):
+        """Resets player position"""
+        self.local = local
+        width, height = self.world.resolution
+        self.vel = [0, 0]
+        self.radius = int((width // PLAYER_SIZE) * self.atts.size)
+        if not host:
+            self.pos = [self.radius * 2, height - self.radius * 2]
+        else:
+            self.pos = [width - self.radius * 2, height - self.radius * 2]
+        self.prev_pos = list(self.pos)
+        self.held = set()
+        self.pressed = set()
+
+    def snapshot(self):
+        """Returns a copy of everything a step can change"""
+        return (list(self.pos), list(self.prev_pos), list(self.vel),
+                self.radius, self.local, self.jumps, self.air_move)
+
+    def restore(self, snapshot):
+        pos, prev_pos, vel, self.radius, self.local, self.jumps, \
+            self.air_move = snapshot
+        self.pos = list(pos)
+        self.prev_pos = list(prev_pos)
+        self.vel = list(vel)
+
+    def lerp_pos(self, alpha):
+        """Returns the position alpha of the way from the last step to now"""
+        return [self.prev_pos[i] + (self.pos[i] - self.prev_pos[i]) * alpha
+                for i in range(0, 2)]
+
+    def set_controls(self, held, pressed):
+        self.held = set(held)
+        self.pressed |= set(pressed)
+
+    def control(self, secs):
+        """Applies the held and pressed controls for one step
+
+        A body that is not steered here is left to its states, abilities
+        and all, so its side's jumps are not made twice.
+        """
+        if not self.steered:
+            return
+        accel = BALL_ACCEL * secs * self.atts.accel
+        if "left" in self.held:
+            if self.on_ground(
+                    moved="left" in self.pressed) or self.era != "Victorian":
+                self.vel[0] -= accel
+        if "right" in self.held:
+            if self.on_ground(
+                    moved="right" in self.pressed) or self.era != "Victorian":
+                self.vel[0] += accel
+        if "jump" in self.pressed or (
+                self.era != "Victorian" and "jump" in self.held):
+            if self.on_ground(moved=True):
+                jump(self)
+        if self.atts.mad_jack and self.on_ground():
+            jump(self, self.atts.mad_jack)
+        # Presses only count on the first step of the frame they arrived in
+        self.pressed = set()
+
+    def tick(self, secs):
+        """Applies gravity and moves the whole step in one go, unswept"""
+        self.accelerate(secs)
+        self.move(secs)
+
+    def accelerate(self, secs):
+        """Starts a step: remembers where it began and applies gravity"""
+        self.prev_pos = list(self.pos)
+        self.vel[0] -= x_gravity * secs
+        self.vel[1] -= y_gravity * secs
+
+    def move(self, secs):
+        for i in range(0, 2):
+            self.pos[i] += (self.vel[i] * secs) * self.world.grid_scale
+
+    def hit_wall(self, i):
+        """Bounces off, wraps through or leaves by wall i of WALLS
+
+        :return: True if the ball left the arena
+        """
+        axis = i % 2
+        size = self.world.resolution[axis]
+        eff = 1
+        if i == 0 or i == 3:
+            # RIGHT or BOTTOM
+            new_pos = size - (self.radius + 1)
+            opposite_pos = self.radius + 1
+            if i == 3:
+                eff = self.atts.elastic
+        else:
+            # TOP OR LEFT
+            new_pos = self.radius + 1
+            opposite_pos = size - (self.radius + 1)
+
+        wall = WALLS[i]
+        if wall == "WALL":
+            self.pos[axis] = new_pos
+            self.vel[axis] = elastic_bounce(self.mass, self.vel[axis],
+                                            WALL_WEIGHT, 0, eff)
+        elif wall == "LOOP":
+            self.pos[axis] = opposite_pos
+        elif wall != "HOLE":
+            return True
+        return False
+
+    def check_pos(self):
+        """Bounces off the walls. Returns True if the ball left the arena"""
+        resolution = self.world.resolution
+        for i in range(0, len(WALLS)):
+            if i == 0 or i == 3:
+                # RIGHT or BOTTOM
+                touching = self.pos[i % 2] + self.radius >= resolution[i % 2]
+            else:
+                # TOP OR LEFT
+                touching = self.pos[i % 2] - self.radius <= 0
+            if touching and self.hit_wall(i):
+                return True
+        return False
+
+    def next_wall(self):
+        """Returns (seconds, wall) to the first "WALL" of WALLS that the
+        ball will reach at its velocity, with 0 seconds if it is already
+        there, or None if it is moving away from all of them"""
+        first = None
+        for axis in range(0, 2):
+            speed = self.vel[axis] * self.world.grid_scale
+            if speed > 0:
+                wall = 0 if axis == 0 else 3  # RIGHT or BOTTOM
+                gap = self.world.resolution[axis] - self.radius - \
+                    self.pos[axis]
+            elif speed < 0:
+                wall = 2 if axis == 0 else 1  # LEFT or TOP
+                gap = self.pos[axis] - self.radius
+                speed = -speed
+            else:
+                continue
+            if WALLS[wall] != "WALL":
+                continue
+            wait = max(0, gap / speed)
+            if isinstance(first, type(None)) or wait < first[0]:
+                first = (wait, wall)
+        return first
+
+    def impact_time(self, _ball):
+        """Returns the seconds until the balls touch at their velocities,
+        0 if they already do, or None if they never will
+
+        Solves |d + v t| = r1 + r2 for the first t, d and v being the
+        second ball's position and velocity relative to the first.
+        """
+        scale = self.world.grid_scale
+        dx = _ball.pos[0] - self.pos[0]
+        dy = _ball.pos[1] - self.pos[1]
+        reach = self.radius + _ball.radius
+        gap = dx * dx + dy * dy - reach * reach
+        if gap <= 0:
+            return 0
+        vx = (_ball.vel[0] - self.vel[0]) * scale
+        vy = (_ball.vel[1] - self.vel[1]) * scale
+        closing = dx * vx + dy * vy
+        if closing >= 0:
+            return None
+        speed = vx * vx + vy * vy
+        discriminant = closing * closing - speed * gap
+        if discriminant < 0:
+            return None
+        return (-closing - math.sqrt(discriminant)) / speed
+
+    def collide(self, _ball):
+        """Bounces two overlapping balls apart
+
+        :return: The ball that landed on the other's head, if any
+        """
+        dist = math.sqrt((_ball.pos[0] - self.pos[0]) ** 2 + (
+                _ball.pos[1] - self.pos[1]) ** 2)
+        if dist > self.radius + _ball.radius:
+            return None
+        return self.bounce(_ball, dist)
+
+    def bounce(self, _ball, dist):
+        """Bounces two touching balls apart
+
+        :param dist: Between their centres
+        :return: The ball that landed on the other's head, if any
+        """
+        selftempx = self.vel[0]
+        selftempy = self.vel[1]
+        self.vel[0] = elastic_bounce(self.mass, self.vel[0],
+                                     _ball.mass, _ball.vel[0], 1)
+        self.vel[1] = elastic_bounce(self.mass, self.vel[1],
+                                     _ball.mass, _ball.vel[1], 1)
+        _ball.vel[0] = elastic_bounce(_ball.mass, _ball.vel[0],
+                                      self.mass, selftempx, 1)
+        _ball.vel[1] = elastic_bounce(_ball.mass, _ball.vel[1],
+                                      self.mass, selftempy, 1)
+
+        angle1 = angle_of_points(self.pos, _ball.pos)
+        angle2 = angle_of_points(_ball.pos, self.pos)
+
+        if -WIN_ARC < angle1 < WIN_ARC and not _ball.atts.do_not_go_gentle:
+            # Jumped on opponent's head
+            return self
+        elif -WIN_ARC < angle2 < WIN_ARC and not self.atts.do_not_go_gentle:
+            # Opponent jumped on my head
+            return _ball
+
+        n_dist2 = dist * (
+                self.radius / (self.radius + _ball.radius))
+
+        center = angled_point(self.pos, angle1, n_dist2)
+        if get_dist(self.pos, center) <= self.radius:
+            self.pos = angled_point(center, angle2, self.radius + 1)
+        if get_dist(_ball.pos, center) <= _ball.radius:
+            _ball.pos = angled_point(center, angle1, _ball.radius + 1)
+        return None
+
+    def on_wall(self):
+        width = self.world.resolution[0]
+        if self.on_ground(True):
+            return True
+        elif -self.radius <= self.pos[1] <= self.radius * self.atts.ground_factor:
+            return True
+        elif self.pos[0] >= width - self.radius * self.atts.ground_factor:
+            return not self.pos[1] <= -self.radius  # Walls not above ceiling
+        elif self.pos[0] <= self.radius * GROUND_FACTOR:
+            return not self.pos[1] <= -self.radius
+        return False
+
+    def on_ground(self, touching=False, moved=True):
+        height = self.world.resolution[1]
+        on_ground = self.pos[1] >= height - self.radius * self.atts.ground_factor
+        if touching:
+            return on_ground
+        if self.era == "Romantic":
+            return on_ground
+        elif self.era == "Victorian":
+            if not moved and self.air_move:
+                return True
+            if self.jumps > 0:
+                self.air_move = True
+                self.jumps -= 1
+                return True
+            self.air_move = False
+            return False
+        else:
+            return self.on_wall()
+
+
+class SpatialHash:
+    """Uniform grid for finding the pairs of bodies that may be touching
+
+    Cells are as wide as the biggest ball plus any reach, so balls that
+    touch, or may within reach, always have their centres in the same or
+    neighbouring cells. Each cell is only
+    checked against itself and the half of its neighbours that come after
+    it, so every pair is found once.
+    """
+
+    NEIGHBOURS = [(1, -1), (1, 0), (1, 1), (0, 1)]
+
+    def pairs(self, bodies, reach=0):
+        """Returns sorted (i, j) index pairs, i < j, of possible contacts
+
+        :param reach: How much closer any two bodies may get, so pairs
+            that can only meet by moving are found as well
+        """
+        size = 2 * max(body.radius for body in bodies) + reach
+        cells = {}
+        for i in range(0, len(bodies)):
+            pos = bodies[i].pos
+            cell = (int(pos[0] // size), int(pos[1] // size))
+            if cell in cells:
+                cells[cell].append(i)
+            else:
+                cells[cell] = [i]
+
+        pairs = []
+        for cell in cells:
+            members = cells[cell]
+            for a in range(0, len(members)):
+                for b in range(a + 1, len(members)):
+                    pairs.append((members[a], members[b]))
+            for offset in self.NEIGHBOURS:
+                others = cells.get((cell[0] + offset[0], cell[1] + offset[1]))
+                if others:
+                    for i in members:
+                        for j in others:
+                            pairs.append((min(i, j), max(i, j)))
+        pairs.sort()
+        return pairs
+
+
+class World:
+    """All bodies in an arena, stepped together with a fixed timestep"""
+
+    def __init__(self, resolution):
+        self.bodies = []
+        self.collide_time = 0  # Seconds spent in collision passes
+        self.resolution = None
+        self.grid_scale = None
+        self.spatial_hash = SpatialHash()
+        self.resize(resolution)
+
+    def resize(self, resolution):
+        self.resolution = list(resolution)
+        self.grid_scale = self.resolution[1] / 4
+
+    def add(self, body):
+        body.world = self
+        self.bodies.append(body)
+
+    def snapshot(self):
+        return list(self.bodies), [body.snapshot() for body in self.bodies]
+
+    def restore(self, snapshot):
+        bodies, states = snapshot
+        self.bodies = list(bodies)
+        for i in range(0, len(bodies)):
+            bodies[i].restore(states[i])
+
+    def pairs(self, secs=0):
+        """Returns the (i, j) index pairs of bodies that may touch within
+        secs at their velocities"""
+        bodies = self.bodies
+        if len(bodies) >= BROAD_PHASE_MIN:
+            # No contact speeds a ball up past the fastest one, so no two
+            # balls further apart than twice its travel can meet
+            travel = max(math.hypot(*body.vel) for body in bodies) * \
+                secs * self.grid_scale
+            pairs = self.spatial_hash.pairs(bodies, 2 * travel)
+            if not travel:
+                return pairs
+            near = []
+            for i, j in pairs:
+                a, b = bodies[i], bodies[j]
+                reach = a.radius + b.radius + 2 * travel
+                if (a.pos[0] - b.pos[0]) ** 2 + (a.pos[1] - b.pos[1]) ** 2 \
+                        <= reach * reach:
+                    near.append((i, j))
+            return near
+        return [(i, j) for i in range(0, len(bodies))
+                for j in range(i + 1, len(bodies))]
+
+    def step(self, secs):
+        """Advances every body by secs exactly once
+
+        :return: List of (winner, loser) pairs for heads landed on this step
+        """
+        for body in self.bodies:
+            body.control(secs)
+        for body in self.bodies:
+            body.accelerate(secs)
+
+        start = time.perf_counter()
+        wins = self.sweep(secs)
+        self.collide_time += time.perf_counter() - start
+
+        # Whatever the sweep left touching a wall, such as a ball that
+        # fell through the top into a HOLE, is dealt with at the end
+        bodies = self.bodies
+        gone = set(body for body in bodies if body.check_pos())
+        if gone:
+            self.bodies = [body for body in bodies if body not in gone]
+
+        for body in self.bodies:
+            if body.on_ground(True):
+                body.jumps = body.jump_start
+                body.air_move = False
+        return wins
+
+    def sweep(self, secs):
+        """Moves every body through secs, resolving each contact at the
+        moment it happens
+
+        Contacts are found as times of impact, with each body moving in a
+        straight line at its velocity, and handled in time order off a
+        heap. Resolving one changes the velocities of the bodies in it,
+        so only their own contacts are worked out again, from where they
+        are at that moment. Each body keeps how far into the step it has
+        been moved, so the rest are only moved when needed. A pair only
+        bounces once a step, as a body that landed on another's head is
+        not pushed back out of it, and at most MAX_IMPACTS contacts a body
+        are resolved before the rest of the step is moved unswept.
+
+        :return: List of (winner, loser) pairs for heads landed on
+        """
+        bodies = self.bodies
+        count = len(bodies)
+        times = [0] * count  # How far into the step each body has moved
+        versions = [0] * count  # Bumped whenever a velocity changes
+        partners = [[] for i in range(0, count)]
+        for i, j in self.pairs(secs):
+            partners[i].append(j)
+            partners[j].append(i)
+        bounced = set()
+        events = []  # (time, i, j or -1 - wall, version of i, of j)
+
+        def move(i, now):
+            if times[i] != now:
+                bodies[i].move(now - times[i])
+                times[i] = now
+
+        def schedule(i, now, others):
+            wall = bodies[i].next_wall()
+            if not isinstance(wall, type(None)) and now + wall[0] <= secs:
+                heapq.heappush(events, (now + wall[0], i, -1 - wall[1],
+                                        versions[i], 0))
+            for j in others:
+                a, b = (i, j) if i < j else (j, i)
+                if (a, b) in bounced:
+                    continue
+                move(j, now)
+                wait = bodies[a].impact_time(bodies[b])
+                if not isinstance(wait, type(None)) and now + wait <= secs:
+                    heapq.heappush(events, (now + wait, a, b, versions[a],
+                                            versions[b]))
+
+        for i in range(0, count):
+            schedule(i, 0, [j for j in partners[i] if j > i])
+
+        wins = []
+        impacts = MAX_IMPACTS * count
+        while events and impacts:
+            now, i, j, version_i, version_j = heapq.heappop(events)
+            if versions[i] != version_i or (j >= 0 and (
+                    versions[j] != version_j or (i, j) in bounced)):
+                continue  # Made stale by an earlier contact
+            impacts -= 1
+            move(i, now)
+            if j < 0:
+                bodies[i].hit_wall(-1 - j)
+                changed = [i]
+            else:
+                move(j, now)
+                bounced.add((i, j))
+                winner = bodies[i].bounce(bodies[j], get_dist(
+                    bodies[i].pos, bodies[j].pos))
+                if winner is bodies[i]:
+                    wins.append((bodies[i], bodies[j]))
+                elif winner is bodies[j]:
+                    wins.append((bodies[j], bodies[i]))
+                changed = [i, j]
+            for k in changed:
+                versions[k] += 1
+            for k in changed:
+                schedule(k, now, partners[k])
+
+        for i in range(0, count):
+            move(i, secs)
+        return wins
+
+
+class Simulation:
+    """Runs a World at a fixed tick rate from variable frame times
+
+    Leftover time is kept in an accumulator and exposed as alpha so the
+    renderer can interpolate between the last two steps.
+    """
+
+    def __init__(self, world, tick_rate=TICK_RATE):
+        self.world = world
+        self.step_secs = 1 / tick_rate
+        self.accumulator = 0
+        self.steps = 0
+
+    def advance(self, secs):
+        """Runs every whole step that fits in secs plus the leftover time
+
+        :return: List of (winner, loser) pairs from all steps run
+        """
+        wins = []
+        self.accumulator += min(secs, MAX_FRAME)
+        while self.accumulator >= self.step_secs:
+            wins += self.step()
+            self.accumulator -= self.step_secs
+        return wins
+
+    def run(self, steps):
+        """Runs steps fixed steps with no frame timing (headless)"""
+        wins = []
+        for k in range(0, steps):
+            wins += self.step()
+        return wins
+
+    def step(self):
+        self.steps += 1
+        return self.world.step(self.step_secs)
+
+    def alpha(self):
+        return self.accumulator / self.step_secs
@@ -0,0 +1,278 @@
+"""NumPy structure-of-arrays backend for large arenas
+
+Every body's state lives in one row of a set of contiguous arrays, and
+integration, walls and collisions run over all of them at once. Bodies
+are BodyView objects, which act like physics.Body but read and write their
+row, so controls and the ground checks are shared with the scalar path.
+
+NumPy is optional. The game itself runs on physics.World.
+"""
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from physics import Body, x_gravity, y_gravity, WALLS, EFFICIENCY, \
+    MIN_FORCE, WALL_WEIGHT, WIN_ARC
+from poetry import find_poet
+
+START_CAPACITY = 16
+
+
+def elastic_bounce(m1, v1, m2, v2, eff):
+    """Vectorized physics.elastic_bounce"""
+    force = ((m1 - m2) / (m1 + m2)) * v1 + ((2 * m2) / (m1 + m2)) * v2
+    return numpy.where(numpy.abs(force) <= MIN_FORCE, 0,
+                       force * EFFICIENCY * eff)
+
+
+def row_property(name, scalar=False):
+    """Property reading and writing this body's row of world.<name>"""
+    if scalar:
+        def get(self):
+            return getattr(self.world, name)[self.index].item()
+    else:
+        def get(self):
+            return getattr(self.world, name)[self.index]
+
+    def set(self, value):
+        getattr(self.world, name)[self.index] = value
+    return property(get, set)
+
+
+class BodyView(Body):
+    """A body whose state is a row of an ArrayWorld's arrays"""
+
+    pos = row_property("pos")
+    prev_pos = row_property("prev_pos")
+    vel = row_property("vel")
+    radius = row_property("radius", True)
+    jumps = row_property("jumps", True)
+    air_move = row_property("air_move", True)
+
+    def __init__(self, world, index, poet):
+        # Body.__init__ is not called, as it would write None into the rows
+        self.world = world
+        self.index = index
+        self.poet = poet
+        self.atts = find_poet(self.poet)
+        self.era = self.atts.era
+        self.local = None
+        self.jump_start = 2
+        self.mass = 10 // self.atts.bounce
+        self.held = set()
+        self.pressed = set()
+        self.steered = True
+
+
+class ArrayWorld:
+    """Drop in replacement for physics.World backed by NumPy arrays
+
+    Contacts are all resolved at once from the positions at the start of
+    the collision pass, where the scalar World resolves them one pair at a
+    time. A ball touching several others therefore ends up with the
+    response to the last of them instead of all of them in turn. Moves are
+    not swept either: contacts are only looked for at the end of a step,
+    so balls fast enough to cross each other in one step do.
+    """
+
+    def __init__(self, resolution):
+        if isinstance(numpy, type(None)):
+            raise Exception("The array backend needs NumPy installed")
+        self.resolution = None
+        self.grid_scale = None
+        self.resize(resolution)
+        self.bodies = []
+        self.count = 0
+        self.collide_time = 0  # Seconds spent in collision passes
+        self.pos = numpy.zeros((START_CAPACITY, 2))
+        self.prev_pos = numpy.zeros((START_CAPACITY, 2))
+        self.vel = numpy.zeros((START_CAPACITY, 2))
+        self.radius = numpy.zeros(START_CAPACITY)
+        self.mass = numpy.zeros(START_CAPACITY)
+        self.elastic = numpy.zeros(START_CAPACITY)
+        self.ground_factor = numpy.zeros(START_CAPACITY)
+        self.gentle = numpy.zeros(START_CAPACITY, dtype=bool)
+        self.jumps = numpy.zeros(START_CAPACITY, dtype=int)
+        self.jump_start = numpy.zeros(START_CAPACITY, dtype=int)
+        self.air_move = numpy.zeros(START_CAPACITY, dtype=bool)
+        self.arrays = ["pos", "prev_pos", "vel", "radius", "mass", "elastic",
+                       "ground_factor", "gentle", "jumps", "jump_start",
+                       "air_move"]
+
+    def resize(self, resolution):
+        self.resolution = list(resolution)
+        self.grid_scale = self.resolution[1] / 4
+
+    def grow(self):
+        for name in self.arrays:
+            array = getattr(self, name)
+            bigger = numpy.zeros((len(array) * 2,) + array.shape[1:],
+                                 dtype=array.dtype)
+            bigger[:len(array)] = array
+            setattr(self, name, bigger)
+
+    def spawn(self, poet, host=True):
+        """Adds a ball for poet, placed like Body.reset, and returns it"""
+        if self.count == len(self.radius):
+            self.grow()
+        body = BodyView(self, self.count, poet)
+        self.count += 1
+        self.bodies.append(body)
+        self.mass[body.index] = body.mass
+        self.elastic[body.index] = body.atts.elastic
+        self.ground_factor[body.index] = body.atts.ground_factor
+        self.gentle[body.index] = body.atts.do_not_go_gentle
+        self.jump_start[body.index] = body.jump_start
+        body.jumps = 1
+        body.reset(host)
+        return body
+
+    def snapshot(self):
+        return list(self.bodies), [getattr(self, name)[:self.count].copy()
+                                   for name in self.arrays]
+
+    def restore(self, snapshot):
+        bodies, arrays = snapshot
+        self.bodies = list(bodies)
+        self.count = len(bodies)
+        for i in range(0, len(arrays)):
+            getattr(self, self.arrays[i])[:self.count] = arrays[i]
+        for i in range(0, self.count):
+            bodies[i].index = i
+
+    def remove(self, gone):
+        """Drops the bodies where the mask gone is set, keeping rows packed"""
+        keep = numpy.flatnonzero(~gone)
+        for name in self.arrays:
+            array = getattr(self, name)
+            array[:len(keep)] = array[keep]
+        self.bodies = [self.bodies[i] for i in keep]
+        self.count = len(keep)
+        for i in range(0, self.count):
+            self.bodies[i].index = i
+
+    def pairs(self, pos, radius):
+        """Returns index arrays (i, j) of touching bodies
+
+        Bodies are sorted on x and each compared with the next, then the
+        one after, and so on, until no two bodies that far apart in the
+        order can still overlap on x (sweep and prune).
+        """
+        order = numpy.argsort(pos[:, 0], kind="stable")
+        xs = pos[order, 0]
+        reach = 2 * radius.max()
+        firsts = []
+        seconds = []
+        for shift in range(1, len(order)):
+            near = xs[shift:] - xs[:-shift] <= reach
+            if not near.any():
+                break
+            i = order[:-shift][near]
+            j = order[shift:][near]
+            delta = pos[j] - pos[i]
+            touching = (delta ** 2).sum(axis=1) <= (radius[i] + radius[j]) ** 2
+            firsts.append(i[touching])
+            seconds.append(j[touching])
+        if not firsts:
+            empty = numpy.zeros(0, dtype=int)
+            return empty, empty
+        i = numpy.concatenate(firsts)
+        j = numpy.concatenate(seconds)
+        return numpy.minimum(i, j), numpy.maximum(i, j)
+
+    def step(self, secs):
+        """Advances every body by secs exactly once, like World.step"""
+        n = self.count
+        for body in self.bodies:
+            if body.held or body.pressed or body.atts.mad_jack:
+                body.control(secs)
+
+        pos = self.pos[:n]
+        vel = self.vel[:n]
+        radius = self.radius[:n]
+        mass = self.mass[:n]
+        self.prev_pos[:n] = pos
+        vel[:, 0] -= x_gravity * secs
+        vel[:, 1] -= y_gravity * secs
+        pos += vel * (secs * self.grid_scale)
+
+        start = time.perf_counter()
+        wins = self.collide(pos, vel, radius, mass)
+        self.collide_time += time.perf_counter() - start
+        gone = self.check_pos(pos, vel, radius, mass)
+
+        on_ground = pos[:, 1] >= self.resolution[1] - radius * \
+            self.ground_factor[:n]
+        self.jumps[:n][on_ground] = self.jump_start[:n][on_ground]
+        self.air_move[:n][on_ground] = False
+        if gone.any():
+            self.remove(gone)
+        return wins
+
+    def collide(self, pos, vel, radius, mass):
+        if self.count < 2:
+            return []
+        i, j = self.pairs(pos, radius)
+        if not len(i):
+            return []
+        mi = mass[i][:, None]
+        mj = mass[j][:, None]
+        vi = vel[i]
+        vj = vel[j]
+        vel[i] = elastic_bounce(mi, vi, mj, vj, 1)
+        vel[j] = elastic_bounce(mj, vj, mi, vi, 1)
+
+        delta = pos[j] - pos[i]
+        dist = numpy.sqrt((delta ** 2).sum(axis=1))
+        angle1 = numpy.arctan2(delta[:, 0], delta[:, 1])
+        angle2 = numpy.arctan2(-delta[:, 0], -delta[:, 1])
+        i_wins = (numpy.abs(angle1) < WIN_ARC) & ~self.gentle[j]
+        j_wins = ~i_wins & (numpy.abs(angle2) < WIN_ARC) & ~self.gentle[i]
+        bodies = self.bodies
+        wins = [(bodies[a], bodies[b]) for a, b in zip(i[i_wins], j[i_wins])]
+        wins += [(bodies[b], bodies[a]) for a, b in zip(i[j_wins], j[j_wins])]
+
+        # Push apart the pairs that were not a head landing
+        apart = ~(i_wins | j_wins) & (dist > 0)
+        i, j, delta, dist = i[apart], j[apart], delta[apart], dist[apart]
+        ri = radius[i]
+        rj = radius[j]
+        unit = delta / dist[:, None]
+        center = pos[i] + unit * (dist * ri / (ri + rj))[:, None]
+        pos[i] = center - unit * (ri + 1)[:, None]
+        pos[j] = center + unit * (rj + 1)[:, None]
+        return wins
+
+    def check_pos(self, pos, vel, radius, mass):
+        """Vectorized Body.check_pos. Returns the mask of bodies to remove"""
+        gone = numpy.zeros(self.count, dtype=bool)
+        for i in range(0, len(WALLS)):
+            axis = i % 2
+            size = self.resolution[axis]
+            if i == 0 or i == 3:
+                # RIGHT or BOTTOM
+                hit = pos[:, axis] + radius >= size
+                new_pos = size - (radius + 1)
+                opposite_pos = radius + 1
+                eff = self.elastic[:self.count] if i == 3 else 1
+            else:
+                # TOP OR LEFT
+                hit = pos[:, axis] - radius <= 0
+                new_pos = radius + 1
+                opposite_pos = size - (radius + 1)
+                eff = 1
+            if not hit.any():
+                continue
+            if WALLS[i] == "WALL":
+                new_vel = elastic_bounce(mass, vel[:, axis], WALL_WEIGHT, 0,
+                                         eff)
+                pos[hit, axis] = new_pos[hit]
+                vel[hit, axis] = new_vel[hit]
+            elif WALLS[i] == "LOOP":
+                pos[hit, axis] = opposite_pos[hit]
+            elif WALLS[i] != "HOLE":
+                gone |= hit
+        return gone
@@ -1,3 +1,5 @@
+from collections import namedtuple
+
 master_poets = {
 
     "Romantic": {
@@ -81,22 +83,54 @@ master_poets = {
 }
 
 
+# Attributes a poet or their era may leave out
+DEFAULT_ATTS = {
+    "jump vel": 1,
+    "size": 1,
+    "accel": 1,
+    "ground factor": 1.25,
+    "do not go gentle": False,
+    "mad jack": 0,  # Power of the jump taken whenever on the ground
+    "gas": False,
+    "visions": False,
+}
+
+# A poet with every attribute resolved, named as in master_poets with
+# spaces made underscores
+Poet = namedtuple("Poet", ["name", "era", "bounce", "elastic"] + [
+    att.replace(" ", "_") for att in DEFAULT_ATTS])
+
+
+def compile_poets(eras):
+    """Resolves every poet's attributes from their own, their era's and the
+    defaults, without changing eras
+
+    :return: {lowercase name: Poet}
+    """
+    poets = {}
+    for era in eras:
+        for name in eras[era]:
+            if name == "atts":
+                continue
+            atts = dict(DEFAULT_ATTS)
+            atts.update(eras[era]["atts"])
+            atts.update(eras[era][name])
+            poets[name.lower()] = Poet(name, era, **{
+                att.replace(" ", "_"): atts[att] for att in atts})
+    return poets
+
+
+POETS = compile_poets(master_poets)
+POET_NAMES = tuple(poet.name for poet in POETS.values())
+
+
 def get_all_poets():
-    poet_list = []
-    for group in master_poets:
-        for poet in master_poets[group]:
-            if poet != "atts":
-                poet_list.append(poet)
-    return poet_list
+    return list(POET_NAMES)
 
 
 def find_poet(poet):
-    poet = poet.title()
-    for group in master_poets:
-        if poet in master_poets[group]:
-            att_dict = master_poets[group][poet]
-            for att in master_poets[group]["atts"]:
-                if att not in master_poets[group][poet]:
-                    att_dict[att] = master_poets[group]["atts"][att]
-            return group, att_dict
-    raise Exception("Poet: " + poet + " does not exist.")
+    """Returns the Poet record for a name in any case"""
+    try:
+        return POETS[poet.lower()]
+    except KeyError:
+        raise Exception("Poet: " + poet.title() + " does not exist.")
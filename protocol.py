@@ -0,0 +1,148 @@
+import struct
+
+VERSION = 1
+
+# Message kinds
+STATE = 1
+WIN = 2
+POET = 3
+ACK = 4  # Sequence is the sequence of the message being acknowledged
+INPUT = 5  # Controls from a frame on, until the next input message
+MATCH = 6  # Sent by a dedicated server before the opponent's poet
+PING = 7  # Answered straight away with a PONG carrying the same stamp
+PONG = 8
+
+# Sides of the arena in a MATCH message
+JOIN_SIDE = 0
+HOST_SIDE = 1
+
+POET_SIZE = 32
+
+# version, kind, sequence
+HEADER = struct.Struct("!BBI")
+PAYLOADS = {
+    STATE: struct.Struct("!4f"),  # pos x, pos y, vel x, vel y
+    WIN: struct.Struct(""),
+    POET: struct.Struct("!" + str(POET_SIZE) + "s"),
+    ACK: struct.Struct(""),
+    INPUT: struct.Struct("!IB"),  # frame, controls
+    MATCH: struct.Struct("!B"),  # side
+    PING: struct.Struct("!d"),  # sender's clock
+    PONG: struct.Struct("!d"),  # the stamp of the ping answered
+}
+SIZES = {kind: HEADER.size + PAYLOADS[kind].size for kind in PAYLOADS}
+MAX_SIZE = max(SIZES.values())
+
+
+class ProtocolError(Exception):
+    """Raised for bytes that are not a message of this protocol"""
+
+
+def is_newer(sequence, last):
+    """Checks if sequence comes after last, allowing for wrap around"""
+    return 0 < ((sequence - last) & 0xFFFFFFFF) < 0x80000000
+
+
+class Message:
+    """A decoded message, reused between decodes to avoid allocating"""
+
+    __slots__ = ("kind", "sequence", "values", "poet", "frame", "controls",
+                 "side", "stamp")
+
+    def __init__(self):
+        self.kind = None
+        self.sequence = 0
+        self.values = [0.0] * 4
+        self.poet = ""
+        self.frame = 0
+        self.controls = 0
+        self.side = None
+        self.stamp = 0.0
+
+
+def message_size(data, offset=0):
+    """Returns the size of the message starting at offset
+
+    :return: 0 if the header has not fully arrived yet
+    """
+    if len(data) - offset < HEADER.size:
+        return 0
+    version, kind, sequence = HEADER.unpack_from(data, offset)
+    if version != VERSION:
+        raise ProtocolError("Unsupported protocol version: " + str(version))
+    if kind not in SIZES:
+        raise ProtocolError("Unknown message kind: " + str(kind))
+    return SIZES[kind]
+
+
+def decode(data, message, offset=0):
+    """Decodes the message at offset of data into message without copying
+
+    :param data: bytes, bytearray or memoryview
+    :return: Number of bytes used, or 0 if the message is not all there
+    """
+    size = message_size(data, offset)
+    if not size or len(data) - offset < size:
+        return 0
+    version, message.kind, message.sequence = HEADER.unpack_from(data, offset)
+    offset += HEADER.size
+    if message.kind == STATE:
+        message.values[:] = PAYLOADS[STATE].unpack_from(data, offset)
+    elif message.kind == POET:
+        name = PAYLOADS[POET].unpack_from(data, offset)[0]
+        try:
+            message.poet = name.rstrip(b"\0").decode()
+        except UnicodeDecodeError:
+            raise ProtocolError("Poet name is not UTF-8")
+    elif message.kind == INPUT:
+        message.frame, message.controls = PAYLOADS[INPUT].unpack_from(
+            data, offset)
+    elif message.kind == MATCH:
+        message.side = PAYLOADS[MATCH].unpack_from(data, offset)[0]
+    elif message.kind == PING or message.kind == PONG:
+        message.stamp = PAYLOADS[message.kind].unpack_from(data, offset)[0]
+    return size
+
+
+class Encoder:
+    """Packs outgoing messages into one reusable buffer
+
+    The returned memoryview is only valid until the next encode, so send it
+    before encoding another message.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray(MAX_SIZE)
+        self.view = memoryview(self.buffer)
+        self.sequence = 0
+
+    def encode(self, kind, *values):
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        HEADER.pack_into(self.buffer, 0, VERSION, kind, self.sequence)
+        PAYLOADS[kind].pack_into(self.buffer, HEADER.size, *values)
+        return self.view[:SIZES[kind]]
+
+    def state(self, pos, vel):
+        return self.encode(STATE, pos[0], pos[1], vel[0], vel[1])
+
+    def win(self):
+        return self.encode(WIN)
+
+    def poet(self, name):
+        return self.encode(POET, name.encode()[:POET_SIZE])
+
+    def input(self, frame, controls):
+        return self.encode(INPUT, frame, controls)
+
+    def match(self, side):
+        return self.encode(MATCH, side)
+
+    def ping(self, stamp):
+        return self.encode(PING, stamp)
+
+    def pong(self, stamp):
+        return self.encode(PONG, stamp)
+
+    def ack(self, sequence):
+        HEADER.pack_into(self.buffer, 0, VERSION, ACK, sequence)
+        return self.view[:SIZES[ACK]]
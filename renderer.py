@@ -0,0 +1,50 @@
+import pygame
+
+BACKGROUND = (0, 0, 0)
+FULL_REDRAW = .5  # Fraction of the screen past which one flip is cheaper
+
+
+class DirtyRenderer:
+    """Redraws only the parts of the screen that change
+
+    Each frame, clear() paints over everything drawn the frame before,
+    the caller draws and hands the rects it drew to add(), and present()
+    pushes both the cleared and the new rects to the screen. Frames after
+    a resize, or that touch most of the screen, are flipped whole.
+    """
+
+    def __init__(self, display, background=BACKGROUND):
+        self.display = display
+        self.background = background
+        self.drawn = []
+        self.cleared = []
+        self.full = True
+
+    def resize(self, display):
+        """Starts over on a new display surface"""
+        self.display = display
+        self.drawn = []
+        self.full = True
+
+    def clear(self):
+        if self.full:
+            self.display.fill(self.background)
+            self.cleared = []
+        else:
+            for rect in self.drawn:
+                self.display.fill(self.background, rect)
+            self.cleared = self.drawn
+        self.drawn = []
+
+    def add(self, rects):
+        self.drawn.extend(rect for rect in rects if rect)
+
+    def present(self):
+        rects = self.cleared + self.drawn
+        area = sum(rect.width * rect.height for rect in rects)
+        if self.full or area >= FULL_REDRAW * self.display.get_width() * \
+                self.display.get_height():
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+        self.full = False
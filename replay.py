@@ -0,0 +1,330 @@
+"""Records matches to disk and plays them back without a display
+
+A recording is a header and then a stream of records. Each frame, the
+packed controls are written when they are set, then the network messages
+the game applied as they happen, and then a FRAME record with the frame's
+length. That is the order the game applies them in, so a remote win that
+resets the players clears the controls on playback as it did live. Every
+KEYFRAME_INTERVAL'th frame starts with a KEYFRAME holding the whole match
+state, and closing the recorder appends an index of where they are.
+
+Playback memory maps the file. Seeking restores the last keyframe before
+the frame wanted and runs only the frames after it. Playing straight
+through instead checks each keyframe against the replayed state, so a
+recording from either side of a desync shows where it went wrong. A
+lockstep match can not roll back past the keyframe it was seeked to, so
+its seeks are only as good as the predictions the keyframe was taken on.
+
+Run with:
+
+    python replay.py recording [frame]
+"""
+import mmap
+import struct
+import sys
+import time
+
+from lockstep import InputHistory, pack_controls, unpack_controls
+from physics import Body, TICK_RATE
+
+MAGIC = b"PPRP"
+VERSION = 3  # 3: controls recorded as they are set, before the messages
+KEYFRAME_INTERVAL = 600  # Frames between keyframes
+WRITE_BUFFER = 1 << 16
+
+# magic, version, tick rate, width, height, local game, hosting, lockstep,
+# local poet, remote poet
+HEADER = struct.Struct("!4sBHHH???32s32s")
+KIND = struct.Struct("!B")
+
+# Record kinds
+FRAME = 1
+STATE = 2  # Where the remote player was shown
+INPUT = 3  # A remote lockstep input
+WIN = 4  # The remote player won
+KEYFRAME = 5  # Followed by a BODY for each body
+CONTROLS = 6  # The frame's controls, set before its messages are applied
+
+RECORDS = {
+    FRAME: struct.Struct("!d"),  # secs
+    STATE: struct.Struct("!4d"),  # pos x, pos y, vel x, vel y
+    INPUT: struct.Struct("!IB"),  # frame, controls
+    WIN: struct.Struct(""),
+    # frame, accumulator, my wins, enemy wins, lockstep frame, lockstep
+    # local controls, lockstep remote controls, bodies
+    KEYFRAME: struct.Struct("!IdIIIBBB"),
+    CONTROLS: struct.Struct("!BB"),  # local, remote
+}
+# pos x, pos y, prev pos x, prev pos y, vel x, vel y, radius, jumps,
+# air move, controls
+BODY = struct.Struct("!6dii?B")
+INDEX_ENTRY = struct.Struct("!IQ")  # frame, offset of the keyframe
+TRAILER = struct.Struct("!QI4s")  # index offset, index entries, magic
+
+
+def capture(game, frame):
+    """Returns a keyframe record of game as it is before frame"""
+    session = game.simulation
+    lockstep = [0, 0, 0]
+    if game.lockstep:
+        lockstep = [session.frame, pack_controls(session.held,
+                                                 session.pressed),
+                    session.remote_inputs.get(session.frame)]
+    bodies = game.world.bodies
+    data = KIND.pack(KEYFRAME) + RECORDS[KEYFRAME].pack(
+        frame, session.accumulator, game.my_wins, game.enemy_wins,
+        *lockstep, len(bodies))
+    for body in bodies:
+        data += BODY.pack(*body.pos, *body.prev_pos, *body.vel, body.radius,
+                          body.jumps, body.air_move,
+                          pack_controls(body.held, body.pressed))
+    return data
+
+
+def restore(game, values, data, offset):
+    """Puts game in the state of a keyframe
+
+    :param values: The keyframe record's values
+    :param offset: Where its bodies start in data
+    """
+    frame, accumulator, my_wins, enemy_wins, lockstep_frame, local, \
+        remote, count = values
+    session = game.simulation
+    session.accumulator = accumulator
+    game.my_wins = my_wins
+    game.enemy_wins = enemy_wins
+    if game.lockstep:
+        session.frame = lockstep_frame
+        session.held, session.pressed = unpack_controls(local)
+        session.scores = {game.local_player: my_wins,
+                          game.remote_player: enemy_wins}
+        session.snapshots = {}
+        session.local_inputs = {}
+        session.remote_used = {}
+        session.remote_inputs = InputHistory()
+        session.remote_inputs.add(lockstep_frame, remote)
+
+    bodies = [game.host_player, game.join_player][:count]
+    game.world.bodies = bodies
+    for body in bodies:
+        values = BODY.unpack_from(data, offset)
+        offset += BODY.size
+        body.pos = list(values[0:2])
+        body.prev_pos = list(values[2:4])
+        body.vel = list(values[4:6])
+        body.radius, body.jumps, body.air_move = values[6:9]
+        body.held, body.pressed = unpack_controls(values[9])
+
+
+class Recorder:
+    """Streams a match to path as it is played
+
+    Game calls it for every frame and every remote message it applies.
+    """
+
+    def __init__(self, path, game, keyframe_interval=KEYFRAME_INTERVAL):
+        self.file = open(path, "wb", buffering=WRITE_BUFFER)
+        self.keyframe_interval = keyframe_interval
+        self.frames = 0
+        self.index = []
+        width, height = game.world.resolution
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, int(1 / game.simulation.step_secs + .5), width,
+            height, game.local_game, game.hosting, game.lockstep,
+            game.local_player.poet.encode(), game.remote_player.poet.encode()))
+
+    def write(self, kind, *values):
+        self.file.write(KIND.pack(kind) + RECORDS[kind].pack(*values))
+
+    def controls(self, game, local, remote):
+        """Records the controls a frame starts with, after its keyframe"""
+        if not self.frames % self.keyframe_interval:
+            self.index.append((self.frames, self.file.tell()))
+            self.file.write(capture(game, self.frames))
+        self.write(CONTROLS, local, remote)
+
+    def input(self, frame, controls):
+        self.write(INPUT, frame, controls)
+
+    def win(self):
+        self.write(WIN)
+
+    def state(self, pos, vel):
+        self.write(STATE, *pos, *vel)
+
+    def frame(self, secs):
+        """Records a frame about to be run"""
+        self.write(FRAME, secs)
+        self.frames += 1
+
+    def close(self):
+        offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(TRAILER.pack(offset, len(self.index), MAGIC))
+        self.file.close()
+
+
+class ReplayLink:
+    """Stands in for the NetLoop of a recorded network match
+
+    What the game sends is dropped. What it received comes from the
+    recording instead.
+    """
+
+    closed = False
+
+    def set_state(self, pos, vel, grid_scale, urgent=False, now=None):
+        pass
+
+    def send_win(self):
+        pass
+
+    def send_input(self, frame, controls):
+        pass
+
+
+class Replay:
+    """A recording, memory mapped for playback"""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.tick_rate, width, height, self.local_game, \
+            self.hosting, self.lockstep, local_poet, remote_poet = \
+            HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise Exception("Not a recording: " + path)
+        if version != VERSION:
+            raise Exception("Unsupported recording version: " + str(version))
+        if self.tick_rate != TICK_RATE:
+            raise Exception("Recorded at " + str(self.tick_rate) +
+                            " ticks per second, not " + str(TICK_RATE))
+        self.resolution = [width, height]
+        self.poets = [local_poet.rstrip(b"\0").decode(),
+                      remote_poet.rstrip(b"\0").decode()]
+        self.end, self.index = self.read_index()
+
+    def read_index(self):
+        """Returns where the records end and the (frame, offset) keyframes"""
+        data = self.data
+        if len(data) >= HEADER.size + TRAILER.size:
+            offset, count, magic = TRAILER.unpack_from(
+                data, len(data) - TRAILER.size)
+            if magic == MAGIC:
+                return offset, [INDEX_ENTRY.unpack_from(
+                    data, offset + i * INDEX_ENTRY.size)
+                    for i in range(0, count)]
+
+        # Never closed, so find the keyframes by reading through
+        index = []
+        end = HEADER.size
+        for offset, kind, values in self.records(HEADER.size, len(data)):
+            if kind == KEYFRAME:
+                index.append((values[0], offset))
+            end = offset
+        return end, index
+
+    def records(self, offset=HEADER.size, end=None):
+        """Yields (offset, kind, values) for each whole record from offset"""
+        data = self.data
+        if isinstance(end, type(None)):
+            end = self.end
+        while offset + KIND.size <= end:
+            kind = KIND.unpack_from(data, offset)[0]
+            record = RECORDS.get(kind)
+            if isinstance(record, type(None)):
+                raise Exception("Unknown record kind: " + str(kind))
+            size = KIND.size + record.size
+            if kind == KEYFRAME and offset + size <= end:
+                size += BODY.size * record.unpack_from(
+                    data, offset + KIND.size)[-1]
+            if offset + size > end:
+                return  # Cut off
+            yield offset, kind, record.unpack_from(data, offset + KIND.size)
+            offset += size
+
+    def make_game(self):
+        """Returns a match set up as the recorded one started"""
+        from main import Game  # main imports this module
+
+        local, remote = [Body(poet) for poet in self.poets]
+        link = None if self.local_game else ReplayLink()
+        return Game(local, remote, self.hosting, link, self.lockstep,
+                    self.resolution)
+
+    def play(self, game, offset=HEADER.size, frame=0, stop=None):
+        """Runs the recorded frames from offset, which is before frame
+
+        :param stop: Frame to stop before. The end of the recording if None
+        :return: (frames run, keyframes that did not match)
+        """
+        start = frame
+        mismatches = 0
+        for offset, kind, values in self.records(offset):
+            if not isinstance(stop, type(None)) and frame >= stop:
+                break  # Before any of the stop frame's records
+            if kind == FRAME:
+                game.update(values[0])
+                frame += 1
+            elif kind == CONTROLS:
+                game.set_controls(*values)
+            elif kind == STATE:
+                game.move_remote(values[0:2], values[2:4])
+            elif kind == INPUT:
+                game.remote_input(*values)
+            elif kind == WIN:
+                game.remote_win()
+            elif kind == KEYFRAME and frame > start:
+                # Taken before the frame's controls were set
+                if capture(game, frame) != self.data[
+                        offset:offset + KIND.size + RECORDS[KEYFRAME].size +
+                        BODY.size * values[-1]]:
+                    mismatches += 1
+        return frame - start, mismatches
+
+    def seek(self, game, frame):
+        """Puts game in its state from just before frame"""
+        start, offset = 0, HEADER.size
+        for keyframe, keyframe_offset in self.index:
+            if keyframe <= frame:
+                start, offset = keyframe, keyframe_offset
+        if start:
+            values = RECORDS[KEYFRAME].unpack_from(self.data,
+                                                   offset + KIND.size)
+            restore(game, values, self.data,
+                    offset + KIND.size + RECORDS[KEYFRAME].size)
+            offset += KIND.size + RECORDS[KEYFRAME].size + \
+                BODY.size * values[-1]
+        self.play(game, offset, start, frame)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def main(path, frame=None):
+    replay = Replay(path)
+    game = replay.make_game()
+    start = time.perf_counter()
+    if isinstance(frame, type(None)):
+        frames, mismatches = replay.play(game)
+        print("frames".ljust(24) + str(frames).rjust(12))
+        print("keyframe mismatches".ljust(24) + str(mismatches).rjust(12))
+    else:
+        replay.seek(game, int(frame))
+        print("frame".ljust(24) + frame.rjust(12))
+    elapsed = time.perf_counter() - start
+    print("steps".ljust(24) + str(game.simulation.steps).rjust(12))
+    print("steps/s".ljust(24) + str(int(
+        game.simulation.steps / max(elapsed, 1e-9))).rjust(12))
+    print("score".ljust(24) + (str(game.my_wins) + " - " +
+                               str(game.enemy_wins)).rjust(12))
+    for body in game.world.bodies:
+        print(body.poet.ljust(24) + str([round(x, 3) for x in body.pos]
+                                        ).rjust(12))
+    replay.close()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
@@ -0,0 +1,363 @@
+"""Headless server that pairs clients into matches and simulates them
+
+Clients join it like any other host, with lockstep inputs turned on. It
+needs no display and asks no questions. Run with:
+
+    python server.py [port] [workers]
+
+With workers > 0, the listening process runs matches itself until one
+more would take its tick load past SATURATION. After that each new match is handed to the
+one of that many worker processes running the fewest. Each match's score
+is printed when it ends.
+"""
+import multiprocessing
+import os
+import selectors
+import socket
+import sys
+import time
+from multiprocessing.reduction import send_handle, recv_handle
+
+from lockstep import InputHistory, unpack_controls
+from net import TcpTransport
+from physics import Body, World, RESOLUTION, TICK_RATE
+from poetry import find_poet
+from protocol import ProtocolError, HOST_SIDE, JOIN_SIDE
+
+SERVER_PORT = 5000
+SERVER_TICK = 60  # Scheduler ticks per second
+MAX_CATCH_UP = TICK_RATE  # Most frames one match may run in one tick
+STATS_TIME = 5  # Seconds between load reports
+SATURATION = .7  # Tick load past which new matches go to workers
+LOAD_SMOOTHING = .05  # Weight of each tick in the smoothed tick load
+MATCH_LOAD = .004  # Least tick load a match is taken to add
+OUTBOX_LIMIT = 16384  # Bytes a client may fall behind by before it is dropped
+
+
+class BufferedSocket:
+    """Wraps a match's socket so sendall() never holds up the server
+
+    The socket is made non-blocking. What it will not take yet is kept in
+    an outbox for flush() to send once it is writable. Everything else
+    behaves like the wrapped socket.
+    """
+
+    def __init__(self, sock):
+        sock.setblocking(False)
+        self.sock = sock
+        self.outbox = bytearray()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def sendall(self, data):
+        self.outbox += data
+        self.flush()
+
+    def flush(self):
+        while self.outbox:
+            try:
+                sent = self.sock.send(self.outbox)
+            except BlockingIOError:
+                return
+            del self.outbox[:sent]
+
+
+class Match:
+    """Two clients in lockstep, relayed and simulated by the server
+
+    Each client's inputs are forwarded to the other as they arrive. The
+    server's own world only runs frames it has both players' inputs for,
+    so it never has to roll back and its scores are final.
+    """
+
+    def __init__(self, transports, poets):
+        self.transports = transports  # Host side first
+        self.poets = poets
+        self.world = World(RESOLUTION)
+        self.bodies = [Body(poet.title()) for poet in poets]
+        for body in self.bodies:
+            self.world.add(body)
+        self.bodies[0].reset(True)
+        self.bodies[1].reset(False)
+        self.inputs = [InputHistory(), InputHistory()]
+        self.scores = [0, 0]
+        self.frame = 0
+        self.step_secs = 1 / TICK_RATE
+
+    def start(self):
+        for i in range(0, 2):
+            self.transports[i].send_match(HOST_SIDE if i == 0 else JOIN_SIDE)
+            self.transports[i].send_poet(self.poets[1 - i])
+
+    def receive(self, i):
+        """Handles data from client i. Returns False if it left"""
+        try:
+            if not self.transports[i].receive():
+                return False
+        except BlockingIOError:
+            return True
+        for frame, controls in self.transports[i].take_inputs():
+            self.inputs[i].add(frame, controls)
+            self.transports[1 - i].send_input(frame, controls)
+        return True
+
+    def flush(self):
+        """Sends what the clients will take of their outboxes
+
+        :return: False if a client has stopped reading
+        """
+        for transport in self.transports:
+            transport.sock.flush()
+            if len(transport.sock.outbox) > OUTBOX_LIMIT:
+                return False
+        return True
+
+    def tick(self):
+        """Runs every frame both players' inputs are known for"""
+        confirmed = min(inputs.heard for inputs in self.inputs)
+        end = min(confirmed + 1, self.frame + MAX_CATCH_UP)
+        while self.frame < end:
+            for i in range(0, 2):
+                self.bodies[i].held, self.bodies[i].pressed = unpack_controls(
+                    self.inputs[i].get(self.frame))
+                self.inputs[i].forget(self.frame)
+            wins = self.world.step(self.step_secs)
+            if wins:
+                self.scores[self.bodies.index(wins[0][0])] += 1
+                self.bodies[0].reset(True)
+                self.bodies[1].reset(False)
+            self.frame += 1
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+
+
+class Server:
+    """Runs matches on one fixed-tick loop
+
+    Selector keys carry the function that handles them, which is passed
+    the events that are ready. With a listener,
+    clients are accepted and paired in order of arrival. With a pipe, this
+    is a worker that is sent its matches' sockets by the listening process.
+    """
+
+    def __init__(self, listener=None, pipe=None, workers=()):
+        self.selector = selectors.DefaultSelector()
+        self.pipe = pipe
+        self.workers = list(workers)
+        self.worker_matches = [0] * len(self.workers)
+        self.waiting = None
+        self.matches = []
+        self.finished = 0
+        self.load = 0  # Smoothed fraction of each tick spent simulating
+        if listener:
+            listener.setblocking(False)
+            self.selector.register(listener, selectors.EVENT_READ,
+                                   lambda mask: self.accept(listener))
+        if pipe:
+            self.selector.register(pipe, selectors.EVENT_READ,
+                                   lambda mask: self.adopt())
+        for i in range(0, len(self.workers)):
+            self.selector.register(self.workers[i][0], selectors.EVENT_READ,
+                                   lambda mask, i=i: self.count(i))
+
+    def accept(self, listener):
+        try:
+            connection, address = listener.accept()
+        except BlockingIOError:
+            return
+        connection.setblocking(True)
+        transport = TcpTransport(connection)
+        self.selector.register(connection, selectors.EVENT_READ,
+                               lambda mask: self.handshake(transport))
+
+    def drop(self, transport):
+        self.selector.unregister(transport.sock)
+        transport.close()
+        if self.waiting is transport:
+            self.waiting = None
+
+    def handshake(self, transport):
+        try:
+            received = transport.receive()
+        except (ConnectionResetError, ProtocolError):
+            received = False
+        if not received:
+            self.drop(transport)
+            return
+        if isinstance(transport.poet, type(None)) or self.waiting is transport:
+            return
+        try:
+            find_poet(transport.poet)
+        except Exception:
+            self.drop(transport)
+            return
+        if isinstance(self.waiting, type(None)):
+            self.waiting = transport
+            return
+
+        pair = [self.waiting, transport]
+        self.waiting = None
+        for client in pair:
+            self.selector.unregister(client.sock)
+        poets = [client.poet for client in pair]
+        if self.workers and self.saturated():
+            self.dispatch(pair, poets)
+        else:
+            self.run_match([client.sock for client in pair], poets)
+
+    def saturated(self):
+        """Whether one more match would take the tick load past SATURATION
+
+        A match costs next to nothing until its inputs start arriving, so
+        each is taken to cost at least MATCH_LOAD. Otherwise a burst of
+        clients would all be paired here before the load showed it.
+        """
+        per_match = MATCH_LOAD
+        if self.matches:
+            per_match = max(per_match, self.load / len(self.matches))
+        return (len(self.matches) + 1) * per_match > SATURATION
+
+    def dispatch(self, pair, poets):
+        """Hands a pair of clients to the least busy worker"""
+        i = self.worker_matches.index(min(self.worker_matches))
+        pipe, pid = self.workers[i]
+        pipe.send(poets)
+        for client in pair:
+            send_handle(pipe, client.sock.fileno(), pid)
+            client.close()
+        self.worker_matches[i] += 1
+
+    def count(self, i):
+        """Reads a worker's report of how many matches it is running"""
+        try:
+            self.worker_matches[i] = self.workers[i][0].recv()
+        except EOFError:
+            self.selector.unregister(self.workers[i][0])
+            self.worker_matches[i] = float("inf")
+
+    def adopt(self):
+        """Takes a match from the listening process"""
+        try:
+            poets = self.pipe.recv()
+        except EOFError:
+            raise SystemExit
+        socks = [socket.socket(fileno=recv_handle(self.pipe))
+                 for poet in poets]
+        self.run_match(socks, poets)
+
+    def run_match(self, socks, poets):
+        match = Match([TcpTransport(BufferedSocket(sock)) for sock in socks],
+                      poets)
+        self.matches.append(match)
+        for i in range(0, 2):
+            self.selector.register(
+                match.transports[i].sock, selectors.EVENT_READ,
+                lambda mask, i=i: self.relay(match, i, mask))
+        try:
+            match.start()
+            sending = match.flush()
+        except OSError:
+            sending = False
+        if sending:
+            self.watch(match)
+        else:
+            self.end_match(match)
+        self.report()
+
+    def relay(self, match, i, mask):
+        try:
+            received = not mask & selectors.EVENT_READ or match.receive(i)
+            received = received and match.flush()
+        except (OSError, ProtocolError):
+            received = False
+        if received:
+            self.watch(match)
+        else:
+            self.end_match(match)
+
+    def watch(self, match):
+        """Waits for a client to be writable only while it has an outbox"""
+        for i in range(0, 2):
+            sock = match.transports[i].sock
+            key = self.selector.get_key(sock)
+            mask = selectors.EVENT_READ | (
+                selectors.EVENT_WRITE if sock.outbox else 0)
+            if key.events != mask:
+                self.selector.modify(sock, mask, key.data)
+
+    def end_match(self, match):
+        if match not in self.matches:
+            return
+        self.matches.remove(match)
+        self.finished += 1
+        for transport in match.transports:
+            self.selector.unregister(transport.sock)
+        match.close()
+        result = " vs ".join(poet.title() + " " + str(score) for poet, score
+                             in zip(match.poets, match.scores))
+        print(str(os.getpid()) + ": " + result + " after " +
+              str(match.frame) + " frames")
+        self.report()
+
+    def report(self):
+        if self.pipe:
+            self.pipe.send(len(self.matches))
+
+    def serve_forever(self):
+        interval = 1 / SERVER_TICK
+        next_tick = time.monotonic()
+        stats_time = next_tick
+        busy = 0
+        while True:
+            timeout = max(0, next_tick - time.monotonic())
+            for key, mask in self.selector.select(timeout):
+                key.data(mask)
+
+            now = time.monotonic()
+            if now >= next_tick:
+                for match in self.matches:
+                    match.tick()
+                tick_busy = time.monotonic() - now
+                busy += tick_busy
+                self.load += (tick_busy / interval - self.load) * \
+                    LOAD_SMOOTHING
+                next_tick = max(next_tick + interval, now)
+
+            if now - stats_time >= STATS_TIME:
+                if self.matches or not self.workers:
+                    print(str(os.getpid()) + ": " + str(len(self.matches)) +
+                          " matches, " + str(self.finished) + " finished, " +
+                          str(int(busy / (now - stats_time) * 100)) +
+                          "% tick load")
+                stats_time = now
+                busy = 0
+
+
+def run_worker(pipe):
+    Server(pipe=pipe).serve_forever()
+
+
+def main(port=SERVER_PORT, workers=0):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("", port))
+    listener.listen(socket.SOMAXCONN)
+
+    pool = []
+    for i in range(0, workers):
+        pipe, child_pipe = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_worker,
+                                          args=(child_pipe,), daemon=True)
+        process.start()
+        pool.append((pipe, process.pid))
+
+    print("Serving on port " + str(port) + " with " + str(workers) +
+          " workers")
+    Server(listener, workers=pool).serve_forever()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
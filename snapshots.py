@@ -0,0 +1,109 @@
+import math
+from collections import deque
+
+from physics import x_gravity, y_gravity
+
+INTERP_DELAY = .05  # Seconds the remote player is shown behind the newest state
+MAX_EXTRAPOLATE = .25  # Longest a late remote player is dead reckoned for
+MAX_LERP = .15  # Longer gaps between states were skipped free flight
+CORRECTION_TIME = .1  # Time constant for blending out a misprediction
+SNAP_DIST = 200  # Errors bigger than this (in pixels) are snapped, not blended
+SNAPSHOTS = 32
+
+
+def lerp(start, end, alpha):
+    return [start[i] + (end[i] - start[i]) * alpha for i in range(0, 2)]
+
+
+def extrapolate(pos, vel, secs, grid_scale):
+    """Returns where a ball will be after secs of free flight"""
+    accel = [-x_gravity, -y_gravity]
+    new_pos = [pos[i] + (vel[i] * secs + accel[i] * secs * secs / 2) * grid_scale
+               for i in range(0, 2)]
+    new_vel = [vel[i] + accel[i] * secs for i in range(0, 2)]
+    return new_pos, new_vel
+
+
+def is_rest(before, after):
+    """Checks if two snapshots are the same state, which the sender sends
+    for a ball at rest"""
+    return before[1] == after[1] and before[2] == after[2]
+
+
+class SnapshotBuffer:
+    """Timestamped states of a remote player, played back smoothly
+
+    The player is shown delay seconds behind the newest state, interpolated
+    between the two states either side of that time, or dead reckoned from
+    the earlier one where the gap says the sender left the flight out. A
+    state sent twice over is a ball at rest, and is held where it is. If
+    states stop arriving it is dead reckoned from its last velocity. When
+    a new state disagrees with what was shown, the difference is blended
+    out over CORRECTION_TIME rather than jumped.
+    """
+
+    def __init__(self, delay=INTERP_DELAY, size=SNAPSHOTS):
+        self.delay = delay
+        self.snapshots = deque(maxlen=size)
+        self.error = [0, 0]
+        self.shown = None
+        self.sample_time = None
+        self.updated = False
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def add(self, time, pos, vel):
+        self.snapshots.append((time, list(pos), list(vel)))
+        self.updated = True
+
+    def clear(self):
+        self.snapshots.clear()
+        self.error = [0, 0]
+        self.shown = None
+        self.sample_time = None
+        self.updated = False
+
+    def raw_sample(self, target, grid_scale):
+        snapshots = self.snapshots
+        if target <= snapshots[0][0]:
+            return list(snapshots[0][1]), list(snapshots[0][2])
+        newest = snapshots[-1]
+        if target >= newest[0]:
+            if len(snapshots) > 1 and is_rest(snapshots[-2], newest):
+                return list(newest[1]), list(newest[2])
+            secs = min(target - newest[0], MAX_EXTRAPOLATE)
+            return extrapolate(newest[1], newest[2], secs, grid_scale)
+        for i in range(len(snapshots) - 1, 0, -1):
+            before = snapshots[i - 1]
+            if before[0] <= target:
+                after = snapshots[i]
+                if after[0] - before[0] > MAX_LERP and \
+                        not is_rest(before, after):
+                    # The sender skipped what dead reckoning would show
+                    return extrapolate(before[1], before[2],
+                                       min(target - before[0],
+                                           MAX_EXTRAPOLATE), grid_scale)
+                alpha = (target - before[0]) / max(after[0] - before[0], 1e-9)
+                return (lerp(before[1], after[1], alpha),
+                        lerp(before[2], after[2], alpha))
+
+    def sample(self, now, grid_scale):
+        """Returns the (pos, vel) to show at now"""
+        pos, vel = self.raw_sample(now - self.delay, grid_scale)
+        if not isinstance(self.shown, type(None)):
+            secs = now - self.sample_time
+            if self.updated:
+                # Where the ball would be shown now without the new state
+                expected = extrapolate(*self.shown, secs, grid_scale)[0]
+                self.error = [expected[i] - pos[i] for i in range(0, 2)]
+                if math.hypot(*self.error) > SNAP_DIST:
+                    self.error = [0, 0]
+            decay = math.exp(-secs / CORRECTION_TIME)
+            self.error = [x * decay for x in self.error]
+        self.updated = False
+        self.sample_time = now
+
+        pos = [pos[i] + self.error[i] for i in range(0, 2)]
+        self.shown = (pos, vel)
+        return pos, vel
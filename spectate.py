@@ -0,0 +1,622 @@
+"""Relays a match to spectators without loading the players
+
+The game publishes BROADCAST_RATE snapshots a second over one connection
+to a relay, however many are watching, and the relay copies them out to
+every viewer. Every KEYFRAME_INTERVAL'th snapshot is a keyframe holding
+each body's quantized pos and vel. The rest are deltas carrying only the
+fields that differ from the last keyframe, so each one decodes alone once
+its keyframe is known. The relay can therefore drop the deltas a slow
+viewer has not been sent yet in favour of newer ones, and keeps a bounded
+queue per viewer. Diffing against the snapshot before would make deltas
+smaller, but viewers never acknowledge anything, so the relay would have
+to re-encode every delta for every viewer it dropped one for. Instead a
+delta leaves out its own sequence, which follows from its keyframe's, and
+names the keyframe by the low byte of its sequence. Run with:
+
+    python spectate.py relay [port]
+    python spectate.py load [viewers] [seconds] [port]
+
+load starts a relay and a bot match and connects viewers to it, a tenth
+of which only read once a second.
+"""
+import multiprocessing
+import random
+import selectors
+import socket
+import struct
+import sys
+import time
+from collections import deque
+
+from bots import ChaseBot
+from lockstep import unpack_controls
+from physics import Body, World, Simulation
+from poetry import get_all_poets
+from stats import percentiles
+
+RELAY_PORT = 5100
+BROADCAST_RATE = 30  # Snapshots published per second
+KEYFRAME_INTERVAL = 30  # Snapshots from one keyframe to the next
+QUEUE_SIZE = 8  # Snapshots queued for a viewer before stale ones drop
+SEND_BUFFER = 4096  # Small, so stale snapshots wait where they can drop
+RECV_BUFFER = 65536
+POS_SCALE = 8  # Quantization steps per pixel
+VEL_SCALE = 256  # Quantization steps per unit of velocity
+QUANT_LIMIT = 32767
+SLOW_VIEWERS = 10  # One in this many load test viewers reads slowly
+SLOW_RECV_BUFFER = 1024  # Their receive buffer, so the relay backs up
+SLOW_READ = 256  # Bytes they read a second, less than a feed sends
+
+# Roles, sent as the first byte of a connection
+PUBLISHER = 1
+VIEWER = 2
+
+# Message kinds
+INFO = 1  # The poets, host side first
+KEYFRAME = 2
+DELTA = 3
+
+ROLE = struct.Struct("!B")
+HEADER = struct.Struct("!HB")  # payload size, kind
+INFO_PAYLOAD = struct.Struct("!32s32s")
+KEYFRAME_PAYLOAD = struct.Struct("!IHHB")  # sequence, scores, bodies
+# keyframe sequence's low byte, how many snapshots back it is, bodies
+DELTA_PAYLOAD = struct.Struct("!BBB")
+BODY = struct.Struct("!4h")  # pos x, pos y, vel x, vel y
+MASK = struct.Struct("!B")  # Which of a body's fields a delta carries
+FIELD = struct.Struct("!h")
+
+
+def quantize(body):
+    """Returns body's pos and vel as a tuple of four short ints"""
+    values = [body.pos[0] * POS_SCALE, body.pos[1] * POS_SCALE,
+              body.vel[0] * VEL_SCALE, body.vel[1] * VEL_SCALE]
+    return tuple(max(-QUANT_LIMIT, min(QUANT_LIMIT, int(round(value))))
+                 for value in values)
+
+
+def dequantize(values):
+    """Returns the (pos, vel) of a quantized body"""
+    return ([values[0] / POS_SCALE, values[1] / POS_SCALE],
+            [values[2] / VEL_SCALE, values[3] / VEL_SCALE])
+
+
+def message(kind, payload):
+    return HEADER.pack(len(payload), kind) + payload
+
+
+def encode_info(poets):
+    return message(INFO, INFO_PAYLOAD.pack(*[poet.encode()[:32]
+                                             for poet in poets]))
+
+
+def encode_keyframe(sequence, scores, states):
+    payload = KEYFRAME_PAYLOAD.pack(sequence, *scores, len(states))
+    for values in states:
+        payload += BODY.pack(*values)
+    return message(KEYFRAME, payload)
+
+
+def encode_delta(sequence, keyframe, scores, states):
+    """Encodes states as the fields that changed since keyframe
+
+    :param keyframe: (sequence, scores, states) of the last keyframe, with
+        the same scores and as many bodies as states
+    """
+    payload = DELTA_PAYLOAD.pack(keyframe[0] & 0xFF, sequence - keyframe[0],
+                                 len(states))
+    for values, base in zip(states, keyframe[2]):
+        mask = 0
+        fields = b""
+        for i in range(0, len(values)):
+            if values[i] != base[i]:
+                mask |= 1 << i
+                fields += FIELD.pack(values[i])
+        payload += MASK.pack(mask) + fields
+    return message(DELTA, payload)
+
+
+def decode_snapshot(kind, payload, keyframe):
+    """Decodes a keyframe, or a delta against keyframe
+
+    :param keyframe: (sequence, scores, states) of the last keyframe
+    :return: (sequence, scores, states), or None for a delta against
+        some other keyframe
+    """
+    states = []
+    if kind == KEYFRAME:
+        sequence, host_score, join_score, count = \
+            KEYFRAME_PAYLOAD.unpack_from(payload)
+        offset = KEYFRAME_PAYLOAD.size
+        for i in range(0, count):
+            states.append(BODY.unpack_from(payload, offset))
+            offset += BODY.size
+        return sequence, (host_score, join_score), states
+
+    keyframe_byte, back, count = DELTA_PAYLOAD.unpack_from(payload)
+    offset = DELTA_PAYLOAD.size
+    if isinstance(keyframe, type(None)) or \
+            keyframe[0] & 0xFF != keyframe_byte:
+        return None
+    sequence = keyframe[0] + back
+    for i in range(0, count):
+        mask = MASK.unpack_from(payload, offset)[0]
+        offset += MASK.size
+        values = list(keyframe[2][i])
+        for field in range(0, len(values)):
+            if mask & (1 << field):
+                values[field] = FIELD.unpack_from(payload, offset)[0]
+                offset += FIELD.size
+        states.append(tuple(values))
+    return sequence, keyframe[1], states
+
+
+def take_messages(buffer):
+    """Removes and returns the whole (kind, payload) messages in buffer"""
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= HEADER.size:
+        size, kind = HEADER.unpack_from(buffer, offset)
+        end = offset + HEADER.size + size
+        if end > len(buffer):
+            break
+        messages.append((kind, bytes(buffer[offset + HEADER.size:end])))
+        offset = end
+    del buffer[:offset]
+    return messages
+
+
+class SpectatorFeed:
+    """Publishes a match's snapshots to a relay from the game loop
+
+    Sends never block. If the relay is not keeping up, snapshots are
+    skipped until it is, and the next one sent is a keyframe. So is any
+    snapshot where the scores or the number of bodies changed, as deltas
+    carry neither.
+    """
+
+    def __init__(self, sock, poets, rate=BROADCAST_RATE):
+        sock.sendall(ROLE.pack(PUBLISHER) + encode_info(poets))
+        sock.setblocking(False)
+        self.sock = sock
+        self.interval = 1 / rate
+        self.next_time = 0
+        self.sequence = 0
+        self.keyframe = None
+        self.pending = b""
+        self.size = 0  # Of the last snapshot
+        self.bytes_sent = 0
+        self.skipped = 0
+
+    def publish(self, bodies, scores, now=None):
+        """Sends a snapshot of bodies if one is due
+
+        :param scores: (host score, join score)
+        """
+        now = time.monotonic() if isinstance(now, type(None)) else now
+        if now < self.next_time:
+            return
+        self.next_time = max(self.next_time + self.interval, now)
+        if not self.flush():
+            self.skipped += 1
+            self.keyframe = None
+            return
+
+        self.sequence += 1
+        states = [quantize(body) for body in bodies]
+        keyframe = self.keyframe
+        if isinstance(keyframe, type(None)) or \
+                self.sequence - keyframe[0] >= KEYFRAME_INTERVAL or \
+                tuple(scores) != keyframe[1] or \
+                len(states) != len(keyframe[2]):
+            self.keyframe = (self.sequence, tuple(scores), states)
+            self.pending = encode_keyframe(self.sequence, scores, states)
+        else:
+            self.pending = encode_delta(self.sequence, keyframe, scores,
+                                        states)
+        self.size = len(self.pending)
+        self.flush()
+
+    def flush(self):
+        """Sends what it can of the last snapshot
+
+        :return: True if it has all been sent
+        """
+        if self.pending:
+            try:
+                sent = self.sock.send(self.pending)
+            except BlockingIOError:
+                sent = 0
+            self.bytes_sent += sent
+            self.pending = self.pending[sent:]
+        return not self.pending
+
+    def close(self):
+        self.sock.close()
+
+
+class Viewer:
+    """A relay's connection to one spectator, with its queue of messages"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.queue = deque()  # (kind, data) not yet started on
+        self.current = None  # What is left of the message being sent
+        self.dropped = 0
+
+    def push(self, kind, data):
+        if kind == KEYFRAME:
+            # Everything queued before a keyframe is stale
+            stale = [item for item in self.queue if item[0] != INFO]
+            self.dropped += len(stale)
+            self.queue = deque(item for item in self.queue
+                               if item[0] == INFO)
+        elif kind == DELTA and len(self.queue) >= QUEUE_SIZE:
+            for item in self.queue:
+                if item[0] == DELTA:
+                    self.queue.remove(item)
+                    break
+            else:
+                self.dropped += 1
+                return
+            self.dropped += 1
+        self.queue.append((kind, data))
+
+    def flush(self):
+        """Sends until the socket is full
+
+        :return: False if the spectator has gone
+        """
+        while self.current or self.queue:
+            if not self.current:
+                self.current = memoryview(self.queue.popleft()[1])
+            try:
+                sent = self.sock.send(self.current)
+            except BlockingIOError:
+                return True
+            except (ConnectionResetError, BrokenPipeError):
+                return False
+            self.current = self.current[sent:]
+        return True
+
+    def backlog(self):
+        return bool(self.current or self.queue)
+
+
+class Relay:
+    """Fans the snapshots of one publisher out to any number of viewers
+
+    Selector keys carry the function that handles them, as in server.py.
+    Each message is copied to every viewer as the bytes it arrived as. New
+    viewers are sent the poets and the last keyframe first.
+    """
+
+    def __init__(self, listener, drops=None):
+        self.selector = selectors.DefaultSelector()
+        self.info = None
+        self.keyframe = None
+        self.viewers = []
+        self.dropped = 0  # By viewers that have left
+        self.drops = drops  # Shared Value kept at the total dropped, or None
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ,
+                               lambda mask: self.accept(listener))
+
+    def accept(self, listener):
+        try:
+            connection, address = listener.accept()
+        except BlockingIOError:
+            return
+        connection.setblocking(False)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = bytearray()
+        self.selector.register(connection, selectors.EVENT_READ,
+                               lambda mask: self.handshake(connection, buffer))
+
+    def handshake(self, connection, buffer):
+        """Reads the role a new connection is taking"""
+        data = self.read(connection)
+        if not data:
+            return
+        buffer += data
+        role = buffer[0]
+        del buffer[:ROLE.size]
+        if role == PUBLISHER:
+            self.info = None
+            self.keyframe = None
+            self.selector.modify(connection, selectors.EVENT_READ,
+                                 lambda mask: self.publish(connection, buffer))
+            self.publish(connection, buffer, False)
+        elif role == VIEWER:
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                  SEND_BUFFER)
+            viewer = Viewer(connection)
+            self.viewers.append(viewer)
+            self.selector.modify(connection, selectors.EVENT_READ,
+                                 lambda mask: self.serve(viewer, mask))
+            for item in [self.info, self.keyframe]:
+                if item:
+                    viewer.push(*item)
+            self.send(viewer)
+        else:
+            self.close(connection)
+
+    def read(self, connection):
+        """Returns the data waiting on connection, closing it if it ended"""
+        try:
+            data = connection.recv(RECV_BUFFER)
+        except BlockingIOError:
+            return None
+        except ConnectionResetError:
+            data = b""
+        if not data:
+            self.close(connection)
+        return data
+
+    def publish(self, connection, buffer, read=True):
+        if read:
+            data = self.read(connection)
+            if not data:
+                return
+            buffer += data
+        for kind, payload in take_messages(buffer):
+            data = HEADER.pack(len(payload), kind) + payload
+            if kind == INFO:
+                self.info = (kind, data)
+            elif kind == KEYFRAME:
+                self.keyframe = (kind, data)
+            for viewer in self.viewers:
+                viewer.push(kind, data)
+        for viewer in list(self.viewers):
+            self.send(viewer)
+        if self.drops:
+            self.drops.value = self.total_dropped()
+
+    def total_dropped(self):
+        """Returns the messages dropped for every viewer there has been"""
+        return self.dropped + sum(viewer.dropped for viewer in self.viewers)
+
+    def serve(self, viewer, mask):
+        if mask & selectors.EVENT_READ and self.read(viewer.sock) == b"":
+            return  # Viewers send nothing, so it left
+        if mask & selectors.EVENT_WRITE:
+            self.send(viewer)
+
+    def send(self, viewer):
+        """Flushes viewer, waiting for it to be writable if it falls behind"""
+        if viewer not in self.viewers:
+            return
+        if not viewer.flush():
+            self.close(viewer.sock)
+            return
+        events = selectors.EVENT_READ
+        if viewer.backlog():
+            events |= selectors.EVENT_WRITE
+        if self.selector.get_key(viewer.sock).events != events:
+            self.selector.modify(viewer.sock, events,
+                                 lambda mask: self.serve(viewer, mask))
+
+    def close(self, connection):
+        self.selector.unregister(connection)
+        connection.close()
+        self.dropped += sum(viewer.dropped for viewer in self.viewers
+                            if viewer.sock is connection)
+        self.viewers = [viewer for viewer in self.viewers
+                        if viewer.sock is not connection]
+
+    def serve_forever(self):
+        while True:
+            for key, mask in self.selector.select():
+                key.data(mask)
+
+
+class Spectator:
+    """Watches a match through a relay, keeping the latest snapshot"""
+
+    def __init__(self, sock):
+        sock.sendall(ROLE.pack(VIEWER))
+        self.sock = sock
+        self.buffer = bytearray()
+        self.poets = None
+        self.keyframe = None
+        self.sequence = 0
+        self.scores = (0, 0)
+        self.states = []
+        self.snapshots = 0
+        self.bytes_received = 0
+
+    def receive(self, size=RECV_BUFFER):
+        """Reads and applies up to size bytes of what has arrived
+
+        :return: False if the relay closed the connection
+        """
+        try:
+            data = self.sock.recv(size)
+        except BlockingIOError:
+            return True
+        except ConnectionResetError:
+            data = b""
+        if not data:
+            return False
+        self.bytes_received += len(data)
+        self.buffer += data
+        for kind, payload in take_messages(self.buffer):
+            if kind == INFO:
+                self.poets = [name.rstrip(b"\0").decode() for name in
+                              INFO_PAYLOAD.unpack(payload)]
+                continue
+            snapshot = decode_snapshot(kind, payload, self.keyframe)
+            if isinstance(snapshot, type(None)):
+                continue
+            self.sequence, self.scores, self.states = snapshot
+            if kind == KEYFRAME:
+                self.keyframe = snapshot
+            self.snapshots += 1
+        return True
+
+    def bodies(self):
+        """Returns the (pos, vel) of each body in the latest snapshot"""
+        return [dequantize(values) for values in self.states]
+
+
+def listen(port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("", port))
+    listener.listen(socket.SOMAXCONN)
+    return listener
+
+
+def relay(port=RELAY_PORT, drops=None):
+    """Runs a relay
+
+    :param drops: multiprocessing.Value to keep at the messages dropped
+    """
+    print("Relaying on port " + str(port))
+    Relay(listen(port), drops).serve_forever()
+
+
+def connect(port, attempts=50, recv_buffer=None):
+    """Connects to a relay on this machine, waiting for it to start
+
+    :param recv_buffer: Size of the socket's receive buffer. The system's
+        if None
+    """
+    for i in range(0, attempts):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if recv_buffer:
+            # Before connecting, so the window is never offered bigger
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer)
+        try:
+            sock.connect(("127.0.0.1", port))
+            return sock
+        except ConnectionRefusedError:
+            sock.close()
+            time.sleep(.1)
+    raise Exception("Could not connect to the relay")
+
+
+def load(viewers=200, seconds=10, port=RELAY_PORT):
+    """Plays a bot match to a relay in another process and watches it
+    through viewers connections, then reports what they saw"""
+    drops = multiprocessing.Value("i", 0)
+    process = multiprocessing.Process(target=relay, args=(port, drops),
+                                      daemon=True)
+    process.start()
+
+    rng = random.Random(1)
+    poets = rng.sample(get_all_poets(), 2)
+    world = World([1600, 900])
+    bodies = [Body(poet) for poet in poets]
+    for body in bodies:
+        world.add(body)
+    bodies[0].reset(True)
+    bodies[1].reset(False)
+    simulation = Simulation(world)
+    bots = [ChaseBot(random.Random(i)) for i in range(0, 2)]
+    scores = [0, 0]
+    feed = SpectatorFeed(connect(port), poets)
+
+    selector = selectors.DefaultSelector()
+    spectators = []
+    slow = []
+    for i in range(0, viewers):
+        if i % SLOW_VIEWERS == SLOW_VIEWERS - 1:
+            spectator = Spectator(connect(port, recv_buffer=SLOW_RECV_BUFFER))
+            spectator.sock.setblocking(False)
+            slow.append(spectator)
+        else:
+            spectator = Spectator(connect(port))
+            spectator.sock.setblocking(False)
+            selector.register(spectator.sock, selectors.EVENT_READ, spectator)
+            spectators.append(spectator)
+
+    sent_times = {}
+    published = []
+    latencies = []
+    sizes = {KEYFRAME: [], DELTA: []}
+    start = time.perf_counter()
+    last = start
+    slow_time = start
+    while last - start < seconds:
+        for key, mask in selector.select(.001):
+            spectator = key.data
+            sequence = spectator.sequence
+            spectator.receive()
+            if spectator.sequence != sequence:
+                latencies.append(time.perf_counter() -
+                                 sent_times[spectator.sequence])
+
+        now = time.perf_counter()
+        for i in range(0, 2):
+            bodies[i].set_controls(*unpack_controls(
+                bots[i].controls(bodies[i], bodies[1 - i])))
+        for winner, loser in simulation.advance(now - last):
+            scores[bodies.index(winner)] += 1
+            bodies[0].reset(True)
+            bodies[1].reset(False)
+            break
+        last = now
+
+        sequence = feed.sequence
+        feed.publish(world.bodies, scores, now)
+        if feed.sequence != sequence:
+            sent_times[feed.sequence] = time.perf_counter()
+            published = [quantize(body) for body in world.bodies]
+            sizes[KEYFRAME if feed.keyframe[0] == feed.sequence
+                  else DELTA].append(feed.size)
+        if now - slow_time >= 1:
+            for spectator in slow:
+                spectator.receive(SLOW_READ)
+            slow_time = now
+    elapsed = time.perf_counter() - start
+
+    # Let everything sent arrive before checking it
+    for k in range(0, 10):
+        time.sleep(.05)
+        for spectator in spectators + slow:
+            spectator.receive()
+    in_sync = sum(1 for spectator in spectators + slow
+                  if spectator.states == published and
+                  spectator.sequence == feed.sequence)
+    fast = [spectator.snapshots for spectator in spectators]
+    slowest = [spectator.snapshots for spectator in slow]
+    latency = percentiles(latencies)
+    received = sum(spectator.bytes_received
+                   for spectator in spectators + slow)
+    print("viewers".ljust(24) + str(viewers).rjust(12))
+    print("published".ljust(24) + str(feed.sequence).rjust(12))
+    print("skipped".ljust(24) + str(feed.skipped).rjust(12))
+    print("keyframe bytes".ljust(24) + str(round(
+        sum(sizes[KEYFRAME]) / max(len(sizes[KEYFRAME]), 1), 1)).rjust(12))
+    print("delta bytes".ljust(24) + str(round(
+        sum(sizes[DELTA]) / max(len(sizes[DELTA]), 1), 1)).rjust(12))
+    print("publisher bytes/s".ljust(24) + str(int(
+        feed.bytes_sent / elapsed)).rjust(12))
+    print("relay bytes/s".ljust(24) + str(int(received / elapsed)).rjust(12))
+    print("fast viewer snapshots".ljust(24) + str(int(
+        sum(fast) / max(len(fast), 1))).rjust(12))
+    print("slow viewer snapshots".ljust(24) + str(int(
+        sum(slowest) / max(len(slowest), 1))).rjust(12))
+    print("relay dropped".ljust(24) + str(drops.value).rjust(12))
+    print("latency p50 ms".ljust(24) + str(round(latency[0] * 1000, 2)
+                                            ).rjust(12))
+    print("latency p95 ms".ljust(24) + str(round(latency[1] * 1000, 2)
+                                            ).rjust(12))
+    print("in sync at end".ljust(24) + (str(in_sync) + "/" + str(
+        viewers)).rjust(12))
+    process.terminate()
+
+
+def main(mode="relay", *args):
+    if mode == "relay":
+        relay(*[int(arg) for arg in args[:1]])
+    elif mode == "load":
+        load(*[int(arg) for arg in args[:3]])
+    else:
+        raise Exception("Mode: " + mode + " does not exist. Choose relay or "
+                        "load")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:5])
@@ -0,0 +1,176 @@
+import random
+from collections import OrderedDict
+
+import pygame
+
+from assets import asset_manager
+
+CACHE_SIZE = 32
+PORTRAIT_SCALE = 1.3
+GAS_COLOR = (25, 100, 25)
+COLOR_KEY = (255, 0, 255)  # Transparent in composed sprites
+GAS_SPRITES = 16  # Gas clouds pre-drawn per radius, one is shown per frame
+FONT_NAME = "monospace"
+TEXT_CACHE_SIZE = 64
+
+
+def blank(size):
+    """Returns a transparent surface for composing a sprite on
+
+    Sprites are drawn without antialiasing, so an RLE colour key gives the
+    same picture as per pixel alpha and blits several times faster.
+    """
+    image = pygame.Surface([size, size])
+    image.fill(COLOR_KEY)
+    image.set_colorkey(COLOR_KEY, pygame.RLEACCEL)
+    return image
+
+
+def finish(image):
+    if pygame.display.get_surface() is not None:
+        return image.convert()
+    return image
+
+
+class SpriteCache:
+    """LRU cache of scaled poet portraits keyed by (poet, radius, flipped)
+
+    Portraits come from the asset manager once per poet and every scaled
+    copy is converted to the display pixel format, so a cache hit is a
+    dict lookup.
+    Whole player sprites and gas clouds are kept in the same cache, so they
+    are only drawn again when a resize changes the radius.
+    """
+
+    def __init__(self, size=CACHE_SIZE, assets=asset_manager):
+        self.size = size
+        self.assets = assets
+        self.sources = {}
+        self.sprites = OrderedDict()
+
+    def get_source(self, poet):
+        """Returns the decoded, unscaled portrait for poet"""
+        poet = poet.lower()
+        if poet not in self.sources:
+            self.sources[poet] = self.assets.portrait(poet)
+        return self.sources[poet]
+
+    def get(self, poet, radius, flipped=False):
+        """Returns the portrait for poet sized for a ball of radius"""
+        key = (poet.lower(), radius, flipped)
+        image = self.lookup(key)
+        if not isinstance(image, type(None)):
+            return image
+
+        size = int(radius * PORTRAIT_SCALE)
+        atlas = self.assets.get_atlas()
+        if flipped:
+            image = pygame.transform.flip(self.get(poet, radius), True, False)
+        elif atlas and atlas.has(poet):
+            # Already in the display's format
+            image = atlas.portrait(poet, size)
+        else:
+            image = finish(pygame.transform.scale(self.get_source(poet),
+                                                  [size, size]))
+        return self.add(key, image)
+
+    def add(self, key, image):
+        self.sprites[key] = image
+        while len(self.sprites) > self.size:
+            self.sprites.popitem(last=False)
+        return image
+
+    def lookup(self, key):
+        """Returns the cached sprite for key, or None"""
+        if key not in self.sprites:
+            return None
+        self.sprites.move_to_end(key)
+        return self.sprites[key]
+
+    def get_player(self, poet, radius, flipped, color, era_color):
+        """Returns a player's ball, portrait and rings as one sprite
+
+        The sprite is 2 * radius + 3 pixels wide, centred on the ball.
+        """
+        key = ("player", poet.lower(), radius, flipped, color, era_color)
+        image = self.lookup(key)
+        if not isinstance(image, type(None)):
+            return image
+
+        size = 2 * radius + 3
+        center = radius + 1
+        image = blank(size)
+        pygame.draw.circle(image, color, [center, center], radius)
+        corner = int(center - radius // 1.5)
+        image.blit(self.get(poet, radius, flipped), [corner, corner])
+        for width, ring_color in [(radius // 3, color),
+                                  (radius // 8, era_color)]:
+            for offset in [0, 1, -1]:
+                pygame.draw.circle(image, ring_color, [center + offset] * 2,
+                                   radius, width)
+        return self.add(key, finish(image))
+
+    def get_gas(self, radius):
+        """Returns GAS_SPRITES different gas clouds for a ball of radius
+
+        Each is 10 * radius + 1 pixels wide, centred on the ball.
+        """
+        key = ("gas", radius)
+        pool = self.lookup(key)
+        if not isinstance(pool, type(None)):
+            return pool
+
+        size = 10 * radius + 1
+        center = 5 * radius
+        pool = []
+        for i in range(0, GAS_SPRITES):
+            image = blank(size)
+            for k in range(0, random.randint(1, 10)):
+                pygame.draw.circle(
+                    image, GAS_COLOR,
+                    [center + random.randint(-radius, radius),
+                     center + random.randint(-radius, radius)],
+                    random.randint(0, radius * 4))
+            pool.append(finish(image))
+        return self.add(key, pool)
+
+    def clear(self):
+        self.sprites.clear()
+
+
+class TextCache:
+    """LRU cache of rendered text keyed by (text, size, color)
+
+    Fonts are looked up and loaded once per size, and a label is only
+    rendered again when its text changes.
+    """
+
+    def __init__(self, name=FONT_NAME, size=TEXT_CACHE_SIZE):
+        self.name = name
+        self.size = size
+        self.fonts = {}
+        self.labels = OrderedDict()
+
+    def font(self, size):
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.SysFont(self.name, size)
+        return self.fonts[size]
+
+    def get(self, text, size, color):
+        """Returns text rendered antialiased at size in color"""
+        key = (text, size, color)
+        if key in self.labels:
+            self.labels.move_to_end(key)
+            return self.labels[key]
+
+        label = self.font(size).render(text, 1, color)
+        if pygame.display.get_surface() is not None:
+            label = label.convert_alpha()
+        self.labels[key] = label
+        while len(self.labels) > self.size:
+            self.labels.popitem(last=False)
+        return label
+
+
+sprite_cache = SpriteCache()
+text_cache = TextCache()
@@ -0,0 +1,157 @@
+"""Frame and network timings for the performance overlay and exports
+
+Nothing here needs pygame, so a headless server or a benchmark can keep
+the same numbers as the game.
+"""
+import csv
+import json
+import time
+from collections import deque
+
+WINDOW = 600  # Frames, or pings, kept for the rolling figures
+SECTIONS = ["input", "network", "physics", "collision", "render", "flip"]
+
+PING_INTERVAL = .25
+PING_TIMEOUT = 1  # Seconds before an unanswered ping counts as lost
+JITTER_GAIN = 1 / 16  # As RFC 3550 smooths interarrival jitter
+
+
+def percentiles(values):
+    """Returns the (median, 95th percentile, max) of values"""
+    values = sorted(values)
+    if not values:
+        return 0, 0, 0
+    return (values[len(values) // 2], values[int(len(values) * .95)],
+            values[-1])
+
+
+class FrameStats:
+    """Times each section of every frame
+
+    begin() starts a frame, lap(name) charges the time since the last lap
+    to name, and end() files the frame away. Only the last WINDOW frames
+    are kept.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.frames = deque(maxlen=window)
+        self.current = None
+        self.lap_time = 0
+
+    def begin(self, secs):
+        """Starts a frame that came secs after the one before"""
+        self.current = {"time": time.time(), "frame": secs * 1000}
+        self.lap_time = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.current[name] = self.current.get(name, 0) + \
+            (now - self.lap_time) * 1000
+        self.lap_time = now
+
+    def move(self, secs, source, name):
+        """Charges secs that were timed as part of source to name instead"""
+        self.current[source] -= secs * 1000
+        self.current[name] = self.current.get(name, 0) + secs * 1000
+
+    def end(self, net=None):
+        """Files the frame, with the network summary current at its end"""
+        if net:
+            self.current.update(net)
+        self.frames.append(self.current)
+
+    def summary(self):
+        """Returns {name: (median, p95, max)} in ms over the kept frames"""
+        frames = list(self.frames)
+        names = ["frame"] + [name for name in SECTIONS
+                             if any(name in frame for frame in frames)]
+        return {name: percentiles([frame.get(name, 0) for frame in frames])
+                for name in names}
+
+    def export(self, path):
+        """Writes the kept frames to path, as JSON if it ends in .json and
+        as CSV otherwise"""
+        frames = list(self.frames)
+        if path.endswith(".json"):
+            with open(path, "w") as file:
+                json.dump({"summary": self.summary(), "frames": frames}, file,
+                          indent=1)
+            return
+        columns = []
+        for frame in frames:
+            for name in frame:
+                if name not in columns:
+                    columns.append(name)
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, columns)
+            writer.writeheader()
+            writer.writerows(frames)
+
+
+class NetStats:
+    """Round trip time, jitter, loss and traffic of one connection
+
+    Fed from the network thread. The figures are worked out every update()
+    into a new summary dict that replaces the old one whole, so the game
+    thread can read summary without a lock.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.rtts = deque(maxlen=window)
+        self.answered = deque(maxlen=window)  # True or False for each ping
+        self.pending = {}
+        self.jitter = 0
+        self.counters = None
+        self.summary = {}
+
+    def ping_sent(self, stamp):
+        self.pending[stamp] = True
+
+    def pong(self, stamp, now):
+        """Times the answer to the ping sent at stamp
+
+        :return: The round trip in seconds, or None for a lost ping
+        """
+        if not self.pending.pop(stamp, None):
+            return None  # Answered after it was counted as lost
+        rtt = now - stamp
+        if self.rtts:
+            self.jitter += (abs(rtt - self.rtts[-1]) - self.jitter) * \
+                JITTER_GAIN
+        self.rtts.append(rtt)
+        self.answered.append(True)
+        return rtt
+
+    def update(self, now, transport, send_rate=None):
+        """Works out a new summary
+
+        :param send_rate: States per second currently sent, if adapted
+        """
+        for stamp in list(self.pending):
+            if now - stamp >= PING_TIMEOUT:
+                del self.pending[stamp]
+                self.answered.append(False)
+
+        counters = (now, transport.packets_sent, transport.packets_received,
+                    transport.bytes_sent, transport.bytes_received)
+        rates = [0, 0, 0, 0]
+        if self.counters and now > self.counters[0]:
+            rates = [(counters[i] - self.counters[i]) /
+                     (now - self.counters[0]) for i in range(1, 5)]
+        self.counters = counters
+
+        rtt, rtt_95, rtt_max = percentiles(self.rtts)
+        summary = {
+            "rtt": rtt * 1000,
+            "rtt p95": rtt_95 * 1000,
+            "jitter": self.jitter * 1000,
+            "loss": (1 - sum(self.answered) / len(self.answered)) * 100
+            if self.answered else 0,
+            "packets out/s": rates[0],
+            "packets in/s": rates[1],
+            "bytes out/s": rates[2],
+            "bytes in/s": rates[3],
+        }
+        if not isinstance(send_rate, type(None)):
+            summary["send rate"] = send_rate
+        self.summary = summary
@@ -0,0 +1,171 @@
+"""Self-play tournament between bots playing every pair of poets
+
+Each match is one round on a bare World at the fixed tick rate, with no
+display and no frame timing, ending when a head is landed or after
+MATCH_SECS as a draw. Every ordered pair of poets is one task for a
+multiprocessing pool, so each poet plays each other from both sides, and
+every task seeds its own generator so a tournament can be run again
+exactly. Run with:
+
+    python tournament.py [games] [workers] [bot] [matrix.csv]
+
+games is per side of each pairing, and bot one of bots.BOTS.
+"""
+import csv
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from bots import BOTS
+from lockstep import unpack_controls
+from physics import Body, World, RESOLUTION, TICK_RATE
+from poetry import get_all_poets
+
+GAMES = 100
+MATCH_SECS = 30  # Longest a match runs before it is called a draw
+FRAME_STEPS = TICK_RATE // 60  # Steps between bot decisions, as at 60 fps
+SEED = 1
+
+
+def play_match(poets, bots, rng):
+    """Plays one round between two bots
+
+    :param poets: (host poet, join poet)
+    :param bots: Bot classes for the host and join sides
+    :return: (index of the winning side or None for a draw, steps run)
+    """
+    world = World(RESOLUTION)
+    bodies = [Body(poet) for poet in poets]
+    for body in bodies:
+        world.add(body)
+    bodies[0].reset(True)
+    bodies[1].reset(False)
+    players = [bots[i](random.Random(rng.random())) for i in range(0, 2)]
+    step_secs = 1 / TICK_RATE
+    steps = 0
+    while steps < MATCH_SECS * TICK_RATE:
+        if not steps % FRAME_STEPS:
+            for i in range(0, 2):
+                bodies[i].set_controls(*unpack_controls(
+                    players[i].controls(bodies[i], bodies[1 - i])))
+        wins = world.step(step_secs)
+        steps += 1
+        if wins:
+            return bodies.index(wins[0][0]), steps
+        if len(world.bodies) < 2:
+            break  # One fell out of the arena
+    return None, steps
+
+
+def play_pairing(task):
+    """Plays games matches for one ordered pair of poets
+
+    :param task: (host poet, join poet, games, bot name, seed)
+    :return: (host poet, join poet, [host wins, join wins, draws], steps)
+    """
+    host, join, games, bot, seed = task
+    rng = random.Random(host + "/" + join + "/" + str(seed))
+    results = [0, 0, 0]
+    steps = 0
+    for k in range(0, games):
+        winner, match_steps = play_match((host, join), (BOTS[bot], BOTS[bot]),
+                                         rng)
+        results[2 if isinstance(winner, type(None)) else winner] += 1
+        steps += match_steps
+    return host, join, results, steps
+
+
+def run(poets, games=GAMES, workers=None, bot="chase", seed=SEED):
+    """Plays every ordered pair of different poets games times
+
+    :param workers: Processes in the pool. One per CPU if None
+    :return: ({poet: {opponent: [wins, losses, draws]}}, matches, steps)
+    """
+    tasks = [(host, join, games, bot, seed) for host in poets
+             for join in poets if host != join]
+    table = {poet: {opponent: [0, 0, 0] for opponent in poets
+                    if opponent != poet} for poet in poets}
+    matches = 0
+    steps = 0
+    with multiprocessing.Pool(workers) as pool:
+        for host, join, results, task_steps in pool.imap_unordered(
+                play_pairing, tasks):
+            for i in range(0, 3):
+                table[host][join][i] += results[i]
+            table[join][host][0] += results[1]
+            table[join][host][1] += results[0]
+            table[join][host][2] += results[2]
+            matches += sum(results)
+            steps += task_steps
+    return table, matches, steps
+
+
+def win_rate(record):
+    return record[0] / max(sum(record), 1)
+
+
+def write_matrix(path, poets, table):
+    """Writes each poet's win rate against each other to a CSV file"""
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["poet"] + [poet.title() for poet in poets])
+        for poet in poets:
+            writer.writerow([poet.title()] + [
+                "" if opponent == poet else round(
+                    win_rate(table[poet][opponent]), 4) for opponent in poets])
+
+
+def report(poets, table, matches, steps, elapsed):
+    """Prints the win rate matrix, the poets ranked and the throughput
+
+    Rows are numbered and columns are headed by the same numbers.
+    """
+    print("win rate of row against column (%)")
+    print(" " * 24 + "".join(str(j + 1).rjust(4)
+                             for j in range(0, len(poets))))
+    for i in range(0, len(poets)):
+        row = (str(i + 1) + " " + poets[i].title()).ljust(24)
+        for opponent in poets:
+            if opponent == poets[i]:
+                row += "-".rjust(4)
+            else:
+                row += str(int(round(win_rate(
+                    table[poets[i]][opponent]) * 100))).rjust(4)
+        print(row)
+
+    print()
+    totals = {poet: [sum(record[i] for record in table[poet].values())
+                     for i in range(0, 3)] for poet in poets}
+    print("poet".ljust(24) + "wins".rjust(8) + "losses".rjust(8) +
+          "draws".rjust(8) + "win %".rjust(8))
+    for poet in sorted(poets, key=lambda poet: -win_rate(totals[poet])):
+        print(poet.title().ljust(24) +
+              "".join(str(count).rjust(8) for count in totals[poet]) +
+              str(round(win_rate(totals[poet]) * 100, 1)).rjust(8))
+
+    print()
+    print("matches".ljust(24) + str(matches).rjust(12))
+    print("seconds".ljust(24) + str(round(elapsed, 2)).rjust(12))
+    print("matches/s".ljust(24) + str(round(matches / elapsed, 1)).rjust(12))
+    print("steps/s".ljust(24) + str(int(steps / elapsed)).rjust(12))
+
+
+def main(games=GAMES, workers=None, bot="chase", path=None):
+    if bot not in BOTS:
+        raise Exception("Bot: " + bot + " does not exist. Choose from " +
+                        ", ".join(BOTS))
+    poets = get_all_poets()
+    workers = workers if workers else os.cpu_count()
+    start = time.perf_counter()
+    table, matches, steps = run(poets, games, workers, bot)
+    elapsed = time.perf_counter() - start
+    report(poets, table, matches, steps, elapsed)
+    if path:
+        write_matrix(path, poets, table)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:5]
+    main(*[int(arg) for arg in args[:2]], *args[2:])